@@ -2,6 +2,9 @@ import requests
 import json
 import zipfile
 import io
+import time
+
+SERVER_URL = 'http://localhost:5000'
 
 def get_image_path():
     return input("Please enter the location of the image you want to modify: ")
@@ -63,18 +66,26 @@ def confirm_and_process(image_path, operations):
     confirmation = input("\nDo you want to proceed with these operations? (yes/no): ").lower()
     
     if confirmation == 'yes':
-        url = 'http://localhost:5000/process_image_sequence'
+        preview = input("Do you want a quick low-resolution preview first? (yes/no): ").lower() == 'yes'
+        url = SERVER_URL + '/process_image_sequence'
         operations_json = json.dumps(operations)
         
         with open(image_path, 'rb') as image_file:
             files = {'image': image_file}
             data = {'operations': operations_json}
+            if preview:
+                data['preview'] = 'true'
             response = requests.post(url, files=files, data=data)
             
             if response.status_code == 200:
-                zip_in_memory = io.BytesIO(response.content)
-                with zipfile.ZipFile(zip_in_memory) as zf:
-                    zf.extractall(path="./processed_images/")
+                # A preview comes with the URL of the full-resolution result
+                if 'X-Job-Url' in response.headers:
+                    save_zip(response.content, "./processed_images/preview/")
+                    print("The preview is saved in './processed_images/preview/'. Waiting for the full-resolution images...")
+                    response = wait_for_job(SERVER_URL + response.headers['X-Job-Url'])
+                    if response is None:
+                        return
+                save_zip(response.content, "./processed_images/")
                 print("The processed images are saved in './processed_images/'.")
             else:
                 print(f"Error: {response.status_code}")
@@ -82,6 +93,24 @@ def confirm_and_process(image_path, operations):
     else:
         print("Operation canceled.")
 
+def save_zip(content, path):
+    with zipfile.ZipFile(io.BytesIO(content)) as zf:
+        zf.extractall(path=path)
+
+
+# Poll a job until its ZIP is ready, returns the response or None if the job failed
+def wait_for_job(job_url):
+    while True:
+        response = requests.get(job_url)
+        if response.status_code == 200 and response.headers.get('Content-Type') == 'application/zip':
+            return response
+        if response.status_code != 202:
+            print(f"Error: {response.status_code}")
+            print(response.text)
+            return None
+        time.sleep(0.5)
+
+
 if __name__ == "__main__":
     image_path = get_image_path()
     operations = get_operations()
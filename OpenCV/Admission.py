@@ -0,0 +1,100 @@
+import threading
+import time
+
+from . import Metrics
+from .ProcessingService import PAGE_PARALLELISM
+
+# Channels counted at least per decoded pixel (JPEGs always decode to BGR, PNG and
+# TIFF keep their own channels and depth, which the header tells)
+DECODED_CHANNELS = 3
+
+
+# Refused before any decoding. status is 429 (queue full) or 503 (waited too long),
+# retry_after is the number of seconds to put in the Retry-After header.
+class AdmissionRejected(Exception):
+    def __init__(self, message, status, retry_after):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+# Rough working set of one request from the header alone: the decoded frame at the
+# largest size the op list reaches (resizes above 100% grow it), once for the
+# source and once per operation, times the pages of a TIFF processed at once.
+def estimate_working_set(header, operations):
+    if not header.width or not header.height:
+        return 0
+    channels = max(DECODED_CHANNELS, header.channels or DECODED_CHANNELS)
+    bytes_per_sample = 2 if (header.bit_depth or 8) > 8 else 1
+    frame_bytes = header.width * header.height * channels * bytes_per_sample
+
+    scale = 1.0
+    peak_scale = 1.0
+    for op in operations:
+        if op.get('operation') == 'resize':
+            scale *= max(op.get('percentage', 100), 1) / 100
+            peak_scale = max(peak_scale, scale)
+    pages = min(header.pages, PAGE_PARALLELISM)
+    return int(frame_bytes * peak_scale * peak_scale * (len(operations) + 1) * pages)
+
+
+# Concurrency limiter sized in bytes rather than requests. A request runs once its
+# estimated working set fits in what is left of the budget, up to max_waiting
+# requests wait (in arrival order) for room, anything beyond that is refused at once.
+class AdmissionController:
+    def __init__(self, budget_bytes, max_waiting, wait_timeout, retry_after):
+        self.budget_bytes = budget_bytes
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+        self.retry_after = retry_after
+        self.condition = threading.Condition()
+        self.in_use = 0
+        self.running = 0
+        self.waiting = []  # Tickets in arrival order
+
+    # Returns a ticket for release(). queue=False skips the waiting-room limit
+    # (for batch images, whose parallelism is already bounded by the batch).
+    def acquire(self, cost, queue=True):
+        with self.condition:
+            if self._fits(cost) and not self.waiting:
+                return self._admit(cost)
+
+            if queue and len(self.waiting) >= self.max_waiting:
+                Metrics.ADMISSION_REJECTED.inc(reason='queue_full')
+                raise AdmissionRejected("Server is busy, too many requests are waiting.", 429, self.retry_after)
+
+            ticket = object()
+            self.waiting.append(ticket)
+            deadline = time.monotonic() + self.wait_timeout if queue else None
+            try:
+                # First in line only, so a big request can't be starved by small ones
+                while not (self.waiting[0] is ticket and self._fits(cost)):
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        Metrics.ADMISSION_REJECTED.inc(reason='timeout')
+                        raise AdmissionRejected("Server is busy, please retry shortly.", 503, self.retry_after)
+                    self.condition.wait(remaining)
+            finally:
+                self.waiting.remove(ticket)
+                self.condition.notify_all()
+            return self._admit(cost)
+
+    def release(self, cost):
+        with self.condition:
+            self.in_use -= cost
+            self.running -= 1
+            self.condition.notify_all()
+
+    def get_stats(self):
+        with self.condition:
+            return {'budget_bytes': self.budget_bytes, 'in_use_bytes': self.in_use,
+                    'running': self.running, 'waiting': len(self.waiting)}
+
+    # A request larger than the whole budget still runs, but only on its own
+    def _fits(self, cost):
+        return self.in_use + cost <= self.budget_bytes or self.running == 0
+
+    def _admit(self, cost):
+        self.in_use += cost
+        self.running += 1
+        return cost
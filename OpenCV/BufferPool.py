@@ -0,0 +1,74 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Idle bytes the shared pool may hold on to, per process
+FRAME_POOL_BYTES = int(os.environ.get('FRAME_POOL_BYTES', 256 * 1024 * 1024))
+
+
+# Reusable frame buffers keyed by (shape, dtype). Renders write into an array
+# taken from here instead of a fresh allocation, and hand it back once the output
+# is encoded, so steady traffic at the same sizes stops churning the allocator
+# (large numpy arrays are mmap'ed and unmapped by malloc on every request).
+# Idle buffers are bounded by bytes, the sizes released longest ago go first.
+class BufferPool:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.free = OrderedDict()  # (shape, dtype) -> idle arrays, least recently released first
+        self.free_bytes = 0
+        self.stats = {'hits': 0, 'misses': 0, 'released': 0, 'evictions': 0}
+
+    # An array of the given shape and dtype, zeroed when zero=True (letterbox canvases)
+    def acquire(self, shape, dtype=np.uint8, zero=False):
+        key = (tuple(shape), np.dtype(dtype).str)
+        array = None
+        with self.lock:
+            idle = self.free.get(key)
+            if idle:
+                array = idle.pop()
+                self.free_bytes -= array.nbytes
+                if not idle:
+                    del self.free[key]
+                self.stats['hits'] += 1
+            else:
+                self.stats['misses'] += 1
+
+        if array is None:
+            return np.zeros(shape, dtype=dtype) if zero else np.empty(shape, dtype=dtype)
+        if zero:
+            array.fill(0)
+        return array
+
+    # Give an array back. Only whole arrays the caller owns outright belong here:
+    # views and memory-mapped frames are ignored.
+    def release(self, array):
+        if array is None or isinstance(array, np.memmap) or not array.flags.owndata:
+            return
+        if array.nbytes > self.max_bytes:
+            return
+        key = (array.shape, array.dtype.str)
+        with self.lock:
+            while self.free and self.free_bytes + array.nbytes > self.max_bytes:
+                oldest_key = next(iter(self.free))
+                idle = self.free[oldest_key]
+                evicted = idle.pop(0)
+                if not idle:
+                    del self.free[oldest_key]
+                self.free_bytes -= evicted.nbytes
+                self.stats['evictions'] += 1
+            self.free.setdefault(key, []).append(array)
+            self.free.move_to_end(key)
+            self.free_bytes += array.nbytes
+            self.stats['released'] += 1
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats, idle_bytes=self.free_bytes,
+                        idle_buffers=sum(len(idle) for idle in self.free.values()))
+
+
+# Shared by every request in this process (worker processes get their own)
+frame_pool = BufferPool(FRAME_POOL_BYTES)
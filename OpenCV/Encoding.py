@@ -0,0 +1,188 @@
+import os
+import time
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, Future
+
+import cv2
+import numpy as np
+
+from . import Metrics
+
+# Output formats the encoder accepts (name -> file extension). AVIF depends on
+# how OpenCV was built, so it is only offered when there is a writer for it.
+ENCODE_FORMATS = {'jpeg': 'jpeg', 'jpg': 'jpeg', 'png': 'png', 'tiff': 'tiff', 'webp': 'webp'}
+if cv2.haveImageWriter('.avif'):
+    ENCODE_FORMATS['avif'] = 'avif'
+
+# Formats that store 16 bit samples, 16 bit frames keep their high byte for the rest
+SIXTEEN_BIT_FORMATS = {'png', 'tiff'}
+
+PNG_STRATEGIES = {
+    'default': cv2.IMWRITE_PNG_STRATEGY_DEFAULT,
+    'filtered': cv2.IMWRITE_PNG_STRATEGY_FILTERED,
+    'huffman': cv2.IMWRITE_PNG_STRATEGY_HUFFMAN_ONLY,
+    'rle': cv2.IMWRITE_PNG_STRATEGY_RLE,
+    'fixed': cv2.IMWRITE_PNG_STRATEGY_FIXED,
+}
+
+# Lossless JPEG transforms for flip / quarter-turn-only requests: 'auto' uses
+# jpegtran when it is installed, 'exif' only rewrites the EXIF orientation tag,
+# 'off' always decodes and re-encodes
+LOSSLESS_MODES = ['auto', 'exif', 'off']
+
+# Setting names, and the kinds of output that can get their own settings
+ENCODE_SETTINGS = ['format', 'quality', 'png_compression', 'png_strategy', 'progressive', 'optimize']
+OUTPUT_KINDS = ['final', 'thumbnail', 'renditions']
+
+# 'default' leaves every codec at OpenCV's defaults (lossless WebP included).
+# 'fast' trades size for latency: lower JPEG quality without the extra Huffman
+# pass, zlib level 1 with run-length matching for PNG, lossy WebP, uncompressed
+# TIFF and the fastest AVIF speed.
+ENCODE_PROFILES = {
+    'default': {},
+    'fast': {'quality': 85, 'png_compression': 1, 'png_strategy': 'rle', 'progressive': False,
+             'optimize': False, 'webp_quality': 80, 'avif_speed': 10, 'tiff_compression': 'none'},
+}
+
+# Encoders running at the same time per process. cv2.imencode releases the GIL,
+# so the final image and the thumbnails of one request are encoded in parallel.
+ENCODE_THREADS = int(os.environ.get('ENCODE_THREADS', min(4, os.cpu_count() or 1)))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+# Check the request's 'encoding' object and resolve it into one settings dict per
+# output kind (plus whether to add a report). Top-level settings apply to every
+# output, 'final' / 'thumbnail' / 'renditions' objects override them per kind.
+def normalize_encoding(spec):
+    if spec is None:
+        spec = {}
+    if not isinstance(spec, dict):
+        raise ValueError("Encoding must be a JSON object.")
+
+    unknown = set(spec) - set(ENCODE_SETTINGS) - set(OUTPUT_KINDS) - {'profile', 'report', 'lossless'}
+    if unknown:
+        raise ValueError(f"Unknown encoding settings: {', '.join(sorted(unknown))}.")
+
+    profile = spec.get('profile', 'default')
+    if profile not in ENCODE_PROFILES:
+        raise ValueError(f"Encoding profile must be one of: {', '.join(ENCODE_PROFILES)}.")
+
+    lossless = spec.get('lossless', 'auto')
+    if lossless not in LOSSLESS_MODES:
+        raise ValueError(f"Lossless mode must be one of: {', '.join(LOSSLESS_MODES)}.")
+
+    base = _normalize_settings({name: spec[name] for name in ENCODE_SETTINGS if name in spec})
+    resolved = {'profile': profile, 'report': bool(spec.get('report', False)), 'lossless': lossless}
+    for kind in OUTPUT_KINDS:
+        override = spec.get(kind, {})
+        if not isinstance(override, dict) or set(override) - set(ENCODE_SETTINGS):
+            raise ValueError(f"Encoding for '{kind}' must be an object with some of: {', '.join(ENCODE_SETTINGS)}.")
+        resolved[kind] = dict(base, **_normalize_settings(override))
+    return resolved
+
+
+def _normalize_settings(settings):
+    result = {}
+    if 'format' in settings:
+        image_format = ENCODE_FORMATS.get(str(settings['format']).lower())
+        if image_format is None:
+            raise ValueError(f"Encoding format must be one of: {', '.join(ENCODE_FORMATS)}.")
+        result['format'] = image_format
+    if 'quality' in settings:
+        quality = settings['quality']
+        if not isinstance(quality, int) or not 1 <= quality <= 100:
+            raise ValueError("Encoding quality must be an integer between 1 and 100.")
+        result['quality'] = quality
+    if 'png_compression' in settings:
+        level = settings['png_compression']
+        if not isinstance(level, int) or not 0 <= level <= 9:
+            raise ValueError("PNG compression must be an integer between 0 and 9.")
+        result['png_compression'] = level
+    if 'png_strategy' in settings:
+        if settings['png_strategy'] not in PNG_STRATEGIES:
+            raise ValueError(f"PNG strategy must be one of: {', '.join(PNG_STRATEGIES)}.")
+        result['png_strategy'] = settings['png_strategy']
+    for flag in ('progressive', 'optimize'):
+        if flag in settings:
+            if not isinstance(settings[flag], bool):
+                raise ValueError(f"Encoding '{flag}' must be true or false.")
+            result[flag] = settings[flag]
+    return result
+
+
+# imencode parameters for one output: the profile first, explicit settings on top
+def encode_params(extension, settings, profile='default'):
+    values = dict(ENCODE_PROFILES[profile], **settings)
+    params = []
+    if extension == 'jpeg':
+        if 'quality' in values:
+            params += [cv2.IMWRITE_JPEG_QUALITY, values['quality']]
+        if 'progressive' in values:
+            params += [cv2.IMWRITE_JPEG_PROGRESSIVE, int(values['progressive'])]
+        if 'optimize' in values:
+            params += [cv2.IMWRITE_JPEG_OPTIMIZE, int(values['optimize'])]
+    elif extension == 'png':
+        if 'png_compression' in values:
+            params += [cv2.IMWRITE_PNG_COMPRESSION, values['png_compression']]
+        if 'png_strategy' in values:
+            params += [cv2.IMWRITE_PNG_STRATEGY, PNG_STRATEGIES[values['png_strategy']]]
+    elif extension == 'webp':
+        # An explicit quality wins over the profile's
+        quality = settings.get('quality', values.get('webp_quality'))
+        if quality is not None:
+            params += [cv2.IMWRITE_WEBP_QUALITY, quality]
+    elif extension == 'avif':
+        if 'quality' in values:
+            params += [cv2.IMWRITE_AVIF_QUALITY, values['quality']]
+        if 'avif_speed' in values:
+            params += [cv2.IMWRITE_AVIF_SPEED, values['avif_speed']]
+    elif extension == 'tiff':
+        if values.get('tiff_compression') == 'none':
+            params += [cv2.IMWRITE_TIFF_COMPRESSION, cv2.IMWRITE_TIFF_COMPRESSION_NONE]
+    return params
+
+
+# Encode one image, returns (encoded, seconds spent encoding). encoded is imencode's
+# own buffer as a flat uint8 array, not copied into bytes: it supports len() and the
+# buffer protocol, so the ZIP writer reads it directly.
+def encode_image(image, extension, params=(), kind='final'):
+    start = time.perf_counter()
+    with Metrics.stage('encode'):
+        if image.dtype != np.uint8 and extension not in SIXTEEN_BIT_FORMATS:
+            image = cv2.convertScaleAbs(image, alpha=255 / 65535)
+        ok, buf = cv2.imencode(f'.{extension}', image, list(params))
+        if not ok:
+            raise ValueError(f"Could not encode the image as {extension}.")
+        encoded = buf.reshape(-1)
+    seconds = time.perf_counter() - start
+    Metrics.ENCODE_SECONDS.observe(seconds, format=extension)
+    Metrics.OUTPUT_BYTES.observe(len(encoded), kind=kind)
+    Metrics.BYTES_OUT.inc(len(encoded), kind=kind)
+    return encoded, seconds
+
+
+# Shared encoder threads, started on first use (worker processes get their own)
+def get_encode_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=ENCODE_THREADS, thread_name_prefix='encoder')
+    return _pool
+
+
+# Start encoding in the background, in a copy of the caller's context so the
+# timings still land in the request's metrics. Returns a future for encode_image
+# (already done when ENCODE_THREADS is 1 and the encode ran on this thread).
+def submit_encode(image, extension, params=(), kind='final'):
+    if ENCODE_THREADS <= 1:
+        future = Future()
+        try:
+            future.set_result(encode_image(image, extension, params, kind))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+    context = contextvars.copy_context()
+    return get_encode_pool().submit(context.run, encode_image, image, extension, params, kind)
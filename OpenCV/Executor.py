@@ -0,0 +1,218 @@
+import os
+import threading
+import contextvars
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from multiprocessing import shared_memory
+
+import cv2
+
+from . import Metrics
+from .ProcessingService import process_image_sequence, stream_image_sequence
+from .Warmup import warm_up
+
+
+# Raised when the pending-job queue is full, the route answers 503
+class ExecutorBusy(Exception):
+    pass
+
+
+# Raised when a job does not finish within its timeout, the route answers 504
+class ExecutorTimeout(Exception):
+    pass
+
+
+# Split the cores between workers so each one's OpenCV thread pool doesn't
+# fight the others for the same CPUs
+def default_cv2_threads(workers):
+    return max(1, (os.cpu_count() or 1) // max(1, workers))
+
+
+# Base class for the execution backends. Subclasses implement _submit and return a
+# concurrent.futures.Future, this class handles the bounded queue and timeouts.
+class ProcessingExecutor:
+    def __init__(self, max_pending):
+        # Running + queued jobs, anything over this is refused straight away
+        self.slots = threading.BoundedSemaphore(max_pending)
+
+    # block=True waits for a free slot instead of refusing (used by batch jobs)
+    def run(self, image_bytes, operations, timeout=None, block=False, encoding=None):
+        if not self.slots.acquire(blocking=block):
+            raise ExecutorBusy("Too many images are being processed, please retry shortly.")
+        try:
+            future = self._submit(image_bytes, operations, encoding)
+        except BaseException:
+            self.slots.release()
+            raise
+        # The slot is held until the job really ends, a timed out job still counts
+        future.add_done_callback(lambda _: self.slots.release())
+
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            # A job that already started keeps its worker until it finishes,
+            # a queued one is dropped
+            future.cancel()
+            raise ExecutorTimeout(f"Processing took longer than {timeout} seconds.")
+
+    # run() for callers that must answer within timeout whatever the backend
+    # (previews). Pooled backends honour it in run() already.
+    def run_within(self, image_bytes, operations, timeout, encoding=None):
+        return self.run(image_bytes, operations, timeout, encoding=encoding)
+
+    # Iterate over (filename, encoded) as they become available. Pooled
+    # backends hand back a whole result, so this is just run() for them.
+    def stream(self, image_bytes, operations, timeout=None, encoding=None):
+        return iter(self.run(image_bytes, operations, timeout, encoding=encoding))
+
+    def _submit(self, image_bytes, operations, encoding=None):
+        raise NotImplementedError
+
+    def shutdown(self):
+        pass
+
+
+# Run on the calling (request) thread, same as before the executor layer existed.
+# run_within is the exception: a job on the request thread can't be given up on,
+# so those run on a helper thread instead and a late one finishes in the
+# background (holding its slot) while the caller gets ExecutorTimeout.
+class InlineExecutor(ProcessingExecutor):
+    def __init__(self, max_pending=64, cv2_threads=None):
+        super().__init__(max_pending)
+        if cv2_threads is not None:
+            cv2.setNumThreads(cv2_threads)
+        # Threads only start when run_within needs them, the slots bound how many
+        self.helpers = ThreadPoolExecutor(max_workers=max_pending, thread_name_prefix='inline-timed')
+
+    def run_within(self, image_bytes, operations, timeout, encoding=None):
+        return ProcessingExecutor.run(self, image_bytes, operations, timeout, encoding=encoding)
+
+    def _submit(self, image_bytes, operations, encoding=None):
+        # Run in a copy of the caller's context so the job's timings reach the request
+        context = contextvars.copy_context()
+        return self.helpers.submit(context.run, process_image_sequence, image_bytes, operations, encoding)
+
+    def shutdown(self):
+        self.helpers.shutdown(wait=False, cancel_futures=True)
+
+    def run(self, image_bytes, operations, timeout=None, block=False, encoding=None):
+        # Nothing to interrupt, the timeout only applies to pooled backends
+        if not self.slots.acquire(blocking=block):
+            raise ExecutorBusy("Too many images are being processed, please retry shortly.")
+        try:
+            return process_image_sequence(image_bytes, operations, encoding)
+        finally:
+            self.slots.release()
+
+    # Outputs are yielded as soon as each one is encoded, the slot is held
+    # until the caller has consumed (or dropped) the generator
+    def stream(self, image_bytes, operations, timeout=None, encoding=None):
+        if not self.slots.acquire(blocking=False):
+            raise ExecutorBusy("Too many images are being processed, please retry shortly.")
+        try:
+            outputs = stream_image_sequence(image_bytes, operations, encoding)
+        except BaseException:
+            self.slots.release()
+            raise
+        return self._hold_slot(outputs)
+
+    def _hold_slot(self, outputs):
+        try:
+            yield from outputs
+        finally:
+            self.slots.release()
+
+
+# Threads in this process. OpenCV releases the GIL inside its kernels, but the
+# cv2 thread count is process wide so it is pinned once for all workers.
+class ThreadPoolBackend(ProcessingExecutor):
+    def __init__(self, workers, max_queue, cv2_threads=None):
+        super().__init__(workers + max_queue)
+        cv2.setNumThreads(cv2_threads if cv2_threads is not None else default_cv2_threads(workers))
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='image-worker')
+
+    def _submit(self, image_bytes, operations, encoding=None):
+        # Run in a copy of the caller's context so the job's timings reach the request
+        context = contextvars.copy_context()
+        return self.pool.submit(context.run, process_image_sequence, image_bytes, operations, encoding)
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+# Worker process setup: pin OpenCV's threads and run synthetic images through the
+# pipeline so the first real job doesn't pay for lazy initialisation
+def _init_worker(cv2_threads):
+    cv2.setNumThreads(cv2_threads)
+    warm_up()
+
+
+def _worker_pid():
+    return os.getpid()
+
+
+# Runs inside the worker: the upload is read from shared memory instead of being
+# pickled through the pool's pipe. The worker's metric observations go back with
+# the result so the parent can record them.
+def _process_shared(shm_name, size, operations, encoding=None):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    observations, token = Metrics.start_collecting()
+    try:
+        view = shm.buf[:size]
+        try:
+            return process_image_sequence(view, operations, encoding), observations
+        finally:
+            view.release()
+    finally:
+        Metrics.stop_collecting(token)
+        shm.close()
+
+
+# Separate worker processes, started and warmed up front. Image bytes are
+# handed over through a shared memory block that the parent owns and unlinks.
+class ProcessPoolBackend(ProcessingExecutor):
+    def __init__(self, workers, max_queue, cv2_threads=None):
+        super().__init__(workers + max_queue)
+        if cv2_threads is None:
+            cv2_threads = default_cv2_threads(workers)
+        # spawn: forking a threaded Flask process is not safe
+        context = multiprocessing.get_context('spawn')
+        self.pool = ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                        initializer=_init_worker, initargs=(cv2_threads,))
+        # Start every worker now rather than on the first requests
+        for future in [self.pool.submit(_worker_pid) for _ in range(workers)]:
+            future.result()
+
+    def run(self, image_bytes, operations, timeout=None, block=False, encoding=None):
+        processed_images, observations = super().run(image_bytes, operations, timeout, block, encoding)
+        Metrics.replay(observations)
+        return processed_images
+
+    def _submit(self, image_bytes, operations, encoding=None):
+        size = len(image_bytes)
+        shm = shared_memory.SharedMemory(create=True, size=max(1, size))
+        shm.buf[:size] = image_bytes
+        future = self.pool.submit(_process_shared, shm.name, size, operations, encoding)
+
+        # Free the block once the worker is done with it (or the job is dropped)
+        def release(_):
+            shm.close()
+            shm.unlink()
+        future.add_done_callback(release)
+        return future
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+# Build the backend named in the configuration: 'inline', 'thread' or 'process'
+def create_executor(kind, workers=None, max_queue=16, cv2_threads=None):
+    workers = workers or os.cpu_count() or 1
+    if kind == 'inline':
+        return InlineExecutor(cv2_threads=cv2_threads)
+    if kind == 'thread':
+        return ThreadPoolBackend(workers, max_queue, cv2_threads)
+    if kind == 'process':
+        return ProcessPoolBackend(workers, max_queue, cv2_threads)
+    raise ValueError(f"Unknown executor type: {kind}. Use 'inline', 'thread' or 'process'.")
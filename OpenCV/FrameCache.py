@@ -0,0 +1,76 @@
+import os
+import threading
+
+# Bytes of decoded frames the cache may hold per process, 0 turns it off
+FRAME_CACHE_BYTES = int(os.environ.get('FRAME_CACHE_BYTES', 0))
+
+
+# Decoded source frames (and their grayscale conversion) shared between requests
+# for the same upload, so a client sending one image with several op lists pays
+# for the decode once. Every op list is planned into warps of the source, so the
+# decoded source (plus the hoisted grayscale) is the prefix all requests share.
+# Keys are (image digest, page, decode factor) plus 'gray' for the converted one.
+#
+# Eviction is GreedyDual-Size: an entry's priority is the cache's clock plus the
+# seconds it took to produce per megabyte held, raised again on every hit. The
+# entry with the lowest priority goes first and the clock moves up to it, so
+# frames that are cheap to redo for their size (PNGs, reduced JPEG decodes) leave
+# before expensive ones, and entries nobody asks for age out.
+# Cached frames are read-only, callers must not render into them.
+class FrameCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = {}  # key -> [frame, seconds, priority]
+        self.bytes = 0
+        self.clock = 0.0
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'saved_seconds': 0.0}
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            entry[2] = self.clock + _density(entry[0], entry[1])
+            self.stats['hits'] += 1
+            self.stats['saved_seconds'] += entry[1]
+            return entry[0]
+
+    # Store frame, which took seconds to produce. Returns the frame, read-only now.
+    def put(self, key, frame, seconds):
+        frame.flags.writeable = False
+        if frame.nbytes > self.max_bytes:
+            return frame
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[0].nbytes
+            while self.entries and self.bytes + frame.nbytes > self.max_bytes:
+                self._evict()
+            self.entries[key] = [frame, seconds, self.clock + _density(frame, seconds)]
+            self.bytes += frame.nbytes
+        return frame
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats, entries=len(self.entries), bytes=self.bytes, max_bytes=self.max_bytes)
+        stats['saved_seconds'] = round(stats['saved_seconds'], 3)
+        return stats
+
+    # Caller holds the lock
+    def _evict(self):
+        key = min(self.entries, key=lambda k: self.entries[k][2])
+        frame, _, priority = self.entries.pop(key)
+        self.bytes -= frame.nbytes
+        self.clock = priority
+        self.stats['evictions'] += 1
+
+
+# Seconds to rebuild per megabyte held
+def _density(frame, seconds):
+    return seconds * 1024 * 1024 / max(frame.nbytes, 1)
+
+
+# Shared by every request in this process (worker processes get their own)
+frame_cache = FrameCache(FRAME_CACHE_BYTES)
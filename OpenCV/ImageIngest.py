@@ -0,0 +1,214 @@
+import io
+import mmap
+import os
+import struct
+import numpy as np
+import cv2
+
+# Formats the API accepts
+SUPPORTED_FORMATS = ['JPEG', 'PNG', 'TIFF']
+
+# File extension used for the outputs of each format
+FORMAT_EXTENSIONS = {'JPEG': 'jpeg', 'PNG': 'png', 'TIFF': 'tiff'}
+
+# Scaled JPEG decodes OpenCV offers (libjpeg does the downscale inside the IDCT)
+REDUCED_COLOR_FLAGS = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+
+# PNG colour type -> channel count
+PNG_CHANNELS = {0: 1, 2: 3, 3: 3, 4: 2, 6: 4}
+
+# EXIF orientation tag in IFD0
+ORIENTATION_TAG = 0x0112
+
+# Pages counted in a TIFF before giving up (also guards against IFD loops)
+MAX_COUNTED_PAGES = 100000
+
+
+# What the file header says about the image, read without decoding any pixels
+class ImageHeader:
+    def __init__(self, image_format, width=None, height=None, channels=None, bit_depth=8, orientation=1, pages=1):
+        self.format = image_format  # 'JPEG', 'PNG', 'TIFF', another name, or None
+        self.width = width  # As stored, before the EXIF orientation is applied
+        self.height = height
+        self.channels = channels
+        self.bit_depth = bit_depth
+        self.orientation = orientation  # EXIF orientation, 1 to 8 (JPEG only)
+        self.pages = pages  # Pages in a multi-page TIFF, width/height are the first page's
+
+    @property
+    def extension(self):
+        return FORMAT_EXTENSIONS.get(self.format, 'jpg')
+
+
+# Identify the format from the magic bytes and read the dimensions from the header
+def sniff_image(data):
+    data = memoryview(data)
+    try:
+        if data[:8] == b'\x89PNG\r\n\x1a\n':
+            return _sniff_png(data)
+        if data[:3] == b'\xff\xd8\xff':
+            return _sniff_jpeg(data)
+        if data[:4] in (b'II*\x00', b'MM\x00*'):
+            return _sniff_tiff(data)
+    except (struct.error, IndexError, ValueError):
+        return ImageHeader(None)
+
+    # Recognised but unsupported, named for the error message
+    if data[:6] in (b'GIF87a', b'GIF89a'):
+        return ImageHeader('GIF')
+    if data[:2] == b'BM':
+        return ImageHeader('BMP')
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return ImageHeader('WEBP')
+    return ImageHeader(None)
+
+
+def _sniff_png(data):
+    # IHDR is always the first chunk
+    width, height, bit_depth, color_type = struct.unpack('>IIBB', data[16:26])
+    return ImageHeader('PNG', width, height, PNG_CHANNELS.get(color_type, 3), bit_depth)
+
+
+def _sniff_jpeg(data):
+    # Walk the marker segments until the start-of-frame
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            raise ValueError("Corrupt JPEG marker")
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        length = struct.unpack('>H', data[pos + 2:pos + 4])[0]
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            precision, height, width, channels = struct.unpack('>BHHB', data[pos + 4:pos + 10])
+            return ImageHeader('JPEG', width, height, channels, precision, jpeg_orientation(data))
+        pos += 2 + length
+    return ImageHeader('JPEG')
+
+
+# EXIF orientation of a JPEG, 1 (as stored) when there is no usable tag
+def jpeg_orientation(data):
+    try:
+        _, location = find_orientation_tag(data)
+    except (struct.error, IndexError):
+        return 1  # Broken metadata shouldn't reject an image that decodes fine
+    if location is None:
+        return 1
+    position, endian = location
+    orientation = struct.unpack(endian + 'H', data[position:position + 2])[0]
+    return orientation if 1 <= orientation <= 8 else 1
+
+
+# Looks for the orientation entry in a JPEG's Exif segment. Returns (whether
+# there is an Exif segment, (offset of the value, TIFF byte order) or None).
+def find_orientation_tag(data):
+    pos = 2
+    while pos + 4 <= len(data) and data[pos] == 0xFF:
+        marker = data[pos + 1]
+        if marker in (0xD9, 0xDA) or 0xC0 <= marker <= 0xCF:  # No metadata after these
+            break
+        length = struct.unpack('>H', data[pos + 2:pos + 4])[0]
+        if marker == 0xE1 and data[pos + 4:pos + 10] == b'Exif\x00\x00':
+            tiff = pos + 10
+            endian = '<' if data[tiff:tiff + 2] == b'II' else '>'
+            ifd = tiff + struct.unpack(endian + 'I', data[tiff + 4:tiff + 8])[0]
+            count = struct.unpack(endian + 'H', data[ifd:ifd + 2])[0]
+            for i in range(count):
+                entry = ifd + 2 + i * 12
+                if struct.unpack(endian + 'H', data[entry:entry + 2])[0] == ORIENTATION_TAG:
+                    return True, (entry + 8, endian)
+            return True, None
+        pos += 2 + length
+    return False, None
+
+
+def _sniff_tiff(data):
+    endian = '<' if data[:2] == b'II' else '>'
+    ifd_offset = struct.unpack(endian + 'I', data[4:8])[0]
+    count = struct.unpack(endian + 'H', data[ifd_offset:ifd_offset + 2])[0]
+    tags = {}
+    for i in range(count):
+        entry = ifd_offset + 2 + i * 12
+        tag, field_type, value_count = struct.unpack(endian + 'HHI', data[entry:entry + 8])
+        if field_type not in (3, 4):  # SHORT, LONG
+            continue
+        fmt, size = ('H', 2) if field_type == 3 else ('I', 4)
+        value_pos = entry + 8
+        if size * value_count > 4:
+            # Doesn't fit in the entry, the entry holds an offset (first value is enough)
+            value_pos = struct.unpack(endian + 'I', data[entry + 8:entry + 12])[0]
+        tags[tag] = struct.unpack(endian + fmt, data[value_pos:value_pos + size])[0]
+    # 256 width, 257 height, 258 bits per sample, 277 samples per pixel
+    return ImageHeader('TIFF', tags.get(256), tags.get(257), tags.get(277, 1), tags.get(258, 8),
+                       pages=_count_tiff_pages(data, endian, ifd_offset))
+
+
+# Follow the chain of IFDs (one per page) without reading any of them
+def _count_tiff_pages(data, endian, ifd_offset):
+    pages = 0
+    seen = set()
+    while ifd_offset and ifd_offset not in seen and pages < MAX_COUNTED_PAGES:
+        seen.add(ifd_offset)
+        pages += 1
+        count = struct.unpack(endian + 'H', data[ifd_offset:ifd_offset + 2])[0]
+        next_pos = ifd_offset + 2 + count * 12
+        if next_pos + 4 > len(data):
+            break
+        ifd_offset = struct.unpack(endian + 'I', data[next_pos:next_pos + 4])[0]
+    return max(pages, 1)
+
+
+# Largest scaled-decode factor that still gives every output at least one source
+# pixel per output pixel (the biggest scale in any planned matrix)
+def reduced_decode_factor(header, plan):
+    if header.format != 'JPEG':
+        return 1  # Other codecs decode at full size and resize afterwards, no saving
+    max_scale = max(np.linalg.svd(output.matrix[:, :2], compute_uv=False)[0] for output in plan)
+    for factor in (8, 4, 2):
+        if max_scale * factor <= 1:
+            return factor
+    return 1
+
+
+# The upload's bytes without copying them. Small uploads are in memory already
+# (getvalue shares the BytesIO's buffer), bigger ones were spooled to a temp file
+# and are memory-mapped read-only, so the kernel pages them in as they are read.
+# The mapping outlives the file and goes away with the last view of it.
+def upload_view(stream):
+    if isinstance(stream, io.BytesIO):
+        return memoryview(stream.getvalue())
+    try:
+        fileno = stream.fileno()
+        size = os.fstat(fileno).st_size
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return memoryview(stream.read())
+    if size == 0:
+        return memoryview(b'')
+    return memoryview(mmap.mmap(fileno, 0, access=mmap.ACCESS_READ))
+
+
+# Decode once, straight from the caller's buffer (np.frombuffer is a view, not a copy).
+# PNG and TIFF keep their depth and channels (1 gray, 3 BGR or 4 BGRA, 8 or 16 bit),
+# JPEG is always 8 bit and is read as BGR so imdecode applies its EXIF orientation.
+def decode_image(data, factor=1):
+    file_bytes = np.frombuffer(data, dtype=np.uint8)
+    if factor in REDUCED_COLOR_FLAGS:
+        flag = REDUCED_COLOR_FLAGS[factor]
+    elif bytes(data[:3]) == b'\xff\xd8\xff':
+        flag = cv2.IMREAD_COLOR
+    else:
+        flag = cv2.IMREAD_UNCHANGED
+    image = cv2.imdecode(file_bytes, flag)
+    if image is None:
+        raise ValueError("The image could not be decoded.")
+    return image
+
+
+# One page of a multi-page TIFF, depth and channels kept. Only that page is decoded,
+# libtiff skips to its directory.
+def decode_page(data, page):
+    ok, pages = cv2.imdecodemulti(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_UNCHANGED, None, (page, page + 1))
+    if not ok or not pages:
+        raise ValueError(f"Page {page + 1} of the image could not be decoded.")
+    return pages[0]
@@ -1,11 +1,26 @@
 import cv2
+import numpy as np
 from abc import ABC, abstractmethod
+from functools import lru_cache
+
+# Interpolation tiers for arbitrary-angle warps, fastest first. 'linear' is what
+# every warp used before the tier could be picked.
+INTERPOLATIONS = {
+    'nearest': cv2.INTER_NEAREST,
+    'linear': cv2.INTER_LINEAR,
+    'cubic': cv2.INTER_CUBIC,
+    'lanczos': cv2.INTER_LANCZOS4,
+}
 
 # Tried creating a base class for the image processor as to avoid code repetition
 # And also force requirements.
+# dst is an optional preallocated output array of the right shape and dtype (e.g.
+# from BufferPool), written into instead of allocating a new one. It can be the
+# input itself for the ops that work in place (flips).
 class ImageProcessor(ABC):
-    def __init__(self, image):
+    def __init__(self, image, dst=None):
         self.image = image
+        self.dst = dst
         
     @abstractmethod
     def process_image(self):
@@ -22,62 +37,217 @@ class ImageProcessor(ABC):
     
 
 class FlipProcessor(ImageProcessor):
-    def __init__(self, image, flip_code):
-        super().__init__(image)
+    def __init__(self, image, flip_code, dst=None):
+        super().__init__(image, dst)
         self.flip_code = flip_code  # 0 for vertical, 1 for horizontal, -1 for both
         
     def process_image(self):
-        self.image = cv2.flip(self.image, self.flip_code)
-        
-        print(f"Flipped image in {self.flip_code} direction")
+        self.image = cv2.flip(self.image, self.flip_code, dst=self.dst)
         return self
 
-# Rotate Operation
+# cv2.rotate code for each right angle (clockwise degrees), 0 is a no-op
+RIGHT_ANGLE_ROTATIONS = {90: cv2.ROTATE_90_CLOCKWISE, 180: cv2.ROTATE_180, 270: cv2.ROTATE_90_COUNTERCLOCKWISE}
+
+
+# Rotation matrix (2x3, as nested tuples) and output bounds for a w x h frame
+# rotated by angle degrees clockwise with no clipping. Cached, the same sizes and
+# angles come back request after request.
+@lru_cache(maxsize=1024)
+def rotation_bounds(angle, w, h):
+    center = (w // 2, h // 2)
+
+    # Calculate the rotation matrix
+    M = cv2.getRotationMatrix2D(center, -angle, 1.0)
+
+    # Perform the rotation with no clipping
+    abs_cos = abs(M[0, 0])
+    abs_sin = abs(M[0, 1])
+
+    # Find the new width and height bounds
+    bound_w = int(h * abs_sin + w * abs_cos)
+    bound_h = int(h * abs_cos + w * abs_sin)
+
+    # Adjust the rotation matrix to the new bounds
+    M[0, 2] += bound_w / 2 - center[0]
+    M[1, 2] += bound_h / 2 - center[1]
+    return tuple(map(tuple, M)), bound_w, bound_h
+
+
+# Rotate Operation. The angle is reduced mod 360 first: right angles are exact
+# pixel permutations (cv2.rotate), anything else is one warp with the chosen
+# interpolation tier.
 class RotateProcessor(ImageProcessor):
-    def __init__(self, image, angle):
-        super().__init__(image)
-        self.angle = angle  
-        
-    def process_image(self):
-        (h, w) = self.image.shape[:2]
-        center = (w // 2, h // 2)
-        
-        # Calculate the rotation matrix
-        M = cv2.getRotationMatrix2D(center, -self.angle, 1.0)
-        
-        # Perform the rotation with no clipping
-        abs_cos = abs(M[0, 0])
-        abs_sin = abs(M[0, 1])
+    def __init__(self, image, angle, interpolation=cv2.INTER_LINEAR, dst=None):
+        super().__init__(image, dst)
+        self.angle = angle % 360
+        self.interpolation = interpolation
 
-        # Find the new width and height bounds
-        bound_w = int(h * abs_sin + w * abs_cos)
-        bound_h = int(h * abs_cos + w * abs_sin)
+    def process_image(self):
+        if self.angle == 0:
+            if self.dst is not None:
+                self.dst[...] = self.image
+                self.image = self.dst
+            return self
+        if self.angle in RIGHT_ANGLE_ROTATIONS:
+            self.image = cv2.rotate(self.image, RIGHT_ANGLE_ROTATIONS[self.angle], dst=self.dst)
+            return self
 
-        # Adjust the rotation matrix to the new bounds
-        M[0, 2] += bound_w / 2 - center[0]
-        M[1, 2] += bound_h / 2 - center[1]
+        (h, w) = self.image.shape[:2]
+        M, bound_w, bound_h = rotation_bounds(self.angle, w, h)
 
         # Rotate the whole image
-        self.image = cv2.warpAffine(self.image, M, (bound_w, bound_h))
-        
-        print(f"Rotated by {self.angle} degrees")
+        self.image = cv2.warpAffine(self.image, np.array(M), (bound_w, bound_h), dst=self.dst,
+                                    flags=self.interpolation)
         return self
 
-# Grayscale Operation
+# Shape of the grayscale version of a frame: single channel, except that a frame
+# with alpha stays 4 channels (gray in B, G and R) so transparency survives
+def grayscale_shape(shape):
+    if len(shape) == 3 and shape[2] == 4:
+        return shape
+    return shape[:2]
+
+
+# Grayscale Operation, for 1, 3 and 4 channel frames of any depth
 class GrayscaleProcessor(ImageProcessor):
-    def __init__(self, image):
-        super().__init__(image)
+    def __init__(self, image, dst=None):
+        super().__init__(image, dst)  # dst has grayscale_shape(image.shape)
         
     def process_image(self):
-        self.image = cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY)
-        
-        print("Converted to grayscale")
+        channels = 1 if self.image.ndim == 2 else self.image.shape[2]
+        if channels == 4:
+            gray = cv2.cvtColor(self.image, cv2.COLOR_BGRA2GRAY)
+            self.image = cv2.merge([gray, gray, gray, self.image[:, :, 3]], dst=self.dst)
+        elif channels == 1:
+            if self.dst is not None:
+                self.dst[...] = self.image.reshape(self.dst.shape)
+                self.image = self.dst
+        else:
+            self.image = cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY, dst=self.dst)
+        return self
+
+
+# Levels on values scaled to 0..1: black..white stretched to the full range (the
+# points are on the 8 bit scale whatever the depth), the midtones bent by gamma,
+# then squeezed into out_black..out_white
+def _levels_curve(x, black, white, gamma, out_black, out_white):
+    x = np.clip((x - black / 255) / ((white - black) / 255), 0, 1) ** (1 / gamma)
+    return out_black / 255 + x * ((out_white - out_black) / 255)
+
+
+# Tone curves by name, on values scaled to 0..1 and vectorised over numpy arrays.
+# Amounts are percentages, -100..100.
+TONE_CURVES = {
+    'brightness': lambda x, amount: x + amount / 100,
+    'contrast': lambda x, amount: (x - 0.5) * (1 + amount / 100) + 0.5,
+    'gamma': lambda x, gamma: x ** (1 / gamma),
+    'levels': _levels_curve,
+    'invert': lambda x: 1 - x,
+}
+
+
+# The lookup table for a chain of tone curves, ((name, args), ...) applied in
+# order and clipped after each one like separate passes would be. 256 entries for
+# 8 bit frames, 65536 for 16 bit. With alpha the 8 bit table has 4 channels, the
+# last one the identity, so cv2.LUT leaves transparency alone. Built once per
+# chain and depth, read-only.
+@lru_cache(maxsize=64)
+def tone_table(curves, depth, alpha=False):
+    peak = (1 << depth) - 1
+    values = np.arange(peak + 1, dtype=np.float64) / peak
+    for name, args in curves:
+        values = np.clip(TONE_CURVES[name](values, *args), 0, 1)
+    table = np.round(values * peak).astype(np.uint8 if depth == 8 else np.uint16)
+    if alpha:
+        table = np.dstack([table, table, table, np.arange(peak + 1, dtype=table.dtype)])
+    table.flags.writeable = False
+    return table
+
+
+# Tone Operation: every channel but alpha through one lookup table, whatever the
+# number of curves in the chain. 8 bit frames go through cv2.LUT, 16 bit ones are
+# indexed into the 65536 entry table. dst can be the input itself.
+class ToneProcessor(ImageProcessor):
+    def __init__(self, image, curves, dst=None):
+        super().__init__(image, dst)
+        self.curves = tuple(curves)  # ((name, args), ...) from TONE_CURVES
+
+    def process_image(self):
+        alpha = self.image.ndim == 3 and self.image.shape[2] == 4
+        if self.image.dtype == np.uint8:
+            self.image = cv2.LUT(self.image, tone_table(self.curves, 8, alpha), dst=self.dst)
+            return self
+
+        table = tone_table(self.curves, 16)
+        dst = self.dst if self.dst is not None else np.empty_like(self.image)
+        colour = (Ellipsis, slice(0, 3)) if alpha else Ellipsis
+        np.take(table, self.image[colour], out=dst[colour])
+        if alpha and dst is not self.image:
+            dst[:, :, 3] = self.image[:, :, 3]
+        self.image = dst
+        return self
+
+
+# Sepia toning as a BGR -> BGR matrix, rows are the output channels
+SEPIA_MATRIX = ((0.131, 0.534, 0.272), (0.168, 0.686, 0.349), (0.189, 0.769, 0.393))
+
+
+# Channel mixing Operation: each output channel a weighted sum of the input ones,
+# 3x3 in BGR order, saturated to the frame's depth. A single channel frame is
+# mixed as gray in all three (and comes out as BGR), alpha passes through.
+class ColorMatrixProcessor(ImageProcessor):
+    def __init__(self, image, matrix, dst=None):
+        super().__init__(image, dst)
+        self.matrix = np.asarray(matrix, dtype=np.float64)
+
+    def process_image(self):
+        image = self.image
+        if image.ndim == 2 or image.shape[2] == 1:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        matrix = self.matrix
+        if image.shape[2] == 4:
+            matrix = np.eye(4)
+            matrix[:3, :3] = self.matrix
+        self.image = cv2.transform(image, matrix, dst=self.dst)
+        return self
+
+
+# Shape of a frame after a chain of color steps (see ColorProcessor)
+def color_shape(shape, steps):
+    for kind, _ in steps:
+        if kind == 'gray':
+            shape = grayscale_shape(shape)
+        elif kind == 'matrix' and (len(shape) == 2 or shape[2] == 1):
+            shape = shape[:2] + (3,)
+    return shape
+
+
+# A chain of composed pointwise steps, one pass over the pixels each:
+# ('tone', curves) through ToneProcessor, ('matrix', 3x3) through
+# ColorMatrixProcessor, ('gray', None) through GrayscaleProcessor. The tone steps
+# write into dst when there is one (it can be the input itself).
+class ColorProcessor(ImageProcessor):
+    def __init__(self, image, steps, dst=None):
+        super().__init__(image, dst)
+        self.steps = steps
+
+    def process_image(self):
+        source, dst = self.image, self.dst
+        for kind, value in self.steps:
+            if kind == 'tone':
+                self.image = ToneProcessor(self.image, value, dst=dst).process_image().get_image()
+            elif kind == 'matrix':
+                self.image = ColorMatrixProcessor(self.image, value).process_image().get_image()
+            else:
+                self.image = GrayscaleProcessor(self.image).process_image().get_image()
+            if self.image is not source:
+                dst = self.image  # A new array, the steps after it can overwrite it
         return self
 
 # Resize Operation
 class ResizeProcessor(ImageProcessor):
-    def __init__(self, image, percentage):
-        super().__init__(image)
+    def __init__(self, image, percentage, dst=None):
+        super().__init__(image, dst)
         self.percentage = percentage
 
     def process_image(self):
@@ -86,16 +256,14 @@ class ResizeProcessor(ImageProcessor):
         height = int(self.image.shape[0] * self.percentage / 100)
 
         # Resize the image
-        self.image = cv2.resize(self.image, (width, height))
-
-        print(f"Resized to {width}x{height} ({self.percentage}%)")
+        self.image = cv2.resize(self.image, (width, height), dst=self.dst)
         return self
     
     
 # Thumbnail Operation (similar to Resize but with aspect ratio consideration)
 class ThumbnailProcessor(ImageProcessor):
-    def __init__(self, image, max_width=200, max_height=200):
-        super().__init__(image)
+    def __init__(self, image, max_width=200, max_height=200, dst=None):
+        super().__init__(image, dst)  # dst is the whole max_height x max_width canvas
         self.max_width = max_width
         self.max_height = max_height
         
@@ -106,42 +274,287 @@ class ThumbnailProcessor(ImageProcessor):
         scaling_factor = min(self.max_width / w, self.max_height / h)
         new_size = (int(w * scaling_factor), int(h * scaling_factor))
 
-        # Resize the image with aspect ratio preservation
-        self.image = cv2.resize(self.image, new_size)
+        # Black letterbox canvas, the resize writes straight into the region the
+        # image covers (no intermediate resized copy, no copyMakeBorder)
+        if self.dst is None:
+            canvas = np.zeros((self.max_height, self.max_width) + self.image.shape[2:], dtype=self.image.dtype)
+        else:
+            canvas = self.dst
+            canvas.fill(0)
+        left = (self.max_width - new_size[0]) // 2
+        top = (self.max_height - new_size[1]) // 2
+        region = canvas[top:top + new_size[1], left:left + new_size[0]]
+        cv2.resize(self.image, new_size, dst=region)
 
-        # Calculate padding for letter-boxing
-        delta_w = self.max_width - new_size[0]
-        delta_h = self.max_height - new_size[1]
-        top, bottom = delta_h // 2, delta_h - (delta_h // 2)
-        left, right = delta_w // 2, delta_w - (delta_w // 2)
+        self.image = canvas
+        return self
 
-        # Add padding to the image to achieve the thumbnail size with letter-boxing
-        color = [0, 0, 0]  # Black padding
-        self.image = cv2.copyMakeBorder(self.image, top, bottom, left, right, cv2.BORDER_CONSTANT, value=color)
-        
-        # Log that thumbnail is created
-        print("Thumbnail created")
-        
+# Crop box (x, y, width, height) clipped to a w x h frame, or None when nothing
+# of it is left
+def crop_box(x, y, width, height, w, h):
+    x0, y0 = min(x, w), min(y, h)
+    x1, y1 = min(x + width, w), min(y + height, h)
+    if x1 <= x0 or y1 <= y0:
+        return None
+    return x0, y0, x1 - x0, y1 - y0
+
+
+# Crop Operation: a numpy view of the box, no pixels are copied
+class CropProcessor(ImageProcessor):
+    def __init__(self, image, x, y, width, height, dst=None):
+        super().__init__(image, dst)
+        self.box = (x, y, width, height)
+
+    def process_image(self):
+        h, w = self.image.shape[:2]
+        box = crop_box(*self.box, w, h)
+        if box is None:
+            raise ValueError("Crop box lies outside the image.")
+        x, y, width, height = box
+        self.image = self.image[y:y + height, x:x + width]
+        if self.dst is not None:
+            self.dst[...] = self.image
+            self.image = self.dst
         return self
 
+
+# Longest side of the frame the smart crop search runs on
+SMARTCROP_ANALYSIS_SIZE = 256
+
+
+# Size of the largest box with the given aspect ratio (width / height) that fits
+# in a w x h frame
+def smartcrop_size(aspect, w, h):
+    if w / h > aspect:
+        return max(1, min(w, int(round(h * aspect)))), h
+    return w, max(1, min(h, int(round(w / aspect))))
+
+
+# Top-left corner of the crop_w x crop_h window of the frame with the most edge
+# energy (Sobel magnitude of a small grayscale copy, summed with an integral
+# image so every position costs four lookups). Ties, a flat frame for one, go to
+# the window nearest the centre.
+def smartcrop_position(image, crop_w, crop_h):
+    h, w = image.shape[:2]
+    if crop_w >= w and crop_h >= h:
+        return 0, 0
+    scale = min(1.0, SMARTCROP_ANALYSIS_SIZE / max(w, h))
+    small = cv2.resize(image, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+    if small.ndim == 3:
+        small = cv2.cvtColor(small, cv2.COLOR_BGRA2GRAY if small.shape[2] == 4 else cv2.COLOR_BGR2GRAY)
+    small = small.astype(np.float32)
+    energy = np.abs(cv2.Sobel(small, cv2.CV_32F, 1, 0)) + np.abs(cv2.Sobel(small, cv2.CV_32F, 0, 1))
+
+    sh, sw = energy.shape
+    win_w = min(sw, max(1, round(crop_w * scale)))
+    win_h = min(sh, max(1, round(crop_h * scale)))
+    integral = cv2.integral(energy, sdepth=cv2.CV_64F)
+    sums = integral[win_h:, win_w:] - integral[:-win_h, win_w:] - integral[win_h:, :-win_w] + integral[:-win_h, :-win_w]
+
+    # Distance to the centred position, scaled well below any real energy difference
+    ys, xs = np.mgrid[0:sums.shape[0], 0:sums.shape[1]]
+    off_centre = np.hypot(xs - (sw - win_w) / 2, ys - (sh - win_h) / 2)
+    score = sums - off_centre * (1e-6 * (sums.max() + 1))
+    top, left = np.unravel_index(np.argmax(score), score.shape)
+    return min(int(round(left / scale)), w - crop_w), min(int(round(top / scale)), h - crop_h)
+
+
+# Smart crop Operation: the box of the given aspect ratio (width / height) with the
+# most detail in it, as a numpy view
+class SmartCropProcessor(ImageProcessor):
+    def __init__(self, image, aspect, dst=None):
+        super().__init__(image, dst)
+        self.aspect = aspect
+
+    def process_image(self):
+        h, w = self.image.shape[:2]
+        crop_w, crop_h = smartcrop_size(self.aspect, w, h)
+        x, y = smartcrop_position(self.image, crop_w, crop_h)
+        self.image = CropProcessor(self.image, x, y, crop_w, crop_h, dst=self.dst).process_image().get_image()
+        return self
+
+
 # Rotate Left (90 degrees CW)
 class RotateLeftProcessor(ImageProcessor):
-    def __init__(self, image):
-        super().__init__(image)
+    def __init__(self, image, dst=None):
+        super().__init__(image, dst)
         
     def process_image(self):
-        self.image = cv2.rotate(self.image, cv2.ROTATE_90_CLOCKWISE)
-        
-        print("Rotated left")
+        self.image = cv2.rotate(self.image, cv2.ROTATE_90_CLOCKWISE, dst=self.dst)
         return self
 
 # Rotate Right (90 degrees CCW)
 class RotateRightProcessor(ImageProcessor):
-    def __init__(self, image):
-        super().__init__(image)
+    def __init__(self, image, dst=None):
+        super().__init__(image, dst)
+        
+    def process_image(self):
+        self.image = cv2.rotate(self.image, cv2.ROTATE_90_COUNTERCLOCKWISE, dst=self.dst)
+        return self
         
+
+# cv2.flip code for (flip_x, flip_y)
+FLIP_CODES = {(True, False): 1, (False, True): 0, (True, True): -1}
+
+
+# Composed geometric transform from OperationPlanner.
+# Anything that reduces to a flip / quarter turn / transpose is done with the exact
+# OpenCV primitives, an identity is skipped and everything else is one warpAffine.
+class AffineProcessor(ImageProcessor):
+    def __init__(self, image, matrix, size, constant_border=False, dst=None, interpolation=cv2.INTER_LINEAR):
+        # dst may also be a view (the inside of a letterbox canvas), or the source
+        # itself when nothing else needs it (flips then run in place)
+        super().__init__(image, dst)
+        self.matrix = np.asarray(matrix, dtype=np.float64)
+        self.size = size  # (width, height)
+        self.constant_border = constant_border
+        self.interpolation = interpolation  # cv2 flag for the warp, permutations ignore it
+
     def process_image(self):
-        self.image = cv2.rotate(self.image, cv2.ROTATE_90_COUNTERCLOCKWISE)
-        print("Rotated right")
+        h, w = self.image.shape[:2]
+        A = self.matrix[:, :2]
+        rounded = np.round(A)
+
+        if np.allclose(A, rounded, atol=1e-9) and np.count_nonzero(rounded) == 2 \
+                and np.all(np.count_nonzero(rounded, axis=1) == 1):
+            image = self._permute(rounded, w, h)
+            if image is not None:
+                self.image = image
+                return self
+
+        # warpAffine can't run in place, a dst that is the source itself is dropped
+        dst = None if self.dst is self.image else self.dst
+        border = cv2.BORDER_CONSTANT if self.constant_border else cv2.BORDER_REPLICATE
+        self.image = cv2.warpAffine(self.image, self.matrix, self.size, dst=dst,
+                                    flags=self.interpolation, borderMode=border)
         return self
-        
\ No newline at end of file
+
+    # Pixel permutation (flips, 90 degree turns, transposes), one OpenCV call
+    # writing into dst when there is one (a flip can use the source itself as dst).
+    # An output that covers only part of the source (a crop) permutes a view of
+    # that window. Returns None when the translation does not line the source up
+    # exactly with the output grid.
+    def _permute(self, A, w, h):
+        t = self.matrix[:, 2]
+        if not np.allclose(t, np.round(t), atol=1e-6):
+            return None
+        # Source pixels under the output's corners (A is orthogonal, A.T inverts it)
+        out_w, out_h = self.size
+        corners = A.T @ (np.array([[0, out_w - 1, 0, out_w - 1], [0, 0, out_h - 1, out_h - 1]]) - np.round(t)[:, None])
+        sx0, sy0 = (int(v) for v in corners.min(axis=1))
+        sx1, sy1 = (int(v) for v in corners.max(axis=1))
+        if sx0 < 0 or sy0 < 0 or sx1 >= w or sy1 >= h:
+            return None
+        transposed = A[0, 0] == 0
+
+        image, dst = self.image, self.dst
+        if (sx0, sy0, sx1, sy1) != (0, 0, w - 1, h - 1):
+            image = image[sy0:sy1 + 1, sx0:sx1 + 1]  # View, no copy
+            if dst is self.image:
+                dst = None  # The window can't be written back over the whole source
+
+        if transposed:
+            # Swap axes first, what is left is diagonal
+            A = A @ np.array([[0, 1], [1, 0]])
+        flip_x = A[0, 0] < 0
+        flip_y = A[1, 1] < 0
+
+        if not transposed:
+            if not flip_x and not flip_y:
+                if dst is None or dst is image:
+                    return image  # Identity
+                dst[...] = image
+                return dst
+            return cv2.flip(image, FLIP_CODES[bool(flip_x), bool(flip_y)], dst=dst)
+        if dst is image:
+            dst = None  # Axis swaps need a separate output
+        if flip_x and not flip_y:
+            return cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE, dst=dst)  # transpose + horizontal flip
+        if flip_y and not flip_x:
+            return cv2.rotate(image, cv2.ROTATE_90_COUNTERCLOCKWISE, dst=dst)  # transpose + vertical flip
+        image = cv2.transpose(image, dst=dst)
+        if flip_x:
+            cv2.flip(image, -1, dst=image)  # Anti-transpose, the flip runs in place
+        return image
+
+
+# Several renditions of one frame (e.g. 64/200/512/1024 px). A downscale pyramid
+# is built once with area interpolation (each level half the previous one) and
+# every rendition is resized from the smallest level that is still at least as
+# big as it needs, so large frames are never resampled more than once per size.
+class RenditionProcessor(ImageProcessor):
+    def __init__(self, image, boxes, fit='letterbox'):
+        super().__init__(image)
+        self.boxes = boxes  # List of (width, height)
+        self.fit = fit  # 'letterbox', 'crop' or 'fit'
+        self.renditions = []
+
+    def process_image(self):
+        h, w = self.image.shape[:2]
+        targets = [self._target(box, w, h) for box in self.boxes]
+
+        # Only as many levels as the smallest rendition can use
+        smallest_w = min(size[0] for _, size, _ in targets)
+        smallest_h = min(size[1] for _, size, _ in targets)
+        levels = [self.image]
+        while levels[-1].shape[1] // 2 >= smallest_w and levels[-1].shape[0] // 2 >= smallest_h:
+            prev = levels[-1]
+            levels.append(cv2.resize(prev, (prev.shape[1] // 2, prev.shape[0] // 2), interpolation=cv2.INTER_AREA))
+
+        self.renditions = []
+        for box, size, crop in targets:
+            self.renditions.append((box, self._render(levels, w, h, box, size, crop)))
+        return self
+
+    def get_renditions(self):
+        return self.renditions
+
+    # (box, content size, crop of the frame in relative coordinates or None)
+    def _target(self, box, w, h):
+        box_w, box_h = box
+        if self.fit == 'crop':
+            # Fill the box: crop the frame to the box's aspect ratio, centred
+            crop_w = min(1.0, (h * box_w / box_h) / w)
+            crop_h = min(1.0, (w * box_h / box_w) / h)
+            return box, (box_w, box_h), (crop_w, crop_h)
+        scaling_factor = min(box_w / w, box_h / h)
+        size = (max(1, int(w * scaling_factor)), max(1, int(h * scaling_factor)))
+        return box, size, None
+
+    def _render(self, levels, w, h, box, size, crop):
+        crop_w, crop_h = crop if crop else (1.0, 1.0)
+
+        # Smallest level whose (cropped) region still covers the target size
+        level = levels[0]
+        for candidate in levels:
+            if candidate.shape[1] * crop_w >= size[0] and candidate.shape[0] * crop_h >= size[1]:
+                level = candidate
+
+        if crop:
+            lh, lw = level.shape[:2]
+            region_w = max(1, int(round(lw * crop_w)))
+            region_h = max(1, int(round(lh * crop_h)))
+            left = (lw - region_w) // 2
+            top = (lh - region_h) // 2
+            level = level[top:top + region_h, left:left + region_w]  # View, no copy
+
+        # Letterbox onto a black box like ThumbnailProcessor, resizing straight
+        # into the covered region
+        dst = None
+        if self.fit == 'letterbox':
+            box_w, box_h = box
+            canvas = np.zeros((box_h, box_w) + level.shape[2:], dtype=level.dtype)
+            left = (box_w - size[0]) // 2
+            top = (box_h - size[1]) // 2
+            dst = canvas[top:top + size[1], left:left + size[0]]
+
+        if (level.shape[1], level.shape[0]) == size:
+            if dst is None:
+                return level
+            dst[...] = level
+        else:
+            interpolation = cv2.INTER_AREA if level.shape[1] >= size[0] else cv2.INTER_LINEAR
+            content = cv2.resize(level, size, dst=dst, interpolation=interpolation)
+            if dst is None:
+                return content
+        return canvas
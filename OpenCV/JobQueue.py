@@ -0,0 +1,250 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from . import Metrics
+
+# Job lifecycle: queued -> running -> done | failed
+JOB_STATUSES = ['queued', 'running', 'done', 'failed']
+
+# Small jobs get workers of their own so they never wait behind a large one, the
+# large-lane workers take small jobs too when they have nothing else to do
+JOB_LANES = ['small', 'large']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    lane TEXT NOT NULL,
+    params TEXT NOT NULL,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    expires REAL,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, lane, created);
+"""
+
+
+# Reported to the client as the job's error message
+class JobFailed(Exception):
+    pass
+
+
+# Refused at submit time, too many jobs are waiting already
+class JobQueueFull(Exception):
+    pass
+
+
+# Durable local job queue: one SQLite database plus the uploads and result ZIPs as
+# files in the same directory, so no broker is needed and jobs survive a restart.
+# Every process that opens the directory runs its own workers, claims are atomic
+# across processes. A running job holds a lease that this process keeps renewing;
+# when the process dies the lease runs out and another worker (or the same one
+# after the restart) picks the job up again, up to max_attempts times.
+# Finished jobs (results and errors) are deleted ttl seconds after they finish.
+class JobQueue:
+    def __init__(self, directory, handler, ttl=3600, small_workers=2, large_workers=1,
+                 max_queued=1000, max_attempts=3, lease_seconds=30, poll_interval=1.0):
+        self.directory = directory
+        self.handler = handler  # handler(input_path, params, result_path), raises JobFailed
+        self.ttl = ttl
+        self.small_workers = small_workers
+        self.large_workers = large_workers
+        self.max_queued = max_queued
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.condition = threading.Condition()
+        self.db_lock = threading.Lock()
+        self.running = set()  # Ids this process is working on (their leases are renewed)
+        self.threads = []
+        self.stopping = False
+
+        os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(directory, 'jobs.sqlite3'), timeout=30,
+                                  isolation_level=None, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        with self.db_lock:
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.executescript(SCHEMA)
+
+    def input_path(self, job_id):
+        return os.path.join(self.directory, f'{job_id}.input')
+
+    def result_path(self, job_id):
+        return os.path.join(self.directory, f'{job_id}.zip')
+
+    def start(self):
+        with self.condition:
+            if self.threads:
+                return
+            self.stopping = False
+            lanes = [('small',)] * self.small_workers + [('large', 'small')] * self.large_workers
+            for index, worker_lanes in enumerate(lanes):
+                self.threads.append(threading.Thread(target=self._work, args=(worker_lanes,),
+                                                     name=f'job-{worker_lanes[0]}-{index}', daemon=True))
+            self.threads.append(threading.Thread(target=self._maintain, name='job-maintenance', daemon=True))
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    # Stores the upload and queues the job, returns its id
+    def submit(self, data, params, lane='small'):
+        if lane not in JOB_LANES:
+            raise ValueError(f"Unknown job lane '{lane}'.")
+        with self.db_lock:
+            queued = self.db.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+        if queued >= self.max_queued:
+            raise JobQueueFull("Too many jobs are waiting, please retry later.")
+
+        job_id = uuid.uuid4().hex
+        path = self.input_path(job_id)
+        with open(path + '.part', 'wb') as f:
+            f.write(data)
+        os.replace(path + '.part', path)
+        with self.db_lock:
+            self.db.execute('INSERT INTO jobs (id, status, lane, params, created) VALUES (?, ?, ?, ?, ?)',
+                            (job_id, 'queued', lane, json.dumps(params), time.time()))
+        with self.condition:
+            self.condition.notify_all()
+        return job_id
+
+    # The job as a dict, or None when it is unknown or has expired
+    def get(self, job_id):
+        with self.db_lock:
+            row = self.db.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None or (row['expires'] is not None and row['expires'] < time.time()):
+            return None
+        job = {key: row[key] for key in ('id', 'status', 'lane', 'created', 'started',
+                                          'finished', 'expires', 'attempts', 'error')}
+        if row['status'] == 'queued':
+            with self.db_lock:
+                job['position'] = self.db.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND lane = ? AND created < ?",
+                    (row['lane'], row['created'])).fetchone()[0]
+        return job
+
+    def get_stats(self):
+        with self.db_lock:
+            rows = self.db.execute('SELECT status, lane, COUNT(*) FROM jobs GROUP BY status, lane').fetchall()
+        stats = {status: {lane: 0 for lane in JOB_LANES} for status in JOB_STATUSES}
+        for status, lane, count in rows:
+            stats.setdefault(status, {})[lane] = count
+        with self.condition:
+            stats['running_here'] = len(self.running)
+        return stats
+
+    # Worker loop: take the oldest queued job of the first lane that has one
+    def _work(self, lanes):
+        while True:
+            with self.condition:
+                if self.stopping:
+                    return
+            job = self._claim(lanes)
+            if job is None:
+                with self.condition:
+                    if not self.stopping:
+                        self.condition.wait(self.poll_interval)
+                continue
+            self._run(job)
+
+    def _claim(self, lanes):
+        now = time.time()
+        with self.db_lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                # Leases that ran out belong to a process that is gone, requeue or give up
+                self.db.execute("UPDATE jobs SET status = 'failed', finished = ?, expires = ?, lease_until = NULL, "
+                                "error = 'The job was interrupted too many times.' "
+                                "WHERE status = 'running' AND lease_until < ? AND attempts >= ?",
+                                (now, now + self.ttl, now, self.max_attempts))
+                self.db.execute("UPDATE jobs SET status = 'queued', lease_until = NULL "
+                                "WHERE status = 'running' AND lease_until < ?", (now,))
+                row = None
+                for lane in lanes:
+                    row = self.db.execute("SELECT * FROM jobs WHERE status = 'queued' AND lane = ? "
+                                          "ORDER BY created LIMIT 1", (lane,)).fetchone()
+                    if row is not None:
+                        break
+                if row is not None:
+                    self.db.execute("UPDATE jobs SET status = 'running', started = ?, lease_until = ?, "
+                                    "attempts = attempts + 1 WHERE id = ?",
+                                    (now, now + self.lease_seconds, row['id']))
+                self.db.execute('COMMIT')
+            except BaseException:
+                self.db.execute('ROLLBACK')
+                raise
+        if row is None:
+            return None
+        with self.condition:
+            self.running.add(row['id'])
+        Metrics.JOB_WAIT_SECONDS.observe(now - row['created'], lane=row['lane'])
+        return row
+
+    def _run(self, job):
+        job_id = job['id']
+        result_path = self.result_path(job_id)
+        error = None
+        try:
+            self.handler(self.input_path(job_id), json.loads(job['params']), result_path + '.part')
+            os.replace(result_path + '.part', result_path)
+        except JobFailed as e:
+            error = str(e)
+        except Exception:
+            error = "An unexpected error occurred while processing the job."
+        finally:
+            with self.condition:
+                self.running.discard(job_id)
+
+        status = 'done' if error is None else 'failed'
+        if error is not None:
+            _remove(result_path + '.part')
+        now = time.time()
+        with self.db_lock:
+            self.db.execute('UPDATE jobs SET status = ?, finished = ?, expires = ?, lease_until = NULL, error = ? '
+                            'WHERE id = ?', (status, now, now + self.ttl, error, job_id))
+        _remove(self.input_path(job_id))
+        Metrics.JOBS_FINISHED.inc(lane=job['lane'], status=status)
+
+    # Renews the leases of the jobs running here and deletes expired jobs
+    def _maintain(self):
+        interval = max(self.lease_seconds / 3, 0.1)
+        while True:
+            with self.condition:
+                if self.stopping:
+                    return
+                self.condition.wait(interval)
+                running = list(self.running)
+            now = time.time()
+            with self.db_lock:
+                if running:
+                    self.db.executemany('UPDATE jobs SET lease_until = ? WHERE id = ?',
+                                        [(now + self.lease_seconds, job_id) for job_id in running])
+                expired = [row[0] for row in self.db.execute(
+                    'SELECT id FROM jobs WHERE expires < ?', (now,)).fetchall()]
+                if expired:
+                    self.db.executemany('DELETE FROM jobs WHERE id = ?', [(job_id,) for job_id in expired])
+            for job_id in expired:
+                _remove(self.result_path(job_id))
+                _remove(self.input_path(job_id))
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,111 @@
+import os
+import shutil
+import struct
+import subprocess
+
+import numpy as np
+
+from . import Metrics
+from .ImageIngest import ORIENTATION_TAG, find_orientation_tag
+
+# The eight EXIF orientations as the linear part of the transform from stored
+# pixels to displayed pixels (y down, same convention as OperationPlanner)
+ORIENTATION_MATRICES = {
+    1: ((1, 0), (0, 1)),
+    2: ((-1, 0), (0, 1)),  # Mirror horizontal
+    3: ((-1, 0), (0, -1)),  # Rotate 180
+    4: ((1, 0), (0, -1)),  # Mirror vertical
+    5: ((0, 1), (1, 0)),  # Transpose
+    6: ((0, -1), (1, 0)),  # Rotate 90 clockwise
+    7: ((0, -1), (-1, 0)),  # Transverse
+    8: ((0, 1), (-1, 0)),  # Rotate 90 counter-clockwise
+}
+
+# jpegtran arguments that apply the same transform to the DCT coefficients
+JPEGTRAN_TRANSFORMS = {
+    1: [],
+    2: ['-flip', 'horizontal'],
+    3: ['-rotate', '180'],
+    4: ['-flip', 'vertical'],
+    5: ['-transpose'],
+    6: ['-rotate', '90'],
+    7: ['-transverse'],
+    8: ['-rotate', '270'],
+}
+
+# jpegtran is optional: without it (or with JPEGTRAN pointing nowhere) the lossless
+# path is only used when the client asks for the EXIF tag instead
+JPEGTRAN = os.environ.get('JPEGTRAN') or shutil.which('jpegtran')
+JPEGTRAN_TIMEOUT = 30
+
+
+# Orientation that shows the stored pixels the way the plan's final output would,
+# or None when the output isn't an exact pixel permutation of the upload (any
+# resize, arbitrary rotation, grayscale, colour op or thumbnail needs the pixel
+# pipeline).
+# orientation is the upload's own EXIF orientation, which imdecode applied before
+# planning.
+def lossless_orientation(plan, orientation, width, height):
+    if len(plan) != 1 or plan[0].grayscale or plan[0].color or plan[0].canvas_size is not None:
+        return None
+    output = plan[0]
+    A = output.matrix[:, :2]
+    rounded = np.round(A)
+    if not np.allclose(A, rounded, atol=1e-9) or np.count_nonzero(rounded) != 2:
+        return None
+
+    # The translation must line the frame up exactly with the output grid
+    corners = rounded @ np.array([[0, width - 1, 0, width - 1], [0, 0, height - 1, height - 1]])
+    out_w, out_h = (width, height) if rounded[0, 0] != 0 else (height, width)
+    if output.size != (out_w, out_h) or not np.allclose(output.matrix[:, 2], -corners.min(axis=1), atol=1e-6):
+        return None
+
+    combined = rounded @ np.array(ORIENTATION_MATRICES.get(orientation, ORIENTATION_MATRICES[1]))
+    for value, matrix in ORIENTATION_MATRICES.items():
+        if np.array_equal(combined, matrix):
+            return value
+    return None
+
+
+# Transform the upload's DCT coefficients with jpegtran. Metadata is dropped like
+# the re-encoding path does, so the result shows upright everywhere. Returns None
+# if jpegtran is missing or refuses (-perfect fails when partial edge blocks would
+# have to be trimmed), the caller then takes the pixel pipeline.
+def jpegtran_transform(data, orientation):
+    if JPEGTRAN is None:
+        return None
+    command = [JPEGTRAN, '-copy', 'none', '-perfect', *JPEGTRAN_TRANSFORMS[orientation]]
+    with Metrics.stage('jpegtran'):
+        try:
+            result = subprocess.run(command, input=data, capture_output=True, timeout=JPEGTRAN_TIMEOUT)
+        except (OSError, subprocess.TimeoutExpired):
+            return None
+    if result.returncode != 0 or not result.stdout:
+        return None
+    return result.stdout
+
+
+# The upload with its EXIF orientation tag set, an Exif APP1 segment is added when
+# there is none. Not a single pixel is touched, viewers rotate on display. Returns
+# None for an Exif segment without an orientation entry (adding one would mean
+# rewriting the IFD).
+def set_exif_orientation(data, orientation):
+    data = bytes(data)
+    has_exif, location = find_orientation_tag(data)
+    if location is not None:
+        position, endian = location
+        return data[:position] + struct.pack(endian + 'H', orientation) + data[position + 2:]
+    if has_exif:
+        return None
+
+    # Minimal big-endian TIFF with one IFD0 entry: orientation, SHORT, count 1
+    tiff = b'MM\x00*' + struct.pack('>I', 8) + struct.pack('>H', 1) \
+        + struct.pack('>HHIHH', ORIENTATION_TAG, 3, 1, orientation, 0) + struct.pack('>I', 0)
+    segment = b'Exif\x00\x00' + tiff
+    app1 = b'\xff\xe1' + struct.pack('>H', len(segment) + 2) + segment
+
+    # After a JFIF APP0 if there is one (it has to come first), else right after SOI
+    insert_at = 2
+    if data[2:4] == b'\xff\xe0':
+        insert_at = 4 + struct.unpack('>H', data[4:6])[0]
+    return data[:insert_at] + app1 + data[insert_at:]
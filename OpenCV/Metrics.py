@@ -0,0 +1,189 @@
+import os
+import threading
+import time
+import contextvars
+from collections import OrderedDict
+
+# Instrumentation switch. When off, stage() hands back a shared no-op context
+# manager and observe()/inc() return straight away, so the hot path pays for one
+# attribute check per call and nothing else.
+ENABLED = os.environ.get('METRICS_ENABLED', '1') != '0'
+
+# Histogram buckets
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BYTE_BUCKETS = tuple(1024 * 4 ** i for i in range(11))  # 1 KB .. 1 GB
+PIXEL_BUCKETS = (1e5, 3e5, 1e6, 2e6, 5e6, 12e6, 24e6, 50e6, 100e6)
+
+# Observations made while a collector is active are also appended to it, so a
+# request can build its Server-Timing header and worker processes can ship their
+# measurements back to the parent
+_collector = contextvars.ContextVar('metrics_collector', default=None)
+
+_registry = OrderedDict()
+
+
+def _label_key(label_names, labels):
+    return tuple(str(labels.get(name, '')) for name in label_names)
+
+
+def _format_labels(label_names, key, extra=None):
+    pairs = [f'{name}="{value}"' for name, value in zip(label_names, key)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.values = {}
+        self.lock = threading.Lock()
+        _registry[name] = self
+
+    def inc(self, amount=1, **labels):
+        if not ENABLED:
+            return
+        key = _label_key(self.label_names, labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+        collector = _collector.get()
+        if collector is not None:
+            collector.append((self.name, labels, amount))
+
+    # Used for replayed worker observations, same signature as Histogram
+    def observe(self, value, **labels):
+        self.inc(value, **labels)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f'{self.name}{_format_labels(self.label_names, key)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.label_names = label_names
+        self.series = {}  # label key -> [bucket counts..., sum, count]
+        self.lock = threading.Lock()
+        _registry[name] = self
+
+    def observe(self, value, **labels):
+        if not ENABLED:
+            return
+        key = _label_key(self.label_names, labels)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+        collector = _collector.get()
+        if collector is not None:
+            collector.append((self.name, labels, value))
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            for key, series in sorted(self.series.items()):
+                for bound, count in zip(self.buckets, series):
+                    labels = _format_labels(self.label_names, key, 'le="%s"' % bound)
+                    lines.append(f'{self.name}_bucket{labels} {count}')
+                labels = _format_labels(self.label_names, key, 'le="+Inf"')
+                lines.append(f'{self.name}_bucket{labels} {series[-1]}')
+                lines.append(f'{self.name}_sum{_format_labels(self.label_names, key)} {series[-2]}')
+                lines.append(f'{self.name}_count{_format_labels(self.label_names, key)} {series[-1]}')
+        return lines
+
+
+# The service's metrics
+STAGE_SECONDS = Histogram('image_stage_seconds', 'Time spent in each processing stage.', TIME_BUCKETS, ('stage',))
+REQUEST_SECONDS = Histogram('http_request_seconds', 'Request time until the last byte is sent.', TIME_BUCKETS, ('route', 'status'))
+BYTES_IN = Counter('image_bytes_in_total', 'Uploaded image bytes.')
+BYTES_OUT = Counter('image_bytes_out_total', 'Encoded output image bytes.', ('kind',))
+OUTPUT_BYTES = Histogram('image_output_bytes', 'Size of each encoded output image.', BYTE_BUCKETS, ('kind',))
+ADMISSION_REJECTED = Counter('admission_rejected_total', 'Requests refused by admission control.', ('reason',))
+ENCODE_SECONDS = Histogram('image_encode_seconds', 'Time to encode each output image.', TIME_BUCKETS, ('format',))
+NEAR_DUPLICATE_LOOKUPS = Counter('near_duplicate_lookups_total', 'Perceptual-hash lookups after a result cache miss.', ('result',))
+JOBS_FINISHED = Counter('image_jobs_total', 'Background jobs finished, by lane and final status.', ('lane', 'status'))
+JOB_WAIT_SECONDS = Histogram('image_job_wait_seconds', 'Time a background job waited in the queue.', TIME_BUCKETS, ('lane',))
+FRAME_PIXELS = Histogram('image_frame_pixels', 'Pixels in each decoded frame.', PIXEL_BUCKETS)
+
+
+# Times the enclosed block into image_stage_seconds{stage=name}
+class _Stage:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        STAGE_SECONDS.observe(time.perf_counter() - self.start, stage=self.name)
+        return False
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+def stage(name):
+    if not ENABLED:
+        return _NULL_STAGE
+    return _Stage(name)
+
+
+# Start collecting this context's observations, returns (list, token for stop_collecting)
+def start_collecting():
+    observations = []
+    return observations, _collector.set(observations)
+
+
+def stop_collecting(token):
+    _collector.reset(token)
+
+
+# Feed observations made in another process into this one's metrics
+def replay(observations):
+    for name, labels, value in observations:
+        metric = _registry.get(name)
+        if metric is not None:
+            metric.observe(value, **labels)
+
+
+# Server-Timing header value from a request's observations (stages summed by name)
+def server_timing(observations):
+    totals = OrderedDict()
+    for name, labels, value in observations:
+        if name == STAGE_SECONDS.name:
+            totals[labels['stage']] = totals.get(labels['stage'], 0) + value
+    return ', '.join(f'{stage_name};dur={seconds * 1000:.2f}' for stage_name, seconds in totals.items())
+
+
+# Prometheus text exposition format
+def render_prometheus():
+    lines = []
+    for metric in _registry.values():
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,132 @@
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+# dHash size: a 9x8 grayscale thumbnail gives 8 horizontal gradients per row, 64 bits
+HASH_BITS = 64
+_HASH_WIDTH = 9
+_HASH_HEIGHT = 8
+
+
+# Difference hash of an upload: decode small and gray (libjpeg decodes JPEGs at 1/8
+# scale straight away), shrink to 9x8 and keep one bit per left/right brightness
+# step. Re-encoding at another quality or changing metadata moves only a few bits.
+# Returns None if the image can't be decoded.
+def dhash(data):
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if image is None or image.size == 0:
+        return None
+    small = cv2.resize(image, (_HASH_WIDTH, _HASH_HEIGHT), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).reshape(-1)
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+# (shift, mask) of `count` near-equal slices of the 64 bit hash
+def _chunk_layout(count):
+    layout = []
+    shift = 0
+    for i in range(count):
+        width = HASH_BITS // count + (1 if i < HASH_BITS % count else 0)
+        layout.append((shift, (1 << width) - 1))
+        shift += width
+    return layout
+
+
+# In-memory near-duplicate index with multi-index hashing. The hash is cut into
+# max_distance + 1 slices with one exact-match table each, and two hashes within
+# max_distance bits must agree on at least one slice (pigeonhole), so a lookup
+# only compares against the entries that share a slice instead of all of them.
+# Entries are keyed by (group, hash) and map to the image digest they came from.
+# The group (format and dimensions) has to match as well, since outputs depend on
+# both, and the same hash in two groups is two entries. Bounded by max_entries,
+# the least recently used entries go first.
+class NearDuplicateIndex:
+    def __init__(self, max_distance=4, max_entries=1000000):
+        if not 0 <= max_distance < HASH_BITS:
+            raise ValueError(f"max_distance must be between 0 and {HASH_BITS - 1}.")
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self.layout = _chunk_layout(max_distance + 1)
+        self.tables = [{} for _ in self.layout]  # slice value -> set of (group, hash) keys
+        self.entries = OrderedDict()  # (group, hash) -> digest, least recently used first
+        # Interned group tuples with the number of entries using each, most
+        # entries share a handful and a group goes once its last entry does
+        self.groups = {}  # group -> [group, entries]
+        self.lock = threading.Lock()
+        self.stats = {'lookups': 0, 'hits': 0, 'misses': 0, 'evictions': 0}
+        self.hits_by_distance = [0] * (max_distance + 1)
+
+    def add(self, image_hash, group, digest):
+        with self.lock:
+            key = (group, image_hash)
+            if key in self.entries:
+                self.entries.move_to_end(key)
+            else:
+                interned = self.groups.setdefault(group, [group, 0])
+                interned[1] += 1
+                key = (interned[0], image_hash)
+                for table, part in zip(self.tables, self._slices(image_hash)):
+                    table.setdefault(part, set()).add(key)
+            self.entries[key] = digest
+            while len(self.entries) > self.max_entries:
+                self._evict()
+
+    # Digests of the indexed images in the same group within max_distance bits,
+    # nearest first, as (distance, digest)
+    def candidates(self, image_hash, group):
+        with self.lock:
+            seen = set()
+            for table, part in zip(self.tables, self._slices(image_hash)):
+                seen.update(table.get(part, ()))
+            matches = []
+            for key in seen:
+                entry_group, other = key
+                if entry_group != group:
+                    continue
+                distance = hamming(image_hash, other)
+                if distance <= self.max_distance:
+                    matches.append((distance, self.entries[key]))
+        matches.sort(key=lambda match: match[0])
+        return matches
+
+    # Lookup outcome, for the hit-rate stats. distance is None on a miss.
+    def record(self, distance):
+        with self.lock:
+            self.stats['lookups'] += 1
+            if distance is None:
+                self.stats['misses'] += 1
+            else:
+                self.stats['hits'] += 1
+                self.hits_by_distance[distance] += 1
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats, entries=len(self.entries), max_distance=self.max_distance,
+                         hits_by_distance=list(self.hits_by_distance))
+        stats['hit_rate'] = round(stats['hits'] / stats['lookups'], 4) if stats['lookups'] else 0.0
+        return stats
+
+    def _slices(self, image_hash):
+        return [(image_hash >> shift) & mask for shift, mask in self.layout]
+
+    # Caller holds the lock
+    def _evict(self):
+        key, _ = self.entries.popitem(last=False)
+        group, image_hash = key
+        for table, part in zip(self.tables, self._slices(image_hash)):
+            bucket = table.get(part)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del table[part]
+        interned = self.groups[group]
+        interned[1] -= 1
+        if not interned[1]:
+            del self.groups[group]
+        self.stats['evictions'] += 1
@@ -0,0 +1,246 @@
+import numpy as np
+import cv2
+
+from .ImageProcessor import INTERPOLATIONS, rotation_bounds, crop_box, smartcrop_size
+from .OperationRegistry import OPERATIONS
+
+# Default thumbnail box, same as ThumbnailProcessor
+THUMBNAIL_WIDTH = 200
+THUMBNAIL_HEIGHT = 200
+
+
+# One image the pipeline has to hand back (the final image or a thumbnail).
+# Every geometric operation before it is folded into a single 2x3 matrix that maps
+# decoded source pixels straight to output pixels, so it costs one warp no matter
+# how many flips/rotates/resizes were in the list.
+class PlannedOutput:
+    def __init__(self, kind, index, matrix, size, grayscale, constant_border,
+                 canvas_size=None, offset=(0, 0), spec=None, interpolation=cv2.INTER_LINEAR, color=(),
+                 source_color=()):
+        self.kind = kind  # 'final', 'thumbnail' or 'renditions'
+        self.index = index  # Position of the op in the request, None for the final image
+        self.matrix = matrix  # 2x3 affine matrix, source -> output
+        self.size = size  # (width, height) of the warped content
+        self.grayscale = grayscale  # Warp from the grayscale copy of the source
+        self.constant_border = constant_border  # Black fill (rotations) instead of edge replicate
+        self.canvas_size = canvas_size  # (width, height) of the letterbox canvas, if any
+        self.offset = offset  # (left, top) of the content inside the canvas
+        self.spec = spec  # The normalized op for outputs that need more than a warp (renditions)
+        self.interpolation = interpolation  # cv2 flag for the warp
+        self.color = color  # Pointwise steps run on the warped output (see ImageProcessor.ColorProcessor)
+        self.source_color = source_color  # Pointwise steps run on the source before the warp
+
+
+# Per-op 3x3 matrices. Pixel coordinates follow OpenCV's convention (pixel centres
+# on integers) so flips and 90 degree turns come out as exact integer permutations.
+def _flip_matrix(flip_code, w, h):
+    if flip_code == 1:
+        return np.array([[-1, 0, w - 1], [0, 1, 0], [0, 0, 1]], dtype=np.float64)
+    return np.array([[1, 0, 0], [0, -1, h - 1], [0, 0, 1]], dtype=np.float64)
+
+
+# Same matrix and bounds RotateProcessor computes (cached per angle and size)
+def _rotate_matrix(angle, w, h):
+    M, bound_w, bound_h = rotation_bounds(angle, w, h)
+    return np.array(M + ((0, 0, 1),)), bound_w, bound_h
+
+
+# cv2.ROTATE_90_CLOCKWISE
+def _rotate_left_matrix(w, h):
+    return np.array([[0, -1, h - 1], [1, 0, 0], [0, 0, 1]], dtype=np.float64)
+
+
+# cv2.ROTATE_90_COUNTERCLOCKWISE
+def _rotate_right_matrix(w, h):
+    return np.array([[0, 1, 0], [-1, 0, w - 1], [0, 0, 1]], dtype=np.float64)
+
+
+# Shift so the box's top-left pixel lands on 0,0
+def _crop_matrix(x, y):
+    return np.array([[1, 0, -x], [0, 1, -y], [0, 0, 1]], dtype=np.float64)
+
+
+# Scale matching cv2.resize's pixel-centre mapping
+def _scale_matrix(new_w, new_h, w, h):
+    sx = new_w / w
+    sy = new_h / h
+    return np.array([[sx, 0, 0.5 * (sx - 1)], [0, sy, 0.5 * (sy - 1)], [0, 0, 1]], dtype=np.float64)
+
+
+# Scale from the frame that a rendition box needs ('crop' fills the box, the other
+# fit modes fit inside it)
+def _rendition_scale(box, fit, w, h):
+    if fit == 'crop':
+        return max(box[0] / w, box[1] / h)
+    return min(box[0] / w, box[1] / h)
+
+
+# Planner state while walking the op list: the composed transform and the size of
+# the frame so far. There is one step method per OperationRegistry plan name.
+# locate(transform, w, h, crop_w, crop_h) places a smart crop in the frame so far
+# (see plan_operations).
+class _PlanState:
+    def __init__(self, width, height, locate=None):
+        self.locate = locate
+        self.outputs = []
+        self.transform = np.eye(3)
+        self.w, self.h = width, height
+        self.gray = False  # A grayscale op has been seen
+        self.rotated = False
+        self.interpolation = None  # Tier of the rotates so far, None until there is one
+        self.color = []  # Composed pointwise steps so far, (kind, value)
+        self.source_color = ()  # Steps that came before an arbitrary rotate
+
+    def _output(self, kind, index, transform, size, **kwargs):
+        return PlannedOutput(kind, index, transform[:2], size, self.gray, self.rotated,
+                             interpolation=INTERPOLATIONS[self.interpolation or 'linear'],
+                             color=tuple(self.color), source_color=self.source_color, **kwargs)
+
+    def flip(self, op, i):
+        self.transform = _flip_matrix(op['flip_code'], self.w, self.h) @ self.transform
+
+    def rotate(self, op, i):
+        # Right angles are exact quarter turns (no black corners, and they stay
+        # pixel permutations), 0 and 360 are no-ops
+        degrees = op['degrees'] % 360
+        if degrees % 90 == 0:
+            for _ in range(degrees // 90):
+                self.rotate_left(op, i)
+            return
+        step, self.w, self.h = _rotate_matrix(degrees, self.w, self.h)
+        self.transform = step @ self.transform
+        self.rotated = True
+        if self.color:
+            # The corners the warp fills must stay black, so the colour steps so far
+            # move to the source (those of an earlier rotate are black as well)
+            self.source_color += tuple(self.color)
+            self.color = []
+        # One warp serves every rotate before it, the best tier asked for wins
+        tier = op.get('interpolation', 'linear')
+        self.interpolation = tier if self.interpolation is None else \
+            max(self.interpolation, tier, key=list(INTERPOLATIONS).index)
+
+    def rotate_left(self, op, i):
+        self.transform = _rotate_left_matrix(self.w, self.h) @ self.transform
+        self.w, self.h = self.h, self.w
+
+    def rotate_right(self, op, i):
+        self.transform = _rotate_right_matrix(self.w, self.h) @ self.transform
+        self.w, self.h = self.h, self.w
+
+    def resize(self, op, i):
+        new_w = int(self.w * op['percentage'] / 100)
+        new_h = int(self.h * op['percentage'] / 100)
+        if new_w < 1 or new_h < 1:
+            raise ValueError(f"Resize to {op['percentage']}% leaves an empty image.")
+        self.transform = _scale_matrix(new_w, new_h, self.w, self.h) @ self.transform
+        self.w, self.h = new_w, new_h
+
+    def grayscale(self, op, i):
+        if self.color or self.source_color:
+            # After a colour op the conversion has to wait for it, on the output
+            self.color.append(('gray', None))
+        else:
+            self.gray = True
+
+    # Tone curves chain into one lookup table and channel mixes multiply into one
+    # matrix (saturated once, at the end), so a run of them costs one pass over the
+    # output whatever its length. Pointwise ops commute with flips, turns, crops
+    # and (to within resampling) scales, so they run on the output, which is rarely
+    # bigger than the source. Not with a rotate's black corners: the ones before
+    # an arbitrary rotate run on the source (see rotate).
+    def tone(self, op, i):
+        curve = OPERATIONS[op['operation']].pointwise(op)
+        if self.color and self.color[-1][0] == 'tone':
+            self.color[-1] = ('tone', self.color[-1][1] + (curve,))
+        else:
+            self.color.append(('tone', (curve,)))
+
+    def color_matrix(self, op, i):
+        matrix = np.asarray(OPERATIONS[op['operation']].pointwise(op), dtype=np.float64)
+        if self.color and self.color[-1][0] == 'matrix':
+            self.color[-1] = ('matrix', matrix @ self.color[-1][1])
+        else:
+            self.color.append(('matrix', matrix))
+
+    # A crop is one more translation in the composed transform, so the warp only
+    # ever computes the pixels inside the box
+    def crop(self, op, i):
+        box = crop_box(op['x'], op['y'], op['width'], op['height'], self.w, self.h)
+        if box is None:
+            raise ValueError(f"Crop box at {op['x']},{op['y']} lies outside the {self.w}x{self.h} image.")
+        x, y, self.w, self.h = box
+        self.transform = _crop_matrix(x, y) @ self.transform
+
+    # Centred until the pixels are there to look at, the size never depends on them
+    def smartcrop(self, op, i):
+        crop_w, crop_h = smartcrop_size(op['aspect'], self.w, self.h)
+        if self.locate is None:
+            x, y = (self.w - crop_w) // 2, (self.h - crop_h) // 2
+        else:
+            x, y = self.locate(self.transform, self.w, self.h, crop_w, crop_h)
+        self.transform = _crop_matrix(x, y) @ self.transform
+        self.w, self.h = crop_w, crop_h
+
+    def thumbnail(self, op, i):
+        # Fit inside the box keeping the aspect ratio, then letterbox
+        w, h = self.w, self.h
+        scaling_factor = min(THUMBNAIL_WIDTH / w, THUMBNAIL_HEIGHT / h)
+        new_size = (int(w * scaling_factor), int(h * scaling_factor))
+        left = (THUMBNAIL_WIDTH - new_size[0]) // 2
+        top = (THUMBNAIL_HEIGHT - new_size[1]) // 2
+        thumb_transform = _scale_matrix(new_size[0], new_size[1], w, h) @ self.transform
+        self.outputs.append(self._output('thumbnail', i, thumb_transform, new_size,
+                                         canvas_size=(THUMBNAIL_WIDTH, THUMBNAIL_HEIGHT), offset=(left, top)))
+
+    def renditions(self, op, i):
+        # The frame at this point is rendered once and the pyramid is built from it.
+        # When even the largest rendition needs at most half of it, the frame is
+        # rendered at half size: a 1/2 bilinear warp averages exactly 2x2 pixels,
+        # the same as area interpolation, and it lets a JPEG take a scaled decode.
+        w, h = self.w, self.h
+        frame_w, frame_h = w, h
+        frame_transform = self.transform
+        if max(_rendition_scale(box, op['fit'], w, h) for box in op['sizes']) <= 0.5 and w >= 2 and h >= 2:
+            frame_w, frame_h = w // 2, h // 2
+            frame_transform = _scale_matrix(frame_w, frame_h, w, h) @ self.transform
+        self.outputs.append(self._output('renditions', i, frame_transform, (frame_w, frame_h), spec=op))
+
+    def finish(self):
+        # The final image goes first, the same order the response has always used
+        self.outputs.insert(0, self._output('final', None, self.transform, (self.w, self.h)))
+        return self.outputs
+
+
+# Compile a validated operation list into the outputs it produces. Each op is
+# dispatched to its planner step through the operation registry.
+# Pairs that cancel (rotateLeft + rotateRight, the same flip twice) drop out of the
+# composed matrix on their own, and grayscale is hoisted so it runs once on the source
+# (outputs reached before the grayscale op still warp from the colour source).
+# Colour and tone ops are composed into as few pointwise passes as the order allows.
+# Operations that depend on the pixels (smartcrop) are placed by locate, which maps
+# the transform so far onto the decoded image. Without it they are centred, which
+# gives the right sizes and scales for a plan made from the header alone.
+def plan_operations(operations, width, height, locate=None):
+    state = _PlanState(width, height, locate)
+    for i, op in enumerate(operations):
+        spec = OPERATIONS.get(op['operation'])
+        if spec is None:
+            raise ValueError(f"Invalid operation type: {op['operation']}")
+        getattr(state, spec.plan)(op, i)
+    return state.finish()
+
+
+# Point a plan at a source decoded at reduced size (scaled JPEG decode). fx/fy are
+# full-size pixels per decoded pixel; decoded pixel r covers full-size pixels
+# [f*r, f*r + f), so its centre sits at f*r + (f - 1) / 2.
+def rebase_matrix(fx, fy):
+    return np.array([[fx, 0, (fx - 1) / 2], [0, fy, (fy - 1) / 2], [0, 0, 1]], dtype=np.float64)
+
+
+# Every output of the plan re-pointed through rebase_matrix
+def rebase_plan(plan, fx, fy):
+    to_full = rebase_matrix(fx, fy)
+    for output in plan:
+        output.matrix = (np.vstack([output.matrix, [0, 0, 1]]) @ to_full)[:2]
+    return plan
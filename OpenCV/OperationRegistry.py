@@ -0,0 +1,367 @@
+import numpy as np
+
+from .Encoding import ENCODE_FORMATS
+from .ImageProcessor import FlipProcessor, RotateProcessor, GrayscaleProcessor, ResizeProcessor, \
+    ThumbnailProcessor, RotateLeftProcessor, RotateRightProcessor, RenditionProcessor, \
+    CropProcessor, SmartCropProcessor, ToneProcessor, ColorMatrixProcessor, INTERPOLATIONS, SEPIA_MATRIX, \
+    rotation_bounds, crop_box, smartcrop_size
+
+# Renditions limits and accepted fit modes (formats are the encoder's)
+MAX_RENDITIONS = 8
+MAX_RENDITION_SIZE = 4096
+RENDITION_FITS = ['letterbox', 'crop', 'fit']
+
+# Largest crop coordinate or size, and the most extreme smartcrop aspect ratio
+MAX_CROP_PIXELS = 1000000
+MAX_ASPECT = 100
+
+# Largest weight (either sign) in a channel mix matrix
+MAX_CHANNEL_WEIGHT = 4
+
+
+# A rejected operation. The message starts with the operation's 1-based position,
+# the way the API has always reported it.
+class OperationError(ValueError):
+    def __init__(self, index, message):
+        super().__init__(f"Operation {index}: {message}")
+        self.index = index
+
+
+# One parameter of an operation. types are the accepted Python types (bool never
+# passes as a number), choices a list of values or a dict mapping each value to
+# what the planner gets, minimum/maximum an inclusive range. The checked value is
+# stored under target (the name itself by default).
+class Param:
+    def __init__(self, name, label, types=None, required=False, default=None, choices=None,
+                 minimum=None, maximum=None, unit='', target=None):
+        self.name = name
+        self.label = label
+        self.types = types
+        self.required = required
+        self.default = default
+        self.choices = choices
+        self.minimum = minimum
+        self.maximum = maximum
+        self.unit = unit
+        self.target = target or name
+
+    def check(self, value):
+        if self.types is not None and (not isinstance(value, self.types) or
+                                       (isinstance(value, bool) and bool not in self.types)):
+            raise ValueError(f"{self.label} must be {_type_names(self.types)}.")
+        if self.choices is not None:
+            if not isinstance(value, str) or value not in self.choices:
+                raise ValueError(f"{self.label} must be {_choice_names(self.choices)}.")
+            if isinstance(self.choices, dict):
+                return self.choices[value]
+        if self.minimum is not None and not self.minimum <= value <= self.maximum:
+            sign = '+' if self.minimum < 0 else ''  # Signed ranges show both signs
+            raise ValueError(f"{self.label} must be between {self.minimum:{sign}}{self.unit} "
+                             f"and {self.maximum:{sign}}{self.unit}.")
+        return value
+
+
+# Everything the service knows about one operation: its parameters, the standalone
+# processor that does the same thing on its own (benchmarks, reference), the
+# OperationPlanner step that folds it into a plan, the cost model and an optional
+# final normalize hook for checks that span parameters.
+# cost(op, w, h) returns (width, height) after the op and the pixels it touches.
+# extra_output marks operations that only add outputs (thumbnails, renditions) and
+# leave the image the rest of the sequence works on alone. content marks the ones
+# whose geometry depends on the pixels (smartcrop): the planner can size them from
+# the header, but places them only once the image is decoded.
+# pointwise(op) is set for the ops that map each pixel on its own: it gives the
+# (curve name, args) of a 'tone' op or the 3x3 BGR matrix of a 'color_matrix' one,
+# which the planner composes with their neighbours.
+class OperationSpec:
+    def __init__(self, name, params=(), processor=None, plan=None, cost=None, normalize=None,
+                 extra_output=False, content=False, pointwise=None):
+        self.name = name
+        self.params = list(params)
+        self.processor = processor
+        self.plan = plan or name
+        self.cost = cost or _same_size_cost
+        self.normalize = normalize
+        self.extra_output = extra_output
+        self.content = content
+        self.pointwise = pointwise
+
+
+def _type_names(types):
+    if types == (int,):
+        return "an integer"
+    if set(types) == {int, float}:
+        return "an integer or float"
+    if types == (str,):
+        return "a string"
+    return "a " + " or ".join(t.__name__ for t in types)
+
+
+def _choice_names(choices):
+    choices = list(choices)
+    if len(choices) == 2:
+        return f"'{choices[0]}' or '{choices[1]}'"
+    return f"one of: {', '.join(choices)}"
+
+
+def _same_size_cost(op, w, h):
+    return w, h, w * h
+
+
+def _quarter_turn_cost(op, w, h):
+    return h, w, w * h
+
+
+def _rotate_cost(op, w, h):
+    degrees = op['degrees']
+    if degrees % 90 == 0:
+        return (h, w, w * h) if degrees % 180 else (w, h, w * h)
+    _, bound_w, bound_h = rotation_bounds(degrees, w, h)
+    return bound_w, bound_h, bound_w * bound_h
+
+
+def _resize_cost(op, w, h):
+    new_w = int(w * op['percentage'] / 100)
+    new_h = int(h * op['percentage'] / 100)
+    if new_w < 1 or new_h < 1:
+        raise ValueError(f"Resize to {op['percentage']}% leaves an empty image.")
+    return new_w, new_h, max(w * h, new_w * new_h)
+
+
+def _crop_cost(op, w, h):
+    box = crop_box(op['x'], op['y'], op['width'], op['height'], w, h)
+    if box is None:
+        raise ValueError(f"Crop box at {op['x']},{op['y']} lies outside the {w}x{h} image.")
+    return box[2], box[3], box[2] * box[3]
+
+
+def _smartcrop_cost(op, w, h):
+    crop_w, crop_h = smartcrop_size(op['aspect'], w, h)
+    return crop_w, crop_h, crop_w * crop_h
+
+
+def _renditions_cost(op, w, h):
+    return w, h, w * h + sum(box_w * box_h for box_w, box_h in op['sizes'])
+
+
+# Reduce the angle to 0..359, -10000 and 80 are the same turn
+def _normalize_rotate(op):
+    op['degrees'] %= 360
+    return op
+
+
+# Smartcrop aspect ratio as "16:9", [16, 9] or a number (width / height), stored
+# as the number
+def _normalize_smartcrop(op):
+    aspect = op['aspect']
+    if isinstance(aspect, str) and aspect.count(':') == 1:
+        aspect = aspect.split(':')
+        try:
+            aspect = [float(part) for part in aspect]
+        except ValueError:
+            pass
+    if isinstance(aspect, list) and len(aspect) == 2 and \
+            all(isinstance(v, (int, float)) and not isinstance(v, bool) and v > 0 for v in aspect):
+        aspect = aspect[0] / aspect[1]
+    if not isinstance(aspect, (int, float)) or isinstance(aspect, bool) or not 1 / MAX_ASPECT <= aspect <= MAX_ASPECT:
+        raise ValueError(f"Smartcrop aspect must be a ratio like '16:9', [16, 9] or 1.78, "
+                         f"between 1:{MAX_ASPECT} and {MAX_ASPECT}:1.")
+    op['aspect'] = float(aspect)
+    return op
+
+
+# Levels need the black point below the white one
+def _normalize_levels(op):
+    if op['black'] >= op['white']:
+        raise ValueError("Levels black must be below white.")
+    return op
+
+
+# Channel mix matrix as three rows of three weights, in RGB order the way clients
+# write it ([[1, 0, 0], [0, 1, 0], [0, 0, 1]] changes nothing), stored as BGR rows
+def _normalize_channel_mix(op):
+    matrix = op['matrix']
+    if not isinstance(matrix, list) or len(matrix) != 3 or not all(
+            isinstance(row, list) and len(row) == 3 and all(
+                isinstance(v, (int, float)) and not isinstance(v, bool) and
+                -MAX_CHANNEL_WEIGHT <= v <= MAX_CHANNEL_WEIGHT for v in row) for row in matrix):
+        raise ValueError(f"Channel mix matrix must be 3 rows of 3 weights between "
+                         f"-{MAX_CHANNEL_WEIGHT} and {MAX_CHANNEL_WEIGHT}.")
+    op['matrix'] = tuple(tuple(float(v) for v in reversed(row)) for row in reversed(matrix))
+    return op
+
+
+# Sepia at amount percent, blended with the identity
+def _sepia_matrix(op):
+    strength = op['amount'] / 100
+    return (1 - strength) * np.eye(3) + strength * np.array(SEPIA_MATRIX)
+
+
+# Renditions: sizes as widths (square box) or [width, height], the fit mode and
+# the output formats (None keeps the upload's format)
+def normalize_renditions(op):
+    sizes = op.get('sizes', [])
+    if not sizes or len(sizes) > MAX_RENDITIONS:
+        raise ValueError(f"Renditions need between 1 and {MAX_RENDITIONS} sizes.")
+    boxes = []
+    for size in sizes:
+        box = (size, size) if isinstance(size, int) else tuple(size)
+        if len(box) != 2 or not all(isinstance(v, int) and 1 <= v <= MAX_RENDITION_SIZE for v in box):
+            raise ValueError(f"Rendition sizes must be integers between 1 and {MAX_RENDITION_SIZE}.")
+        boxes.append(box)
+
+    fit = op.get('fit', 'letterbox')
+    if fit not in RENDITION_FITS:
+        raise ValueError(f"Rendition fit must be one of: {', '.join(RENDITION_FITS)}.")
+
+    formats = op.get('formats')
+    if formats is not None:
+        formats = [ENCODE_FORMATS.get(str(f).lower()) for f in formats]
+        if not formats or None in formats:
+            raise ValueError(f"Rendition formats must be some of: {', '.join(ENCODE_FORMATS)}.")
+    return {'operation': 'renditions', 'sizes': boxes, 'fit': fit, 'formats': formats}
+
+
+# The operations the API accepts. A new operation is one entry here plus, if it is
+# geometric in a new way, its step in OperationPlanner (a new tone curve is one
+# more entry in ImageProcessor.TONE_CURVES).
+OPERATION_SPECS = [
+    OperationSpec('flip', [
+        Param('direction', 'Flip direction', required=True,
+              choices={'horizontal': 1, 'vertical': 0}, target='flip_code'),
+    ], FlipProcessor),
+    OperationSpec('rotate', [
+        Param('degrees', 'Rotation degrees', (int,), required=True, minimum=-10000, maximum=10000),
+        Param('interpolation', 'Interpolation', default='linear', choices=list(INTERPOLATIONS)),
+    ], RotateProcessor, cost=_rotate_cost, normalize=_normalize_rotate),
+    OperationSpec('resize', [
+        Param('percentage', 'Resize percentage', (int, float), required=True, minimum=-95, maximum=500, unit='%'),
+    ], ResizeProcessor, cost=_resize_cost),
+    OperationSpec('grayscale', [], GrayscaleProcessor),
+    OperationSpec('thumbnail', [], ThumbnailProcessor, extra_output=True),
+    OperationSpec('rotateLeft', [], RotateLeftProcessor, plan='rotate_left', cost=_quarter_turn_cost),
+    OperationSpec('rotateRight', [], RotateRightProcessor, plan='rotate_right', cost=_quarter_turn_cost),
+    OperationSpec('renditions', [
+        Param('sizes', 'Rendition sizes', required=True),
+        Param('fit', 'Rendition fit'),
+        Param('formats', 'Rendition formats'),
+    ], RenditionProcessor, cost=_renditions_cost, normalize=normalize_renditions, extra_output=True),
+    OperationSpec('crop', [
+        Param('x', 'Crop x', (int,), default=0, minimum=0, maximum=MAX_CROP_PIXELS),
+        Param('y', 'Crop y', (int,), default=0, minimum=0, maximum=MAX_CROP_PIXELS),
+        Param('width', 'Crop width', (int,), required=True, minimum=1, maximum=MAX_CROP_PIXELS),
+        Param('height', 'Crop height', (int,), required=True, minimum=1, maximum=MAX_CROP_PIXELS),
+    ], CropProcessor, cost=_crop_cost),
+    OperationSpec('smartcrop', [
+        Param('aspect', 'Smartcrop aspect', required=True),
+    ], SmartCropProcessor, cost=_smartcrop_cost, normalize=_normalize_smartcrop, content=True),
+    OperationSpec('brightness', [
+        Param('amount', 'Brightness amount', (int, float), required=True, minimum=-100, maximum=100, unit='%'),
+    ], ToneProcessor, plan='tone', pointwise=lambda op: ('brightness', (op['amount'],))),
+    OperationSpec('contrast', [
+        Param('amount', 'Contrast amount', (int, float), required=True, minimum=-100, maximum=100, unit='%'),
+    ], ToneProcessor, plan='tone', pointwise=lambda op: ('contrast', (op['amount'],))),
+    OperationSpec('gamma', [
+        Param('gamma', 'Gamma', (int, float), required=True, minimum=0.1, maximum=10),
+    ], ToneProcessor, plan='tone', pointwise=lambda op: ('gamma', (op['gamma'],))),
+    OperationSpec('levels', [
+        Param('black', 'Levels black', (int,), default=0, minimum=0, maximum=255),
+        Param('white', 'Levels white', (int,), default=255, minimum=0, maximum=255),
+        Param('gamma', 'Levels gamma', (int, float), default=1.0, minimum=0.1, maximum=10),
+        Param('outputBlack', 'Levels output black', (int,), default=0, minimum=0, maximum=255, target='out_black'),
+        Param('outputWhite', 'Levels output white', (int,), default=255, minimum=0, maximum=255, target='out_white'),
+    ], ToneProcessor, plan='tone', normalize=_normalize_levels,
+        pointwise=lambda op: ('levels', (op['black'], op['white'], op['gamma'], op['out_black'], op['out_white']))),
+    OperationSpec('invert', [], ToneProcessor, plan='tone', pointwise=lambda op: ('invert', ())),
+    OperationSpec('sepia', [
+        Param('amount', 'Sepia amount', (int, float), default=100, minimum=0, maximum=100, unit='%'),
+    ], ColorMatrixProcessor, plan='color_matrix', pointwise=_sepia_matrix),
+    OperationSpec('channelMix', [
+        Param('matrix', 'Channel mix matrix', required=True),
+    ], ColorMatrixProcessor, plan='color_matrix', normalize=_normalize_channel_mix, pointwise=lambda op: op['matrix']),
+]
+
+OPERATIONS = {spec.name: spec for spec in OPERATION_SPECS}
+
+
+# Turn a spec into a validator closure, everything that doesn't depend on the
+# request (allowed names, the error texts) is worked out here once
+def compile_validator(spec):
+    name = spec.name
+    params = spec.params
+    allowed = {'operation'} | {param.name for param in params}
+    if params:
+        extra_message = f"Unknown {name} parameters: {{}}."
+    else:
+        extra_message = f"'{name}' operation does not take any parameters. Please remove the extra parameters."
+
+    def validate(op, index):
+        if len(op) > len(allowed) or not allowed.issuperset(op):
+            raise OperationError(index, extra_message.format(', '.join(sorted(set(op) - allowed))))
+        normalized = {'operation': name}
+        for param in params:
+            if param.name not in op:
+                if param.required:
+                    raise OperationError(index, f"'{param.name}' is required for {name} operation. Please check your spelling or syntax.")
+                if param.default is not None:
+                    normalized[param.target] = param.default
+                continue
+            try:
+                normalized[param.target] = param.check(op[param.name])
+            except (ValueError, TypeError) as e:
+                raise OperationError(index, str(e))
+        if spec.normalize is not None:
+            try:
+                normalized = spec.normalize(normalized)
+            except (ValueError, TypeError) as e:
+                raise OperationError(index, str(e) if isinstance(e, ValueError) else f"Invalid {name} parameters.")
+        return normalized
+
+    return validate
+
+
+# Compiled once at import
+VALIDATORS = {name: compile_validator(spec) for name, spec in OPERATIONS.items()}
+
+
+# Check a client's operation list and resolve defaults, so the planner only sees
+# clean values. Raises OperationError (a ValueError) for the first bad operation.
+def normalize_operations(operations):
+    if not isinstance(operations, list):
+        raise ValueError("Operations must be a JSON list.")
+    normalized = []
+    for index, op in enumerate(operations, start=1):
+        if not isinstance(op, dict):
+            raise OperationError(index, "Each operation must be a JSON object.")
+        validate = VALIDATORS.get(op.get('operation'))
+        if validate is None:
+            raise OperationError(index, f"Unknown operation type: {op.get('operation')}. Please check the operation type and parameters.")
+        normalized.append(validate(op, index))
+    return normalized
+
+
+# Pixels the op list touches on a width x height source if every op ran on its own
+# (pixel count x ops, the planner usually does much less). Works from the header
+# alone, so an over-budget request is refused before anything is decoded. So is
+# one whose geometry doesn't fit the image (a crop outside it), as OperationError.
+def estimate_cost(operations, width, height):
+    return sum(pixels for _, _, pixels in _walk_sizes(operations, width, height))
+
+
+# (width, height) of the final image of a normalized op list on a width x height source
+def final_size(operations, width, height):
+    w, h = width, height
+    for w, h, _ in _walk_sizes(operations, width, height):
+        pass
+    return w, h
+
+
+# (width, height, pixels touched) after each op
+def _walk_sizes(operations, width, height):
+    w, h = width, height
+    for index, op in enumerate(operations, start=1):
+        try:
+            w, h, pixels = OPERATIONS[op['operation']].cost(op, w, h)
+        except ValueError as e:
+            raise OperationError(index, str(e))
+        yield w, h, pixels
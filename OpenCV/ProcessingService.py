@@ -1,97 +1,458 @@
+import os
+import json
+import time
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import cv2
-import io
-from imghdr import what
-from datetime import datetime  # For generating unique filenames
 
 # Import the image processing classes
-from .ImageProcessor import FlipProcessor,  \
-RotateProcessor, GrayscaleProcessor, \
-ResizeProcessor, ThumbnailProcessor, \
-RotateLeftProcessor, RotateRightProcessor
-
-
-# Check the flip direction and convert it to the appropriate OpenCV code
-def convert_direction_to_code(direction):
-    if direction == 'horizontal':
-        return 1
-    elif direction == 'vertical':
-        return 0
+from .ImageProcessor import GrayscaleProcessor, AffineProcessor, RenditionProcessor, ColorProcessor, \
+    grayscale_shape, color_shape, smartcrop_position, SMARTCROP_ANALYSIS_SIZE
+from .OperationPlanner import plan_operations, rebase_plan, rebase_matrix
+from .OperationRegistry import OPERATIONS, normalize_operations, final_size
+from . import Metrics
+from .TiledProcessor import TiledAffineProcessor, source_box
+from .ImageIngest import sniff_image, decode_image, decode_page, reduced_decode_factor
+from .BufferPool import frame_pool
+from .FrameCache import frame_cache
+from .ResultCache import image_digest
+from .LosslessJpeg import lossless_orientation, jpegtran_transform, set_exif_orientation
+from .Encoding import ENCODE_THREADS, normalize_encoding, encode_params, submit_encode
+
+# Outputs with at least this many pixels are rendered in TILE_SIZE tiles, and from
+# SPILL_OUTPUT_PIXELS on the output frame is memory-mapped from a temp file
+TILED_OUTPUT_PIXELS = int(os.environ.get('TILED_OUTPUT_PIXELS', 16 * 1000 * 1000))
+SPILL_OUTPUT_PIXELS = int(os.environ.get('SPILL_OUTPUT_PIXELS', 64 * 1000 * 1000))
+TILE_SIZE = int(os.environ.get('TILE_SIZE', 512))
+
+# Multi-page TIFFs: how many pages are decoded and processed at the same time, and
+# the most pages one upload may have
+PAGE_PARALLELISM = int(os.environ.get('PAGE_PARALLELISM', 2))
+MAX_PAGES = int(os.environ.get('MAX_PAGES', 500))
+
+# A source box that is at most this share of the decoded frame is cut out as a
+# view before rendering (see _source_roi)
+SOURCE_ROI_SHARE = 0.9
+
+# Longest side of a preview image (see preview_operations) unless the client asks
+# for another size
+PREVIEW_SIZE = int(os.environ.get('PREVIEW_SIZE', 512))
+
+
+# Run one planned output: a single warp of the (colour or grayscale) source,
+# letterboxed onto a black canvas for thumbnails, then its colour steps. The
+# output array comes from the frame pool, returns (image, pooled array to release
+# once the image is encoded, or None). in_place=True lets a flip overwrite the
+# source when nothing after this output reads it.
+def render_output(output, source, in_place=False):
+    channels = source.shape[2:]
+    if output.canvas_size is None:
+        if in_place:
+            dst = source
+        else:
+            width, height = output.size
+            dst = frame_pool.acquire((height, width) + channels, source.dtype)
+        image = AffineProcessor(source, output.matrix, output.size, output.constant_border, dst=dst,
+                                interpolation=output.interpolation).process_image().get_image()
+        image = _apply_color(output, image, writable=image is dst or dst is source)
+        if dst is source:
+            return image, None
+        if image is dst:
+            return image, dst
+        frame_pool.release(dst)  # Identity, in-place fallback or new channels, the buffer went unused
+        return image, None
+
+    # The warp goes straight into the canvas, unless the colour steps change the
+    # number of channels (grayscale after a colour op, a mix of a gray source)
+    canvas_w, canvas_h = output.canvas_size
+    canvas_channels = color_shape(source.shape, output.color)[2:]
+    canvas = frame_pool.acquire((canvas_h, canvas_w) + canvas_channels, source.dtype, zero=True)
+    left, top = output.offset
+    content_w, content_h = output.size
+    region = canvas[top:top + content_h, left:left + content_w]
+    direct = canvas_channels == channels
+    content = AffineProcessor(source, output.matrix, output.size, output.constant_border,
+                              dst=region if direct else None,
+                              interpolation=output.interpolation).process_image().get_image()
+    content = _apply_color(output, content, writable=direct)
+    if content is not region:
+        region[...] = content.reshape(region.shape)
+    return canvas, canvas
+
+
+# The output's colour steps, written over image when it is ours to overwrite
+def _apply_color(output, image, writable):
+    if not output.color:
+        return image
+    with Metrics.stage('color'):
+        return ColorProcessor(image, output.color, dst=image if writable else None).process_image().get_image()
+
+
+# Big outputs are rendered tile by tile so scratch memory doesn't grow with the
+# frame, and really big ones are written to a memory-mapped temp file
+def use_tiles(output):
+    width, height = output.size
+    return output.canvas_size is None and width * height >= TILED_OUTPUT_PIXELS
+
+
+def render_tiled(output, source):
+    width, height = output.size
+    processor = TiledAffineProcessor(source, output.matrix, output.size, output.constant_border,
+                                     grayscale=output.grayscale, tile_size=TILE_SIZE,
+                                     spill_to_disk=width * height >= SPILL_OUTPUT_PIXELS,
+                                     interpolation=output.interpolation, color=output.color,
+                                     source_color=output.source_color)
+    return processor.process_image().get_image()
+
+
+# Sniff, plan and decode right away (so bad input fails before anything is sent),
+# then return a generator that renders and encodes one output at a time, yielding
+# (filename, encoded) with the final image first (encoded is a flat uint8 array).
+# encoding is the request's 'encoding' object (see Encoding.normalize_encoding),
+# None for the defaults.
+def stream_image_sequence(image_bytes, operations, encoding=None):
+    header = sniff_image(image_bytes)
+    operations = normalize_operations(operations)
+    encoding = normalize_encoding(encoding)
+    if header.pages > 1:
+        return _stream_pages(image_bytes, header, operations, encoding)
+
+    # With the size from the header the plan can tell whether a scaled JPEG decode
+    # is enough (only thumbnails / big downscales), which is much cheaper, or whether
+    # the JPEG can be transformed without decoding at all
+    plan = None
+    factor = 1
+    if header.width and header.height:
+        width, height = header.width, header.height
+        if header.orientation >= 5:
+            width, height = height, width  # imdecode will turn it upright
+        with Metrics.stage('plan'):
+            plan = plan_operations(operations, width, height)
+            factor = reduced_decode_factor(header, plan)
+
+        lossless = _lossless_final(image_bytes, header, plan, width, height, encoding)
+        if lossless is not None:
+            return _lossless_outputs(lossless, encoding)
+
+    source_key = (image_digest(image_bytes), 0, factor) if frame_cache.max_bytes else None
+    image = _decode_source(source_key, decode_image, image_bytes, factor)
+    h, w = image.shape[:2]
+    Metrics.FRAME_PIXELS.observe(w * h)
+
+    if factor == 1:
+        # The decoded size is the one to plan for, should the header have been off
+        if plan is None or (w, h) != (width, height):
+            plan = plan_operations(operations, w, h)
     else:
-        raise ValueError("Invalid flip direction. Must be 'horizontal' or 'vertical'.")
-
-# Validate the resize percentage   
-def validate_resize_percentage(percentage):
-    if not -95 <= percentage <= 500:
-        raise ValueError("Resize percentage must be between -95% and +500%.")
-
-# validate the rotation degrees
-def validate_rotation_degrees(degrees):
-    if not -10000 <= degrees <= 10000:
-        raise ValueError("Rotation degrees must be between -10000 and +10000.")
-
-
-# Process the image with the sequence of operations,
-# Call the appropriate classes from ImageProcessor.py
-def process_image_sequence(image_bytes, operations):
-    print("Reached the ProcessingService.py")
-    file_bytes = np.asarray(bytearray(image_bytes), dtype=np.uint8)
-    image = cv2.imdecode(file_bytes, cv2.IMREAD_COLOR)
-    
-    processed_images = []  # This will store tuples of (filename, image_bytes)
-    
-    # Determine the image format and set it to jpg if it's not recognized
-    image_format = what(io.BytesIO(image_bytes)) or 'jpg'
-    
-    # Process the image with the sequence of operations
-    for i, op in enumerate(operations):
-        operation_type = op['operation']
-        
-        if operation_type == 'flip':
-            direction = op.get('direction', 'horizontal')  # Default to horizontal if not specified
-            flip_code = convert_direction_to_code(direction)
-            image = FlipProcessor(image, flip_code).process_image().get_image()
-        
-        elif operation_type == 'rotate':
-            degrees = op.get('degrees', 0)  # Default rotation is 0 degrees
-            validate_rotation_degrees(degrees)
-            image = RotateProcessor(image, degrees).process_image().get_image()
-            
-        elif operation_type == 'grayscale':
-            image = GrayscaleProcessor(image).process_image().get_image()
-            
-        elif operation_type == 'resize':
-        
-            percentage = op.get('percentage', 100)
-            validate_resize_percentage(percentage)
-            processor = ResizeProcessor(image, percentage)
-            image = processor.process_image().get_image()
-            
-        elif operation_type == 'thumbnail':
-            thumbnail_processor = ThumbnailProcessor(image)
-            thumbnail_image = thumbnail_processor.process_image().get_image()
-            
-            # Convert thumbnail to bytes and store
-            _, thumb_buf = cv2.imencode(f'.{image_format}', thumbnail_image)
-            thumbnail_bytes = io.BytesIO(thumb_buf).getvalue()
-            thumbnails_filename = f"thumbnail_{datetime.now().strftime('%Y_%m_%d_%H-%M-%S_%f')}_{i}.{image_format}"
-            processed_images.append((thumbnails_filename, thumbnail_bytes))
-        
-        elif operation_type == 'rotateLeft':
-            image = RotateLeftProcessor(image).process_image().get_image()
-        
-        elif operation_type == 'rotateRight':
-            image = RotateRightProcessor(image).process_image().get_image()
+        if (w > h) != (width > height):
+            # Orientation applied differently than the tag said, plan for what came out
+            width, height = height, width
+            plan = plan_operations(operations, width, height)
+        plan = rebase_plan(plan, width / w, height / h)
+
+    if any(OPERATIONS[op['operation']].content for op in operations):
+        # Smart crops were centred in the header plan, now the pixels are there
+        plan_w, plan_h = (w, h) if factor == 1 else (width, height)
+        locate = _content_locator(image, plan_w / w, plan_h / h)
+        plan = rebase_plan(plan_operations(operations, plan_w, plan_h, locate), plan_w / w, plan_h / h)
+
+    shared = []  # Pooled buffers several outputs may read, released at the very end
+    return _encode_outputs(_render_plan(image, plan, header.extension, encoding, shared, source_key), encoding, shared)
+
+
+# locate callback for plan_operations (smart crops). The frame the transform so
+# far describes is warped straight from the decoded image at analysis size (fx/fy
+# are plan pixels per decoded pixel, as for rebase_plan) and searched there.
+def _content_locator(image, fx, fy):
+    def locate(transform, w, h, crop_w, crop_h):
+        # A few times the search size, smartcrop_position area-averages it down
+        scale = min(1.0, 4 * SMARTCROP_ANALYSIS_SIZE / max(w, h))
+        frame_w, frame_h = max(1, round(w * scale)), max(1, round(h * scale))
+        sx, sy = frame_w / w, frame_h / h
+        to_frame = np.array([[sx, 0, 0.5 * (sx - 1)], [0, sy, 0.5 * (sy - 1)], [0, 0, 1]])
+        matrix = (to_frame @ transform @ rebase_matrix(fx, fy))[:2]
+        with Metrics.stage('smartcrop'):
+            frame = cv2.warpAffine(image, matrix, (frame_w, frame_h), flags=cv2.INTER_LINEAR,
+                                   borderMode=cv2.BORDER_REPLICATE)
+            x, y = smartcrop_position(frame, max(1, round(crop_w * sx)), max(1, round(crop_h * sy)))
+        return min(round(x / sx), w - crop_w), min(round(y / sy), h - crop_h)
+    return locate
+
+
+# The part of the source the plan reads, as a view with every output's matrix
+# shifted to match, so the grayscale conversion and tiled renders only touch that
+# box when a crop comes early in the list. Returns (image, box), box is None when
+# the whole frame is used.
+def _source_roi(image, plan):
+    h, w = image.shape[:2]
+    boxes = []
+    for output in plan:
+        inverse = cv2.invertAffineTransform(output.matrix)
+        box = source_box(inverse, 0, 0, output.size[0], output.size[1], w, h, output.constant_border)
+        if box is not None:
+            boxes.append(box)
+    if not boxes:
+        return image, None
+    x0, y0 = min(box[0] for box in boxes), min(box[1] for box in boxes)
+    x1, y1 = max(box[2] for box in boxes), max(box[3] for box in boxes)
+    if (x1 - x0) * (y1 - y0) > SOURCE_ROI_SHARE * w * h:
+        return image, None
+    for output in plan:
+        output.matrix = output.matrix.copy()
+        output.matrix[:, 2] += output.matrix[:, :2] @ np.array([x0, y0])
+    return image[y0:y1, x0:x1], (x0, y0, x1, y1)
+
+
+# The decoded source, from the frame cache when source_key is set (and put there
+# after a miss, with the decode time as its cost)
+def _decode_source(source_key, decode, *args):
+    image = frame_cache.get(source_key) if source_key is not None else None
+    if image is None:
+        started = time.perf_counter()
+        with Metrics.stage('decode'):
+            image = decode(*args)
+        if source_key is not None:
+            image = frame_cache.put(source_key, image, time.perf_counter() - started)
+    return image
+
+
+# The grayscale conversion of the source. A cached source gets a cached conversion
+# (costed at the decode plus the conversion), anything else a pooled buffer that
+# goes back with the other shared ones.
+def _grayscale_source(image, source_key, shared):
+    if source_key is None:
+        with Metrics.stage('grayscale'):
+            gray_image = frame_pool.acquire(grayscale_shape(image.shape), image.dtype)
+            GrayscaleProcessor(image, dst=gray_image).process_image()
+        shared.append(gray_image)
+        return gray_image
+
+    gray_key = source_key + ('gray',)
+    gray_image = frame_cache.get(gray_key)
+    if gray_image is None:
+        started = time.perf_counter()
+        with Metrics.stage('grayscale'):
+            gray_image = GrayscaleProcessor(image).process_image().get_image()
+        if gray_image is not image:  # Single-channel sources are their own conversion
+            gray_image = frame_cache.put(gray_key, gray_image, time.perf_counter() - started)
+    return gray_image
+
+
+# The source run through the colour steps that come before a rotate, into a pooled
+# buffer that goes back with the other shared ones when the shape allows
+def _color_source(source, steps, shared):
+    with Metrics.stage('color'):
+        dst = None
+        if color_shape(source.shape, steps) == source.shape:
+            dst = frame_pool.acquire(source.shape, source.dtype)
+        colored = ColorProcessor(source, steps, dst=dst).process_image().get_image()
+    if dst is not None:
+        if colored is dst:
+            shared.append(dst)
         else:
-            raise ValueError(f"Invalid operation type: {operation_type}")
-
-    # Convert the final processed image back to bytes
-    _, final_buf = cv2.imencode(f'.{image_format}', image)
-    final_image_bytes = io.BytesIO(final_buf).getvalue()
-    
-    # Store the final processed image with datetime to differentiate
-    final_filename = f"final_processed_image_{datetime.now().strftime('%Y_%m_%d_%H-%M-%S_%f')}.{image_format}"
-    processed_images.insert(0, (final_filename, final_image_bytes))  # Ensure the final image is the first in the list
-
-    # Return the list of processed images
-    return processed_images
+            frame_pool.release(dst)
+    return colored
+
+
+# The op list for a preview of the final image: the same operations without the
+# ones that only add outputs (thumbnails, renditions), plus a last resize down to
+# max_side pixels on the long side. The downscale is folded into the single warp
+# like any other op, so the plan asks for a 1/8 JPEG decode of a 24 MP upload and
+# every geometric step runs on the small frame with its parameters scaled to match.
+# Takes and returns the op list as the client sent it, width x height is the
+# upright source size.
+def preview_operations(operations, width, height, max_side=PREVIEW_SIZE):
+    final_w, final_h = final_size(normalize_operations(operations), width, height)
+    preview = [op for op in operations if not OPERATIONS[op['operation']].extra_output]
+    if max(final_w, final_h) > max_side:
+        # Never below one pixel on the short side of a very narrow image
+        percentage = max(100 * max_side / max(final_w, final_h), 100 / min(final_w, final_h))
+        preview.append({'operation': 'resize', 'percentage': percentage})
+    return preview
+
+
+# Previews are encoded with the 'fast' profile in the format the client asked for
+def preview_encoding(encoding):
+    return normalize_encoding(dict(encoding or {}, profile='fast', report=False))
+
+
+# Every page of a multi-page TIFF goes through the op list on its own, with its
+# outputs under page_NNNN/ in the ZIP. The first page is decoded right away so a
+# broken file still fails before anything is sent.
+def _stream_pages(image_bytes, header, operations, encoding):
+    if header.pages > MAX_PAGES:
+        raise ValueError(f"The image has too many pages. Maximum allowed is {MAX_PAGES}.")
+    digest = image_digest(image_bytes) if frame_cache.max_bytes else None
+    first = _decode_source((digest, 0, 1) if digest is not None else None, decode_page, image_bytes, 0)
+    return _page_outputs(image_bytes, header, operations, encoding, first, digest)
+
+
+# Up to PAGE_PARALLELISM pages are decoded, rendered and encoded at the same time,
+# and their outputs come out in page order, so a long scan never has more than
+# that many pages in memory
+def _page_outputs(image_bytes, header, operations, encoding, first, digest=None):
+    pool = ThreadPoolExecutor(max_workers=PAGE_PARALLELISM, thread_name_prefix='page')
+    pending = deque()
+    try:
+        for page in range(header.pages):
+            # Each page gets its own copy of the context (metrics collector)
+            context = contextvars.copy_context()
+            pending.append(pool.submit(context.run, _process_page, image_bytes, page, first,
+                                       operations, encoding, header.extension, digest))
+            first = None
+            if len(pending) >= PAGE_PARALLELISM:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+# One page, decoded here unless it is the first one (already decoded), planned for
+# its own size. With the upload's digest its frames go through the frame cache.
+# Returns its (filename, encoded) list.
+def _process_page(image_bytes, page, image, operations, encoding, image_format, digest=None):
+    source_key = (digest, page, 1) if digest is not None else None
+    if image is None:
+        image = _decode_source(source_key, decode_page, image_bytes, page)
+    h, w = image.shape[:2]
+    Metrics.FRAME_PIXELS.observe(w * h)
+    with Metrics.stage('plan'):
+        plan = plan_operations(operations, w, h, _content_locator(image, 1, 1))
+
+    shared = []
+    prefix = f"page_{page + 1:04d}/"
+    outputs = _encode_outputs(_render_plan(image, plan, image_format, encoding, shared, source_key), encoding, shared)
+    return [(prefix + filename, encoded) for filename, encoded in outputs]
+
+
+# JPEG in and nothing but flips / quarter turns: the output is the upload with its
+# DCT coefficients moved around by jpegtran, or with just its EXIF orientation tag
+# changed when the client asked for that. Bit-exact and a fraction of the time of
+# a decode and re-encode. Returns (jpeg bytes, seconds) or None.
+def _lossless_final(image_bytes, header, plan, width, height, encoding):
+    settings = encoding['final']
+    if encoding['lossless'] == 'off' or header.format != 'JPEG':
+        return None
+    if settings.get('format', 'jpeg') != 'jpeg' or set(settings) - {'format'}:
+        return None  # Explicit quality / progressive / optimize means re-encode
+    orientation = lossless_orientation(plan, header.orientation, width, height)
+    if orientation is None:
+        return None
+
+    start = time.perf_counter()
+    data = None
+    if encoding['lossless'] == 'exif':
+        data = set_exif_orientation(image_bytes, orientation)
+    if data is None:
+        data = jpegtran_transform(image_bytes, orientation)
+    if data is None:
+        return None
+    return data, time.perf_counter() - start
+
+
+def _lossless_outputs(lossless, encoding):
+    data, seconds = lossless
+    Metrics.OUTPUT_BYTES.observe(len(data), kind='final')
+    Metrics.BYTES_OUT.inc(len(data), kind='final')
+    yield ('final_processed_image.jpeg', data)
+    if encoding['report']:
+        report = [{'file': 'final_processed_image.jpeg', 'format': 'jpeg', 'lossless': encoding['lossless'],
+                   'bytes': len(data), 'encode_ms': round(seconds * 1000, 2)}]
+        yield ('encoding_report.json', json.dumps(report, indent=2).encode('utf-8'))
+
+
+# Hands each rendered output to the encoder threads and yields the results in plan
+# order. Rendering keeps going while earlier outputs encode, but only ENCODE_THREADS
+# rendered frames wait at a time. Each output's pooled buffer goes back to the pool
+# once it is encoded (a generator dropped half way leaves them to the GC instead,
+# an encode may still be reading them).
+def _encode_outputs(rendered, encoding, shared):
+    report = [] if encoding['report'] else None
+    pending = deque()
+    for filename, image, extension, kind, pooled in rendered:
+        params = encode_params(extension, encoding[kind], encoding['profile'])
+        pending.append((filename, extension, image.shape, pooled, submit_encode(image, extension, params, kind)))
+        while len(pending) >= ENCODE_THREADS:
+            yield _finish_encode(pending.popleft(), report)
+    while pending:
+        yield _finish_encode(pending.popleft(), report)
+
+    for buffer in shared:
+        frame_pool.release(buffer)
+    if report is not None:
+        yield ('encoding_report.json', json.dumps(report, indent=2).encode('utf-8'))
+
+
+def _finish_encode(entry, report):
+    filename, extension, shape, pooled, future = entry
+    encoded, seconds = future.result()
+    frame_pool.release(pooled)
+    if report is not None:
+        report.append({'file': filename, 'format': extension, 'width': shape[1], 'height': shape[0],
+                       'bytes': len(encoded), 'encode_ms': round(seconds * 1000, 2)})
+    return (filename, encoded)
+
+
+# Renders the plan one output at a time, yielding (filename, image, extension,
+# kind, pooled buffer to release after encoding or None). source_key is set when
+# image is in the frame cache, which other requests read too.
+def _render_plan(image, plan, image_format, encoding, shared, source_key=None):
+    image, roi = _source_roi(image, plan)
+    if source_key is not None and roi is not None:
+        source_key = source_key + (roi,)  # Its grayscale conversion covers the box only
+
+    # Grayscale is hoisted to the source, so it is converted once at most
+    # (tiled outputs convert only the source boxes they read instead), and so are
+    # the colour steps before a rotate, once per chain (outputs after the same
+    # rotate share theirs)
+    gray_image = None
+    colored = {}
+
+    for output in plan:
+        pooled = None
+        with Metrics.stage(f'render_{output.kind}'):
+            if use_tiles(output):
+                result = render_tiled(output, image)
+            else:
+                if output.grayscale and gray_image is None:
+                    gray_image = _grayscale_source(image, source_key, shared)
+                source = gray_image if output.grayscale else image
+                if output.source_color:
+                    key = (output.grayscale, id(output.source_color))
+                    if key not in colored:
+                        colored[key] = _color_source(source, output.source_color, shared)
+                    source = colored[key]
+                # A lone output can flip its source in place, nothing else reads it (with
+                # more outputs an earlier one may still be encoding from the source)
+                result, pooled = render_output(output, source, in_place=len(plan) == 1 and source_key is None)
+
+        extension = encoding[output.kind].get('format', image_format)
+        if output.kind == 'renditions':
+            # Every size from one pyramid, each in every requested format
+            with Metrics.stage('renditions'):
+                renditions = RenditionProcessor(result, output.spec['sizes'], output.spec['fit']).process_image().get_renditions()
+            # The renditions can be views of the frame, it goes back after the last one
+            items = [(f"rendition_{output.index}_{box_w}x{box_h}.{rendition_extension}", rendition, rendition_extension)
+                     for (box_w, box_h), rendition in renditions
+                     for rendition_extension in output.spec['formats'] or [extension]]
+            for i, (filename, rendition, rendition_extension) in enumerate(items):
+                yield (filename, rendition, rendition_extension, output.kind, pooled if i == len(items) - 1 else None)
+            continue
+
+        # Names only depend on the request so cached responses are byte-identical
+        if output.kind == 'thumbnail':
+            filename = f"thumbnail_{output.index}.{extension}"
+        else:
+            filename = f"final_processed_image.{extension}"
+        yield (filename, result, extension, output.kind, pooled)
+
+
+# Process the image with the sequence of operations.
+# The op list is compiled by OperationPlanner into one warp per returned image,
+# the processors in ImageProcessor.py do the pixel work
+def process_image_sequence(image_bytes, operations, encoding=None):
+    # List of (filename, encoded buffer), final image first
+    return list(stream_image_sequence(image_bytes, operations, encoding))
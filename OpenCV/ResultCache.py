@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from .OperationRegistry import normalize_operations
+
+
+def image_digest(image_bytes):
+    return hashlib.sha256(image_bytes).digest()
+
+
+# Build the cache key from the image's digest and the normalized operations (registry
+# defaults filled in, angles reduced to 0..359, whole floats as ints) in canonical
+# JSON, so op lists that render the same thing share an entry however the client
+# wrote them. The operations must have passed normalize_operations already.
+def make_digest_cache_key(image_sha256, operations, *extra):
+    digest = hashlib.sha256()
+    digest.update(image_sha256)
+    canonical = _canonical(normalize_operations(operations))
+    digest.update(json.dumps(canonical, sort_keys=True, separators=(',', ':')).encode('utf-8'))
+    for value in extra:
+        digest.update(b'\0' + str(value).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _canonical(value):
+    if isinstance(value, dict):
+        return {key: _canonical(v) for key, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+# Two tier result cache: an in-process LRU bounded by bytes, and an optional
+# directory on disk bounded by total file size (least recently used files go first)
+class ResultCache:
+    def __init__(self, max_memory_bytes, cache_dir=None, max_disk_bytes=0):
+        self.max_memory_bytes = max_memory_bytes
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.memory_bytes = 0
+        self.disk_bytes = 0
+        self.stats = {'hits': 0, 'memory_hits': 0, 'disk_hits': 0, 'misses': 0,
+                      'memory_evictions': 0, 'disk_evictions': 0}
+
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self.disk_bytes = sum(size for _, size, _ in self._disk_files())
+
+    # count_miss=False leaves the miss counter alone, for extra probes after the
+    # request's own key has missed already
+    def get(self, key, count_miss=True):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+                self.stats['hits'] += 1
+                self.stats['memory_hits'] += 1
+                return value
+
+        value = self._disk_get(key)
+        with self.lock:
+            if value is None:
+                if count_miss:
+                    self.stats['misses'] += 1
+                return None
+            self.stats['hits'] += 1
+            self.stats['disk_hits'] += 1
+            self._memory_put(key, value)
+        return value
+
+    def put(self, key, value):
+        with self.lock:
+            self._memory_put(key, value)
+        self._disk_put(key, value)
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['memory_entries'] = len(self.entries)
+            stats['memory_bytes'] = self.memory_bytes
+            stats['disk_bytes'] = self.disk_bytes
+        return stats
+
+    # Caller holds the lock
+    def _memory_put(self, key, value):
+        if len(value) > self.max_memory_bytes:
+            return
+        if key in self.entries:
+            self.memory_bytes -= len(self.entries.pop(key))
+        self.entries[key] = value
+        self.memory_bytes += len(value)
+        while self.memory_bytes > self.max_memory_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.memory_bytes -= len(evicted)
+            self.stats['memory_evictions'] += 1
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.zip")
+
+    def _disk_files(self):
+        files = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.zip'):
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((path, stat.st_size, stat.st_mtime))
+        return files
+
+    def _disk_get(self, key):
+        if not self.cache_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = f.read()
+            os.utime(path)  # Mark as recently used for eviction
+        except FileNotFoundError:
+            return None
+        return value
+
+    def _disk_put(self, key, value):
+        if not self.cache_dir or len(value) > self.max_disk_bytes:
+            return
+        path = self._disk_path(key)
+        if os.path.exists(path):
+            return
+
+        # Write to a temp name first so readers never see half a file
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(value)
+        os.replace(tmp_path, path)
+
+        with self.lock:
+            self.disk_bytes += len(value)
+            if self.disk_bytes <= self.max_disk_bytes:
+                return
+            # Over budget, rescan and drop the least recently used files
+            files = sorted(self._disk_files(), key=lambda entry: entry[2])
+            self.disk_bytes = sum(size for _, size, _ in files)
+            for old_path, size, _ in files:
+                if self.disk_bytes <= self.max_disk_bytes:
+                    break
+                try:
+                    os.remove(old_path)
+                except FileNotFoundError:
+                    pass
+                self.disk_bytes -= size
+                self.stats['disk_evictions'] += 1
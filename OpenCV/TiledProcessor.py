@@ -0,0 +1,113 @@
+import tempfile
+import numpy as np
+import cv2
+
+from .ImageProcessor import ImageProcessor, GrayscaleProcessor, ColorProcessor, grayscale_shape, color_shape
+
+# Output side length of one tile, and how many pixels of context around the
+# inverse-mapped source box a sample can reach (Lanczos, the widest kernel)
+TILE_SIZE = 512
+SOURCE_MARGIN = 4
+
+
+# Output frame for a tiled render. Large outputs live in a memory-mapped temp file,
+# so finished tiles can be paged out instead of all staying resident.
+def allocate_output(width, height, channels, dtype, spill_to_disk):
+    shape = (height, width) if channels == 1 else (height, width, channels)
+    if not spill_to_disk:
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(tempfile.TemporaryFile(), dtype=dtype, mode='w+', shape=shape)
+
+
+# Bounding box (x0, y0, x1, y1) in a src_w x src_h source of what the output
+# rectangle x0..x1, y0..y1 samples through the inverse matrix, with margin for the
+# interpolation kernel. None when a constant-border warp reads nothing at all.
+def source_box(inverse, x0, y0, x1, y1, src_w, src_h, constant_border=False):
+    corners = np.array([[x0, x1 - 1, x0, x1 - 1], [y0, y0, y1 - 1, y1 - 1], [1, 1, 1, 1]], dtype=np.float64)
+    mapped = inverse @ corners
+    sx0 = int(np.floor(mapped[0].min())) - SOURCE_MARGIN
+    sx1 = int(np.ceil(mapped[0].max())) + SOURCE_MARGIN + 1
+    sy0 = int(np.floor(mapped[1].min())) - SOURCE_MARGIN
+    sy1 = int(np.ceil(mapped[1].max())) + SOURCE_MARGIN + 1
+
+    if constant_border and (sx1 <= 0 or sy1 <= 0 or sx0 >= src_w or sy0 >= src_h):
+        return None
+
+    # Clip to the source, keeping at least one pixel so edge replication still works
+    sx0 = min(max(sx0, 0), src_w - 1)
+    sy0 = min(max(sy0, 0), src_h - 1)
+    sx1 = max(min(sx1, src_w), sx0 + 1)
+    sy1 = max(min(sy1, src_h), sy0 + 1)
+    return sx0, sy0, sx1, sy1
+
+
+# Composed affine transform rendered one output tile at a time. For each tile the
+# output corners are mapped back into the source (inverse mapping), only that box
+# of the source is converted (grayscale, colour steps before a rotate), warped and
+# run through the colour steps, and the result goes straight into the tile's slice
+# of the output. Peak scratch memory is a couple of tiles,
+# whatever the image size, and arbitrary rotations work the same way as resizes.
+class TiledAffineProcessor(ImageProcessor):
+    def __init__(self, image, matrix, size, constant_border=False, grayscale=False,
+                 tile_size=TILE_SIZE, spill_to_disk=False, interpolation=cv2.INTER_LINEAR, color=(),
+                 source_color=()):
+        super().__init__(image)
+        self.matrix = np.asarray(matrix, dtype=np.float64)
+        self.size = size  # (width, height)
+        self.constant_border = constant_border
+        self.grayscale = grayscale  # Convert each source box to gray before warping
+        self.tile_size = tile_size
+        self.spill_to_disk = spill_to_disk
+        self.interpolation = interpolation
+        self.color = color  # Pointwise steps for each warped tile (see ColorProcessor)
+        self.source_color = source_color  # Pointwise steps for each source box, before the warp
+
+    def process_image(self):
+        src_h, src_w = self.image.shape[:2]
+        out_w, out_h = self.size
+        warped_shape = grayscale_shape(self.image.shape) if self.grayscale else self.image.shape
+        warped_shape = color_shape(warped_shape, self.source_color)
+        shape = color_shape(warped_shape, self.color)
+        channels = shape[2] if len(shape) == 3 else 1
+        output = allocate_output(out_w, out_h, channels, self.image.dtype, self.spill_to_disk)
+
+        inverse = cv2.invertAffineTransform(self.matrix)
+        border = cv2.BORDER_CONSTANT if self.constant_border else cv2.BORDER_REPLICATE
+
+        for y0 in range(0, out_h, self.tile_size):
+            y1 = min(y0 + self.tile_size, out_h)
+            for x0 in range(0, out_w, self.tile_size):
+                x1 = min(x0 + self.tile_size, out_w)
+                tile = output[y0:y1, x0:x1]
+
+                box = source_box(inverse, x0, y0, x1, y1, src_w, src_h, self.constant_border)
+                if box is None:
+                    # Entirely outside the source (rotation corners)
+                    if self.color:
+                        black = np.zeros((y1 - y0, x1 - x0) + warped_shape[2:], dtype=self.image.dtype)
+                        tile[...] = self._color(black).reshape(tile.shape)
+                    else:
+                        tile[...] = 0
+                    continue
+                sx0, sy0, sx1, sy1 = box
+
+                source = self.image[sy0:sy1, sx0:sx1]
+                if self.grayscale:
+                    source = GrayscaleProcessor(source).process_image().get_image()
+                if self.source_color:
+                    source = ColorProcessor(source, self.source_color).process_image().get_image()
+
+                # Same transform, shifted so the source box and the tile both start at 0,0
+                tile_matrix = self.matrix.copy()
+                tile_matrix[:, 2] += self.matrix[:, :2] @ np.array([sx0, sy0]) - np.array([x0, y0])
+                warped = cv2.warpAffine(source, tile_matrix, (x1 - x0, y1 - y0),
+                                        flags=self.interpolation, borderMode=border)
+                tile[...] = self._color(warped).reshape(tile.shape)
+
+        self.image = output
+        return self
+
+    def _color(self, warped):
+        if not self.color:
+            return warped
+        return ColorProcessor(warped, self.color, dst=warped).process_image().get_image()
@@ -0,0 +1,58 @@
+import time
+
+import cv2
+import numpy as np
+
+from .Encoding import ENCODE_FORMATS
+from .ImageProcessor import INTERPOLATIONS
+from .ProcessingService import process_image_sequence
+
+# Sample sizes: small enough to take milliseconds, big enough that OpenCV's
+# parallel kernels split the work and start their thread pool
+WARM_UP_WIDTH = 640
+WARM_UP_HEIGHT = 480
+
+# Between them these reach every kernel a request can: flips and quarter turns,
+# grayscale, a tone lookup table and a colour matrix, a downscale (JPEGs take the
+# reduced decode), an upscale, the thumbnail letterbox, the renditions pyramid and
+# a rotate at every interpolation tier
+WARM_UP_SEQUENCES = [
+    [{"operation": "flip", "direction": "horizontal"}, {"operation": "rotateLeft"},
+     {"operation": "grayscale"}, {"operation": "thumbnail"}, {"operation": "gamma", "gamma": 1.5},
+     {"operation": "sepia"}],
+    [{"operation": "resize", "percentage": 25}],
+    [{"operation": "resize", "percentage": 150},
+     {"operation": "renditions", "sizes": [64, [200, 100]], "fit": "crop"}],
+] + [[{"operation": "rotate", "degrees": 30, "interpolation": name}] for name in INTERPOLATIONS]
+
+
+# A smooth gradient rather than a flat frame, so the codecs do real work
+def _sample(channels, dtype):
+    y, x = np.mgrid[0:WARM_UP_HEIGHT, 0:WARM_UP_WIDTH]
+    peak = np.iinfo(dtype).max
+    planes = [x * peak // WARM_UP_WIDTH, y * peak // WARM_UP_HEIGHT,
+              (x + y) * peak // (WARM_UP_WIDTH + WARM_UP_HEIGHT)]
+    planes += [np.full_like(x, peak)] * (channels - 3)
+    return np.dstack(planes[:channels]).astype(dtype)
+
+
+# Run synthetic uploads through the whole pipeline once, so the first real request
+# doesn't pay for lazy initialisation: codec libraries, OpenCV's dispatch tables
+# and thread pool, the encode pool. A JPEG goes through every op sequence, the
+# other upload kinds (PNG, TIFF, 16 bit BGRA) through the first one, and the final
+# image is encoded in every output format. Returns the seconds it took.
+def warm_up():
+    started = time.perf_counter()
+    uploads = []
+    for extension, channels, dtype in (('.jpg', 3, np.uint8), ('.png', 3, np.uint8), ('.tiff', 3, np.uint8),
+                                       ('.png', 4, np.uint16)):
+        ok, buf = cv2.imencode(extension, _sample(channels, dtype))
+        if ok:
+            uploads.append(buf)
+    for operations in WARM_UP_SEQUENCES:
+        process_image_sequence(uploads[0], operations)
+    for buf in uploads[1:]:
+        process_image_sequence(buf, WARM_UP_SEQUENCES[0])
+    for image_format in set(ENCODE_FORMATS.values()):
+        process_image_sequence(uploads[0], WARM_UP_SEQUENCES[1], {'format': image_format})
+    return time.perf_counter() - started
@@ -0,0 +1,74 @@
+import zipfile
+
+from . import Metrics
+
+# Fixed timestamp for ZIP entries so identical results give identical archives
+ZIP_ENTRY_DATE = (1980, 1, 1, 0, 0, 0)
+
+
+# Write-only file object that just collects what zipfile writes. It has no tell()
+# or seek(), so zipfile switches to streaming mode (sizes go in data descriptors
+# after each entry) and never needs to go back and patch a header. Chunks are kept
+# as written (stored entries are views of the caller's buffer), drain() makes the
+# one copy into the bytes the WSGI server sends.
+class _ChunkSink:
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(data)
+        return memoryview(data).nbytes
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+# Builds a ZIP archive one entry at a time, handing back the bytes of each entry
+# as soon as it is written so the response can start before the last image is ready
+class ZipStream:
+    def __init__(self, compression=zipfile.ZIP_DEFLATED):
+        self.compression = compression
+        self.sink = _ChunkSink()
+        self.zf = zipfile.ZipFile(self.sink, 'w', compression)
+
+    # Add one file, returns the bytes to send for it. compression overrides the
+    # archive default for this entry.
+    def add(self, filename, data, compression=None):
+        info = zipfile.ZipInfo(filename, date_time=ZIP_ENTRY_DATE)
+        info.compress_type = self.compression if compression is None else compression
+        with Metrics.stage('zip'):
+            self.zf.writestr(info, data)
+        return self.sink.drain()
+
+    # Write the central directory, returns the closing bytes
+    def close(self):
+        self.zf.close()
+        return self.sink.drain()
+
+
+# Already-compressed formats: DEFLATE costs CPU and saves next to nothing
+PRECOMPRESSED_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.avif')
+
+
+# ZIP method for one entry: 'deflate', 'stored', or 'auto' (stored for payloads
+# that are compressed already, deflate for the rest)
+def entry_compression(filename, mode):
+    if mode == 'stored':
+        return zipfile.ZIP_STORED
+    if mode == 'auto' and filename.lower().endswith(PRECOMPRESSED_EXTENSIONS):
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+# Generator over the bytes of a ZIP holding the given (filename, data) entries,
+# data being bytes or any buffer (encoded numpy arrays are passed as they are)
+def stream_zip(entries, mode='deflate'):
+    archive = ZipStream()
+    for filename, data in entries:
+        yield archive.add(filename, data, entry_compression(filename, mode))
+    yield archive.close()
@@ -0,0 +1,17 @@
+# ASGI entry point for production serving, e.g.
+#   uvicorn asgi:app --host 0.0.0.0 --port 5000 --workers 2 --limit-concurrency 64 --backlog 64
+# The Flask app runs unchanged behind asgiref's WSGI adapter (on its thread pool).
+# Admission control in main.py bounds the memory in flight, and uvicorn's
+# --limit-concurrency / --backlog bound the connections queued in front of it.
+try:
+    from asgiref.wsgi import WsgiToAsgi
+except ImportError:
+    raise ImportError("ASGI mode needs asgiref and an ASGI server: pip install asgiref uvicorn")
+
+from main import app as flask_app, warm_start
+
+# Warm up before serving, and start the job queue workers with the server so
+# queued jobs resume after a restart
+warm_start()
+
+app = WsgiToAsgi(flask_app)
@@ -0,0 +1,4 @@
+# Benchmarks for the processing pipeline.
+#   python -m benchmarks.micro  - per-processor and per-sequence timings on synthetic images
+#   python -m benchmarks.load   - concurrent requests against the Flask app
+# Both print (or write with --output) a JSON report that can be compared across commits.
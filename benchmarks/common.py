@@ -0,0 +1,139 @@
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+import cv2
+
+# Synthetic image sizes in megapixels, 4:3 like most camera output
+SIZES_MP = [0.3, 2, 12, 24]
+
+# Operation mixes shared by both benchmarks
+OPERATION_MIXES = {
+    # Same list as ClientSide/PythonTestFiles/generic.py
+    'generic': [
+        {"operation": "flip", "direction": "horizontal"},
+        {"operation": "rotate", "degrees": 187},
+        {"operation": "grayscale"},
+        {"operation": "resize", "percentage": 400},
+        {"operation": "thumbnail"},
+        {"operation": "rotateLeft"},
+        {"operation": "rotateRight"},
+    ],
+    'thumbnail': [
+        {"operation": "thumbnail"},
+    ],
+    'downscale': [
+        {"operation": "resize", "percentage": 25},
+        {"operation": "thumbnail"},
+    ],
+    # A crop early on, everything after it works on the box only
+    'crop': [
+        {"operation": "crop", "x": 100, "y": 100, "width": 400, "height": 300},
+        {"operation": "grayscale"},
+        {"operation": "rotate", "degrees": 30},
+        {"operation": "thumbnail"},
+    ],
+    # A tone chain and a colour matrix, one pass over the output each
+    'color': [
+        {"operation": "resize", "percentage": 50},
+        {"operation": "brightness", "amount": 10},
+        {"operation": "contrast", "amount": 20},
+        {"operation": "gamma", "gamma": 1.8},
+        {"operation": "sepia", "amount": 60},
+        {"operation": "thumbnail"},
+    ],
+    # 20 geometric ops, the worst case the API accepts
+    'geometric20': [
+        {"operation": "flip", "direction": "horizontal"},
+        {"operation": "rotateLeft"},
+        {"operation": "rotate", "degrees": 15},
+        {"operation": "rotateRight"},
+        {"operation": "flip", "direction": "vertical"},
+    ] * 4,
+}
+
+
+def dimensions_for(megapixels):
+    width = int(round((megapixels * 1e6 * 4 / 3) ** 0.5))
+    height = int(round(width * 3 / 4))
+    return width, height
+
+
+# Smooth noise so the encoders see something photo-like rather than pure noise
+def synthetic_image(megapixels, channels=3, seed=0):
+    width, height = dimensions_for(megapixels)
+    rng = np.random.default_rng(seed)
+    small = rng.integers(0, 256, (max(1, height // 16), max(1, width // 16), channels), dtype=np.uint8)
+    image = cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+    if channels == 1:
+        image = image.reshape(height, width)
+    return image
+
+
+def encode(image, extension):
+    ok, buf = cv2.imencode(f'.{extension}', image)
+    if not ok:
+        raise RuntimeError(f"Could not encode synthetic image as {extension}")
+    return buf.tobytes()
+
+
+# Nearest-rank percentile over a list of samples
+def percentile(samples, pct):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    rank = max(0, int(np.ceil(pct / 100 * len(ordered))) - 1)
+    return ordered[rank]
+
+
+def summarize(samples):
+    return {
+        'count': len(samples),
+        'mean_ms': round(1000 * sum(samples) / len(samples), 3) if samples else None,
+        'p50_ms': round(1000 * percentile(samples, 50), 3) if samples else None,
+        'p95_ms': round(1000 * percentile(samples, 95), 3) if samples else None,
+        'p99_ms': round(1000 * percentile(samples, 99), 3) if samples else None,
+    }
+
+
+# Peak resident set size of this process in MB (ru_maxrss is KB on Linux, bytes on macOS)
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return round(peak / (1024 * 1024), 1)
+    return round(peak / 1024, 1)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Header shared by every report so runs on different commits/machines line up
+def run_info():
+    return {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'opencv': cv2.__version__,
+        'numpy': np.__version__,
+        'cpu_count': os.cpu_count(),
+        'cv2_threads': cv2.getNumThreads(),
+    }
+
+
+def write_report(report, output):
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
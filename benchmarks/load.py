@@ -0,0 +1,147 @@
+import argparse
+import itertools
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from .common import OPERATION_MIXES, synthetic_image, encode, summarize, peak_rss_mb, run_info, write_report
+
+
+# multipart/form-data body with the image and the operations, like the clients send
+def build_request_body(image_bytes, extension, operations):
+    boundary = uuid.uuid4().hex
+    parts = [
+        f'--{boundary}\r\nContent-Disposition: form-data; name="operations"\r\n\r\n'.encode(),
+        json.dumps(operations).encode(), b'\r\n',
+        f'--{boundary}\r\nContent-Disposition: form-data; name="image"; filename="image.{extension}"\r\n'
+        f'Content-Type: application/octet-stream\r\n\r\n'.encode(),
+        image_bytes, b'\r\n',
+        f'--{boundary}--\r\n'.encode(),
+    ]
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+def send(url, body, content_type):
+    request = urllib.request.Request(url, data=body, headers={'Content-Type': content_type}, method='POST')
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        e.read()
+        status = e.code
+    except OSError:
+        status = 'connection_error'
+    return status, time.perf_counter() - start
+
+
+# Run the Flask app on a free local port in a background thread
+def start_local_server(use_cache):
+    from werkzeug.serving import make_server
+    import main as app_module
+    from OpenCV.ResultCache import ResultCache
+
+    if not use_cache:
+        # Zero byte budget: every request does the full pipeline
+        app_module.result_cache = ResultCache(0)
+    server = make_server('127.0.0.1', 0, app_module.app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f'http://127.0.0.1:{server.server_port}/process_image_sequence'
+
+
+# Peak RSS of another process (the server when it runs separately), Linux only
+def process_peak_rss_mb(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test /process_image_sequence.")
+    parser.add_argument('--url', help="Target a running server instead of starting the app in-process")
+    parser.add_argument('--server-pid', type=int, help="With --url, read the server's peak RSS from /proc")
+    parser.add_argument('--requests', type=int, default=100, help="Total requests to send")
+    parser.add_argument('--concurrency', type=int, default=4, help="Requests in flight at once")
+    parser.add_argument('--megapixels', type=float, default=2)
+    parser.add_argument('--format', default='jpg', choices=['jpg', 'png', 'tiff'])
+    parser.add_argument('--mixes', nargs='+', default=['generic'], choices=list(OPERATION_MIXES),
+                        help="Operation mixes, used round robin")
+    parser.add_argument('--variants', type=int, default=1,
+                        help="Distinct images to cycle through (more variants, fewer cache hits on a remote server)")
+    parser.add_argument('--cache', action='store_true', help="Keep the result cache on for the in-process server")
+    parser.add_argument('--output', help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+    if url is None:
+        server, url = start_local_server(args.cache)
+
+    # Build every request body up front so the client side costs as little as possible
+    bodies = []
+    for seed in range(args.variants):
+        image_bytes = encode(synthetic_image(args.megapixels, 3, seed=seed), args.format)
+        for mix in args.mixes:
+            body, content_type = build_request_body(image_bytes, args.format, OPERATION_MIXES[mix])
+            bodies.append((mix, body, content_type))
+    schedule = list(itertools.islice(itertools.cycle(bodies), args.requests))
+
+    latencies = []
+    per_mix = defaultdict(list)
+    statuses = Counter()
+    lock = threading.Lock()
+
+    def worker(item):
+        mix, body, content_type = item
+        status, elapsed = send(url, body, content_type)
+        with lock:
+            statuses[str(status)] += 1
+            if status == 200:
+                latencies.append(elapsed)
+                per_mix[mix].append(elapsed)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(worker, schedule))
+    wall = time.perf_counter() - start
+
+    if server is not None:
+        server.shutdown()
+
+    report = {
+        'benchmark': 'load',
+        'info': run_info(),
+        'config': {
+            'url': args.url or 'in-process',
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'megapixels': args.megapixels,
+            'format': args.format,
+            'mixes': args.mixes,
+            'variants': args.variants,
+            'cache': args.cache if args.url is None else None,
+        },
+        'wall_seconds': round(wall, 3),
+        'throughput_rps': round(len(latencies) / wall, 3) if wall else None,
+        'statuses': dict(statuses),
+        'latency': summarize(latencies),
+        'latency_by_mix': {mix: summarize(samples) for mix, samples in per_mix.items()},
+        'peak_rss_mb': peak_rss_mb() if args.url is None else process_peak_rss_mb(args.server_pid),
+    }
+    write_report(report, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+import argparse
+import gc
+import sys
+import urllib.error
+import urllib.request
+
+from .common import OPERATION_MIXES, synthetic_image, encode, run_info, write_report
+from .load import build_request_body, start_local_server
+
+# Sizes where the copies matter, the upload limit is lifted for the run
+MEMORY_SIZES_MP = [2, 12, 24]
+
+
+# Linux keeps a resettable high-water mark per process: writing 5 to clear_refs
+# resets VmHWM to the current RSS, so each request gets its own peak
+def _proc_status_mb(field):
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) / 1024
+    return None
+
+
+def _reset_peak_rss():
+    with open('/proc/self/clear_refs', 'w') as f:
+        f.write('5')
+
+
+# Send one request and read the response in small chunks, so the client side
+# adds next to nothing to the peak
+def send_streaming(url, body, content_type):
+    request = urllib.request.Request(url, data=body, headers={'Content-Type': content_type}, method='POST')
+    try:
+        with urllib.request.urlopen(request) as response:
+            while response.read(64 * 1024):
+                pass
+            return response.status
+    except urllib.error.HTTPError as e:
+        e.read()
+        return e.code
+
+
+# Peak RSS growth during one request, in MB above the RSS just before it
+def measure_request(url, body, content_type):
+    gc.collect()
+    _reset_peak_rss()
+    baseline = _proc_status_mb('VmRSS')
+    status = send_streaming(url, body, content_type)
+    return status, round(_proc_status_mb('VmHWM') - baseline, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peak RSS per /process_image_sequence request (Linux only).")
+    parser.add_argument('--sizes', type=float, nargs='+', default=MEMORY_SIZES_MP, help="Image sizes in megapixels")
+    parser.add_argument('--formats', nargs='+', default=['jpg', 'png'], choices=['jpg', 'png', 'tiff'])
+    parser.add_argument('--mixes', nargs='+', default=['thumbnail', 'generic'], choices=list(OPERATION_MIXES))
+    parser.add_argument('--repeat', type=int, default=3, help="Requests per case, the median peak is reported")
+    parser.add_argument('--output', help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    if not sys.platform.startswith('linux'):
+        parser.error("the memory benchmark reads /proc and only runs on Linux")
+
+    import main as app_module
+    app_module.MAX_IMAGE_SIZE = 1024 * 1024 * 1024
+    server, url = start_local_server(use_cache=False)
+
+    results = []
+    try:
+        for megapixels in args.sizes:
+            for extension in args.formats:
+                image_bytes = encode(synthetic_image(megapixels, 3), extension)
+                for mix in args.mixes:
+                    body, content_type = build_request_body(image_bytes, extension, OPERATION_MIXES[mix])
+                    send_streaming(url, body, content_type)  # Warm-up, lazy imports and pools
+                    peaks = []
+                    statuses = set()
+                    for _ in range(args.repeat):
+                        status, peak = measure_request(url, body, content_type)
+                        statuses.add(status)
+                        peaks.append(peak)
+                    peaks.sort()
+                    results.append({'mix': mix, 'megapixels': megapixels, 'format': extension,
+                                    'input_bytes': len(image_bytes), 'statuses': sorted(statuses),
+                                    'peak_rss_growth_mb': peaks[len(peaks) // 2],
+                                    'max_peak_rss_growth_mb': peaks[-1]})
+                    del body
+    finally:
+        server.shutdown()
+
+    write_report({'benchmark': 'memory', 'info': run_info(), 'repeat': args.repeat, 'requests': results},
+                 args.output)
+
+
+if __name__ == '__main__':
+    main()
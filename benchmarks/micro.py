@@ -0,0 +1,91 @@
+import argparse
+import time
+
+import cv2
+
+from OpenCV.ImageProcessor import FlipProcessor, RotateProcessor, GrayscaleProcessor, \
+    ResizeProcessor, ThumbnailProcessor, RotateLeftProcessor, RotateRightProcessor, SmartCropProcessor, \
+    ToneProcessor, ColorMatrixProcessor, SEPIA_MATRIX
+from OpenCV.ProcessingService import process_image_sequence
+
+from .common import SIZES_MP, OPERATION_MIXES, synthetic_image, encode, summarize, \
+    peak_rss_mb, run_info, write_report
+
+FORMATS = ['jpg', 'png', 'tiff']
+CHANNELS = [1, 3]
+
+# One factory per ImageProcessor subclass, each builds a processor for a frame
+PROCESSORS = {
+    'flip': lambda image: FlipProcessor(image, 1),
+    'rotate': lambda image: RotateProcessor(image, 187),
+    'rotate_nearest': lambda image: RotateProcessor(image, 187, cv2.INTER_NEAREST),
+    'rotate_180': lambda image: RotateProcessor(image, 180),
+    'grayscale': lambda image: GrayscaleProcessor(image),
+    'resize_50': lambda image: ResizeProcessor(image, 50),
+    'resize_200': lambda image: ResizeProcessor(image, 200),
+    'thumbnail': lambda image: ThumbnailProcessor(image),
+    'rotateLeft': lambda image: RotateLeftProcessor(image),
+    'rotateRight': lambda image: RotateRightProcessor(image),
+    'smartcrop': lambda image: SmartCropProcessor(image, 1.0),
+    'tone': lambda image: ToneProcessor(image, [('brightness', (10,)), ('contrast', (20,)), ('gamma', (2.2,))]),
+    'sepia': lambda image: ColorMatrixProcessor(image, SEPIA_MATRIX),
+}
+
+
+# Time fn() repeat times, after one warm-up call
+def time_call(fn, repeat):
+    samples = []
+    fn()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def bench_processors(sizes, repeat):
+    results = []
+    for megapixels in sizes:
+        for channels in CHANNELS:
+            image = synthetic_image(megapixels, channels)
+            for name, factory in PROCESSORS.items():
+                stats = time_call(lambda: factory(image).process_image(), repeat)
+                results.append(dict(processor=name, megapixels=megapixels, channels=channels, **stats))
+    return results
+
+
+def bench_sequences(sizes, formats, mixes, repeat):
+    results = []
+    for megapixels in sizes:
+        for channels in CHANNELS:
+            image = synthetic_image(megapixels, channels)
+            for extension in formats:
+                image_bytes = encode(image, extension)
+                for mix in mixes:
+                    operations = OPERATION_MIXES[mix]
+                    stats = time_call(lambda: process_image_sequence(image_bytes, operations), repeat)
+                    results.append(dict(mix=mix, megapixels=megapixels, channels=channels, format=extension,
+                                        input_bytes=len(image_bytes), **stats))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark the image processors and process_image_sequence.")
+    parser.add_argument('--sizes', type=float, nargs='+', default=SIZES_MP, help="Image sizes in megapixels")
+    parser.add_argument('--formats', nargs='+', default=FORMATS, choices=FORMATS)
+    parser.add_argument('--mixes', nargs='+', default=list(OPERATION_MIXES), choices=list(OPERATION_MIXES))
+    parser.add_argument('--repeat', type=int, default=5, help="Timed runs per case")
+    parser.add_argument('--skip-processors', action='store_true', help="Only time whole sequences")
+    parser.add_argument('--output', help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    report = {'benchmark': 'micro', 'info': run_info(), 'repeat': args.repeat}
+    if not args.skip_processors:
+        report['processors'] = bench_processors(args.sizes, args.repeat)
+    report['sequences'] = bench_sequences(args.sizes, args.formats, args.mixes, args.repeat)
+    report['peak_rss_mb'] = peak_rss_mb()
+    write_report(report, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from .common import OPERATION_MIXES, synthetic_image, encode, summarize, run_info, write_report
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in a fresh interpreter so nothing is imported or warmed yet. Only the
+# standard library is imported before main, so import_ms is the app's own cost.
+# Times are in ms, python_ms from process spawn to the first line of the script.
+CHILD_SCRIPT = """
+import io, json, os, sys, time
+started = time.time()
+with open(sys.argv[1], 'rb') as f:
+    image = f.read()
+operations = sys.argv[2]
+t0 = time.perf_counter()
+import main
+t1 = time.perf_counter()
+main.warm_start()
+t2 = time.perf_counter()
+from OpenCV.ResultCache import ResultCache
+main.result_cache = ResultCache(0)  # The second request must not be a cache hit
+client = main.app.test_client()
+requests = []
+for _ in range(2):
+    start = time.perf_counter()
+    response = client.post('/process_image_sequence', data={'image': (io.BytesIO(image), sys.argv[3]), 'operations': operations})
+    response.get_data()
+    response.close()  # Gives the admission budget back
+    requests.append((time.perf_counter() - start, response.status_code))
+print(json.dumps({
+    'python_ms': (started - float(os.environ['STARTUP_SPAWNED'])) * 1000,
+    'import_ms': (t1 - t0) * 1000,
+    'warm_start_ms': (t2 - t1) * 1000,
+    'first_request_ms': requests[0][0] * 1000,
+    'second_request_ms': requests[1][0] * 1000,
+    'status': requests[0][1],
+}))
+"""
+
+
+# One cold start: spawn the interpreter, import the app, warm_start (with or
+# without the warm-up run), then two requests
+def measure_start(image_path, extension, operations, warm):
+    env = dict(os.environ, WARM_START='1' if warm else '0', MAX_IMAGE_SIZE_MB='200',
+               STARTUP_SPAWNED=repr(time.time()))
+    output = subprocess.check_output([sys.executable, '-c', CHILD_SCRIPT, image_path, json.dumps(operations),
+                                      f'image.{extension}'], cwd=PROJECT_ROOT, env=env, text=True)
+    result = json.loads(output.strip().splitlines()[-1])
+    result['ready_ms'] = result['python_ms'] + result['import_ms'] + result['warm_start_ms']
+    result['time_to_first_response_ms'] = result['ready_ms'] + result['first_request_ms']
+    return {key: round(value, 1) if isinstance(value, float) else value for key, value in result.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold start: import, warm-up and time to first request of a new worker.")
+    parser.add_argument('--size', type=float, default=12, help="Image size in megapixels")
+    parser.add_argument('--format', default='jpg', choices=['jpg', 'png', 'tiff'])
+    parser.add_argument('--mix', default='downscale', choices=list(OPERATION_MIXES))
+    parser.add_argument('--repeat', type=int, default=3, help="Cold starts per mode")
+    parser.add_argument('--output', help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    with tempfile.NamedTemporaryFile(suffix=f'.{args.format}', delete=False) as f:
+        f.write(encode(synthetic_image(args.size), args.format))
+        image_path = f.name
+    try:
+        results = {}
+        for mode, warm in (('cold', False), ('warm', True)):
+            runs = [measure_start(image_path, args.format, OPERATION_MIXES[args.mix], warm) for _ in range(args.repeat)]
+            results[mode] = {
+                'runs': runs,
+                'ready': summarize([run['ready_ms'] / 1000 for run in runs]),
+                'first_request': summarize([run['first_request_ms'] / 1000 for run in runs]),
+                'time_to_first_response': summarize([run['time_to_first_response_ms'] / 1000 for run in runs]),
+            }
+    finally:
+        os.remove(image_path)
+
+    write_report({'run': run_info(), 'size_mp': args.size, 'format': args.format, 'mix': args.mix,
+                  'results': results}, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+# Production WSGI serving: gunicorn -c gunicorn.conf.py main:app
+# Every setting can be overridden with the matching GUNICORN_* environment variable.
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+
+# Threaded workers: OpenCV releases the GIL, and admission control in main.py
+# caps how many decoded frames are alive per worker no matter how many threads wait
+worker_class = 'gthread'
+workers = int(os.environ.get('GUNICORN_WORKERS', 2))
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+# Bound the accept queue so a burst is refused by the kernel instead of piling up
+backlog = int(os.environ.get('GUNICORN_BACKLOG', 64))
+
+# Recycle workers now and then to hand fragmented heap back to the OS
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 100))
+
+# Import the app once in the master, forked workers share the loaded modules and
+# start in milliseconds (OpenCV's threads only start in the workers, at warm-up)
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+graceful_timeout = 30
+
+
+# Warm up every worker process before it accepts connections, and start its job
+# queue workers so queued jobs resume after a restart
+def post_worker_init(worker):
+    from main import warm_start
+    warm_start()
@@ -1,20 +1,142 @@
-from flask import Flask, request, send_file, jsonify
+from flask import Flask, Request, request, send_file, jsonify, Response, stream_with_context, g, url_for
 import json
 import io
+import os
+import re
+import tempfile
+import threading
+import time
 import zipfile
-from OpenCV.ProcessingService import process_image_sequence
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from OpenCV import Metrics
+from OpenCV.ResultCache import ResultCache, image_digest, make_digest_cache_key
+from OpenCV.NearDuplicate import NearDuplicateIndex, dhash
+from OpenCV.BufferPool import frame_pool
+from OpenCV.FrameCache import frame_cache
+from OpenCV.Admission import AdmissionController, AdmissionRejected, estimate_working_set
+from OpenCV.Executor import create_executor, ExecutorBusy, ExecutorTimeout
+from OpenCV.OperationRegistry import normalize_operations, estimate_cost
+from OpenCV.ProcessingService import MAX_PAGES, PREVIEW_SIZE, preview_operations, preview_encoding
+from OpenCV.Encoding import normalize_encoding
+from OpenCV.ImageIngest import sniff_image, upload_view, SUPPORTED_FORMATS
+from OpenCV.ZipStream import ZipStream, stream_zip, entry_compression
+from OpenCV.JobQueue import JobQueue, JobFailed, JobQueueFull
+from OpenCV.Warmup import warm_up
 from werkzeug.exceptions import BadRequest
-from PIL import Image
+
+# Uploads up to UPLOAD_SPOOL_BYTES are kept in memory, bigger ones are written to
+# a temp file that upload_view memory-maps, so the image bytes are never copied
+# into a Python bytes object
+UPLOAD_SPOOL_BYTES = int(os.environ.get('UPLOAD_SPOOL_BYTES', 1024 * 1024))
+
+
+class SpoolingRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if total_content_length is not None and total_content_length <= UPLOAD_SPOOL_BYTES:
+            return io.BytesIO()
+        return tempfile.TemporaryFile('rb+')
+
 
 app = Flask(__name__)
+app.request_class = SpoolingRequest
 
-# Define a maximum image size (in bytes)
-MAX_IMAGE_SIZE = 5 * 1024 * 1024  
+# Define a maximum image size (in bytes). Large outputs are rendered in tiles
+# (see TILED_OUTPUT_PIXELS in ProcessingService), so this can be raised with
+# MAX_IMAGE_SIZE_MB for big TIFF scans and PNGs
+MAX_IMAGE_SIZE = int(float(os.environ.get('MAX_IMAGE_SIZE_MB', 5)) * 1024 * 1024)
 MAX_SIZE_IN_MB = MAX_IMAGE_SIZE / (1024 * 1024)
 
 # Only allow a maximum of 20 operations
 MAX_OPERATIONS = 20
 
+# Most pixels an op list may touch on one image, counted as if every op ran on its
+# own (OperationRegistry.estimate_cost). Jobs run in the background and get more.
+OPERATION_COST_BUDGET = int(os.environ.get('OPERATION_COST_BUDGET', 4 * 1000 * 1000 * 1000))
+
+# Result cache: in-memory LRU budget, plus an optional on-disk tier when
+# RESULT_CACHE_DIR is set
+RESULT_CACHE_MEMORY_BYTES = 64 * 1024 * 1024
+RESULT_CACHE_DIR = os.environ.get('RESULT_CACHE_DIR')
+RESULT_CACHE_DISK_BYTES = 1024 * 1024 * 1024
+result_cache = ResultCache(RESULT_CACHE_MEMORY_BYTES, RESULT_CACHE_DIR, RESULT_CACHE_DISK_BYTES)
+
+# Optional near-duplicate lookup after a result cache miss: set NEAR_DUPLICATE_DISTANCE
+# (Hamming distance between 64 bit dHashes, 4 is a good start) to serve the cached
+# result of a re-saved copy of the same image. The index keeps the hashes of up to
+# NEAR_DUPLICATE_MAX_ENTRIES images, and at most NEAR_DUPLICATE_PROBES of the
+# nearest ones are looked up in the result cache.
+NEAR_DUPLICATE_DISTANCE = int(os.environ['NEAR_DUPLICATE_DISTANCE']) if 'NEAR_DUPLICATE_DISTANCE' in os.environ else None
+NEAR_DUPLICATE_MAX_ENTRIES = int(os.environ.get('NEAR_DUPLICATE_MAX_ENTRIES', 1000000))
+NEAR_DUPLICATE_PROBES = 4
+near_duplicates = NearDuplicateIndex(NEAR_DUPLICATE_DISTANCE, NEAR_DUPLICATE_MAX_ENTRIES) \
+    if NEAR_DUPLICATE_DISTANCE is not None else None
+
+# Where process_image_sequence runs: 'inline' (request thread), 'thread' or 'process'.
+# Pool backends take at most PROCESSING_WORKERS + PROCESSING_QUEUE jobs at a time and
+# give up on a job after PROCESSING_TIMEOUT seconds. PROCESSING_CV2_THREADS pins
+# OpenCV's own thread count per worker (defaults to cores / workers).
+PROCESSING_EXECUTOR = os.environ.get('PROCESSING_EXECUTOR', 'inline')
+PROCESSING_WORKERS = int(os.environ.get('PROCESSING_WORKERS', os.cpu_count() or 1))
+PROCESSING_QUEUE = int(os.environ.get('PROCESSING_QUEUE', 16))
+PROCESSING_TIMEOUT = float(os.environ.get('PROCESSING_TIMEOUT', 60))
+PROCESSING_CV2_THREADS = int(os.environ['PROCESSING_CV2_THREADS']) if 'PROCESSING_CV2_THREADS' in os.environ else None
+
+executor = None
+executor_lock = threading.Lock()
+
+# Add a Server-Timing header with the per-stage durations (METRICS_ENABLED=0
+# turns all instrumentation off)
+SERVER_TIMING_ENABLED = os.environ.get('SERVER_TIMING', '0') == '1'
+
+# Accepted values for the optional 'compression' form field
+ZIP_COMPRESSION_MODES = ['deflate', 'stored', 'auto']
+
+# Admission control: requests are admitted while the sum of their estimated
+# working sets (decoded frame x operations) fits in ADMISSION_BUDGET_BYTES. Up to
+# ADMISSION_MAX_WAITING requests wait for room, at most ADMISSION_WAIT_TIMEOUT
+# seconds (then 503), anything beyond that gets an immediate 429. Both carry a
+# Retry-After of ADMISSION_RETRY_AFTER seconds.
+ADMISSION_BUDGET_BYTES = int(os.environ.get('ADMISSION_BUDGET_BYTES', 1024 * 1024 * 1024))
+ADMISSION_MAX_WAITING = int(os.environ.get('ADMISSION_MAX_WAITING', 32))
+ADMISSION_WAIT_TIMEOUT = float(os.environ.get('ADMISSION_WAIT_TIMEOUT', 10))
+ADMISSION_RETRY_AFTER = int(os.environ.get('ADMISSION_RETRY_AFTER', 2))
+admission = AdmissionController(ADMISSION_BUDGET_BYTES, ADMISSION_MAX_WAITING, ADMISSION_WAIT_TIMEOUT, ADMISSION_RETRY_AFTER)
+
+# Batch requests: total upload limit, image count limit and how many images of
+# one batch are processed at the same time
+MAX_BATCH_SIZE = 1024 * 1024 * 1024
+MAX_BATCH_SIZE_IN_MB = MAX_BATCH_SIZE / (1024 * 1024)
+MAX_BATCH_IMAGES = 5000
+BATCH_PARALLELISM = int(os.environ.get('BATCH_PARALLELISM', PROCESSING_WORKERS))
+
+# Job mode (POST /jobs): uploads, results and the SQLite queue live in JOBS_DIR.
+# Jobs whose estimated working set is above JOBS_LARGE_BYTES go to the large lane,
+# which has its own JOBS_LARGE_WORKERS so small jobs don't wait behind them. Results
+# are kept for JOBS_RESULT_TTL seconds, JOBS_TIMEOUT is the per-job limit.
+JOBS_DIR = os.environ.get('JOBS_DIR', os.path.join(tempfile.gettempdir(), 'image-jobs'))
+JOBS_RESULT_TTL = float(os.environ.get('JOBS_RESULT_TTL', 3600))
+JOBS_SMALL_WORKERS = int(os.environ.get('JOBS_SMALL_WORKERS', 2))
+JOBS_LARGE_WORKERS = int(os.environ.get('JOBS_LARGE_WORKERS', 1))
+JOBS_LARGE_BYTES = int(os.environ.get('JOBS_LARGE_BYTES', 256 * 1024 * 1024))
+JOBS_MAX_QUEUED = int(os.environ.get('JOBS_MAX_QUEUED', 1000))
+JOBS_TIMEOUT = float(os.environ.get('JOBS_TIMEOUT', 600))
+JOBS_COST_BUDGET = int(os.environ.get('JOBS_COST_BUDGET', 10 * OPERATION_COST_BUDGET))
+
+job_queue = None
+job_queue_lock = threading.Lock()
+
+# Warm start: server entry points call warm_start() before the worker takes
+# traffic, /readyz answers 503 until it has finished. WARM_START=0 skips the
+# synthetic warm-up run (the executor and job queue still start).
+WARM_START = os.environ.get('WARM_START', '1') == '1'
+worker_ready = threading.Event()
+
+# Preview mode ('preview' form field): the longest side a client may ask for, and
+# how long the preview may take before the request gives up with a 504
+MAX_PREVIEW_SIZE = 2048
+PREVIEW_TIMEOUT = float(os.environ.get('PREVIEW_TIMEOUT', 5))
+
 
 # The main route for processing an image sequence
 @app.route('/process_image_sequence', methods=['POST'])
@@ -22,43 +144,69 @@ def process_image_sequence_route():
     try:
         # Preliminary checks, returns 400 if image and opeartions is missing. Checks if 
         # image size is greater than 5MB (for now)
-        if 'image' not in request.files:
-            raise BadRequest("Image file is missing in the request.")
-        if 'operations' not in request.form:
-            raise BadRequest("Operations data is missing in the request.")
         if request.content_length > MAX_IMAGE_SIZE:
             raise BadRequest(f"Image file is too large. Maximum allowed is {MAX_SIZE_IN_MB} MB.")
+        with Metrics.stage('parse'):
+            files, form = request.files, request.form
+        if 'image' not in files:
+            raise BadRequest("Image file is missing in the request.")
+        if 'operations' not in form:
+            raise BadRequest("Operations data is missing in the request.")
 
-        image_file = request.files['image'].read()
-
-        # Image format check
-        image = Image.open(io.BytesIO(image_file))
-        image_format = image.format
-        if image_format not in ['JPEG', 'PNG', 'TIFF']:
-            raise BadRequest(f"Invalid image format. Image was {image_format}. Only JPG, PNG, and TIFF are supported.")
+        image_file = upload_view(files['image'].stream)
+        Metrics.BYTES_IN.inc(len(image_file))
 
-        # Operations count check
-        operations = json.loads(request.form['operations'])
-        if len(operations) > MAX_OPERATIONS:
-            raise BadRequest(f"Too many operations. Maximum allowed is {MAX_OPERATIONS}.")
-        
-        # Check each operation for required parameters and validity
-        for index, op in enumerate(operations, start=1):
-            check_op_parameters(op, index)
+        with Metrics.stage('validate'):
+            header = check_image_format(image_file)
+            operations = parse_operations(form['operations'])
+            check_operation_cost(header, operations, OPERATION_COST_BUDGET)
+            compression = parse_compression(form)
+            encoding = parse_encoding(form)
+            preview_size = parse_preview(form)
 
-        # Process image, return the thumbnails as well
-        processed_images = process_image_sequence(image_file, operations)
+        # Same image and same operations, send the stored archive back
+        digest = image_digest(image_file)
+        key_extra = (compression, json.dumps(encoding, sort_keys=True))
+        cache_key = make_digest_cache_key(digest, operations, *key_extra)
+        zip_bytes = result_cache.get(cache_key)
+        if zip_bytes is None and near_duplicates is not None:
+            zip_bytes = find_near_duplicate(image_file, header, digest, operations, key_extra)
+        if zip_bytes is not None:
+            return send_file(io.BytesIO(zip_bytes), mimetype='application/zip', as_attachment=True, download_name='processed_images.zip')
 
-        # Create ZIP archive in memory for processed images
-        # Can send back multiple images in a single response because of zip
-        memory_file = io.BytesIO()
-        with zipfile.ZipFile(memory_file, 'w', zipfile.ZIP_DEFLATED) as zf:
-            for filename, img_bytes in processed_images:
-                zf.writestr(filename, img_bytes)
-        memory_file.seek(0)
+        # Single images with known dimensions only, anything else gets the full result
+        if preview_size is not None and header.pages == 1 and header.width and header.height:
+            return preview_response(image_file, header, operations, preview_size, compression, encoding)
 
-        return send_file(memory_file, mimetype='application/zip', as_attachment=True, download_name='processed_images.zip')
+        # Process image, return the thumbnails as well. Decoding and planning happen
+        # here so their errors still get a JSON response, each output is then zipped
+        # and sent as soon as it is encoded.
+        # Wait for room in the memory budget (or get a fast 429/503), the budget is
+        # given back once the last byte of the response has gone out
+        cost = estimate_working_set(header, operations)
+        admission.acquire(cost)
+        try:
+            outputs = get_executor().stream(image_file, operations, timeout=PROCESSING_TIMEOUT, encoding=encoding)
+        except BaseException:
+            admission.release(cost)
+            raise
+        response = Response(stream_with_context(stream_and_cache_zip(outputs, compression, cache_key)), mimetype='application/zip')
+        response.headers['Content-Disposition'] = 'attachment; filename=processed_images.zip'
+        response.call_on_close(lambda: admission.release(cost))
+        return response
 
+    except AdmissionRejected as ar:
+        app.logger.error(f"Admission refused: {str(ar)}")
+        return jsonify({'error': str(ar)}), ar.status, {'Retry-After': str(ar.retry_after)}
+    except ExecutorBusy as eb:
+        app.logger.error(f"Executor busy: {str(eb)}")
+        return jsonify({'error': str(eb)}), 503, {'Retry-After': str(ADMISSION_RETRY_AFTER)}
+    except ExecutorTimeout as et:
+        app.logger.error(f"Processing timeout: {str(et)}")
+        return jsonify({'error': str(et)}), 504
+    except JobQueueFull as jf:
+        app.logger.error(f"Job queue full: {str(jf)}")
+        return jsonify({'error': str(jf)}), 429, {'Retry-After': str(ADMISSION_RETRY_AFTER)}
     except BadRequest as br:
         # Handle known client errors first
         app.logger.error(f"Client error: {str(br)}")
@@ -69,54 +217,465 @@ def process_image_sequence_route():
         return jsonify({'error': "An unexpected error occurred while processing the image"}), 500
     
 
-# Check each operation for required parameters and validity
-def check_op_parameters(operation, index):
-    operation_type = operation.get('operation')
-
-    # Define required parameters for each operation type
-    required_params = {
-        'flip': ['direction'],
-        'rotate': ['degrees'],
-        'resize': ['percentage'],
-        # Assuming 'thumbnail', 'grayscale', 'rotateLeft', 'rotateRight' do not have required params
-    }
-
-    if operation_type in required_params:
-        for param in required_params[operation_type]:
-            if param not in operation:
-                raise BadRequest(f"Operation {index}: '{param}' is required for {operation_type} operation. Please check your spelling or syntax.")
-
-            # Additional specific checks
-            if operation_type == 'flip':
-                direction = operation[param]
-                if direction not in ['horizontal', 'vertical']:
-                    raise BadRequest(f"Operation {index}: Flip direction must be 'horizontal' or 'vertical'.")
-            
-            if operation_type == 'rotate':
-                degrees = operation[param]
-                if not isinstance(degrees, int):
-                    raise BadRequest(f"Operation {index}: Rotation degrees must be an integer.")
-                if not -10000 <= degrees <= 10000:
-                    raise BadRequest(f"Operation {index}: Rotation degrees must be between -10000 and +10000.")
-            
-            if operation_type == 'resize':
-                percentage = operation[param]
-                if not isinstance(percentage, int) and not isinstance(percentage, float):
-                    raise BadRequest(f"Operation {index}: Resize percentage must be an integer or float.")
-                if not -95 <= percentage <= 500:
-                    raise BadRequest(f"Operation {index}: Resize percentage must be between -95% and +500%.")
-                
-    elif operation_type in ['thumbnail', 'grayscale', 'rotateLeft', 'rotateRight']:
-        # If there are parameters then tell the client that it is extra
-        if len(operation) > 1:
-            raise BadRequest(f"Operation {index}: '{operation_type}' operation does not take any parameters. Please remove the extra parameters.")
-    else:
-        raise BadRequest(f"Operation {index}: Unknown operation type: {operation_type}. Please check the operation type and parameters.")
-    
+# Preview mode: the final image is rendered at most preview_size pixels on its
+# long side (see preview_operations), within PREVIEW_TIMEOUT whatever the executor,
+# then the full-resolution result is queued as a job and the preview is sent back
+# as a small ZIP. X-Job-Id and X-Job-Url point to the full result, poll it like any
+# other job. A preview that fails queues nothing, so the client can simply retry.
+def preview_response(image_file, header, operations, preview_size, compression, encoding):
+    width, height = header.width, header.height
+    if header.orientation >= 5:
+        width, height = height, width  # imdecode will turn it upright
+    preview = preview_operations(operations, width, height, preview_size)
+    cost = admission.acquire(estimate_working_set(header, preview))
+    try:
+        outputs = get_executor().run_within(image_file, preview, PREVIEW_TIMEOUT, encoding=preview_encoding(encoding))
+    finally:
+        admission.release(cost)
+
+    params = {'operations': operations, 'compression': compression, 'encoding': encoding}
+    lane = 'large' if estimate_working_set(header, operations) > JOBS_LARGE_BYTES else 'small'
+    job_id = get_job_queue().submit(image_file, params, lane)
+
+    response = Response(b''.join(stream_zip(outputs, compression)), mimetype='application/zip')
+    response.headers['Content-Disposition'] = 'attachment; filename=preview.zip'
+    response.headers['X-Job-Id'] = job_id
+    response.headers['X-Job-Url'] = url_for('job_route', job_id=job_id)
+    return response
+
+
+# The cached result of a re-saved copy of this image (another JPEG quality, other
+# metadata), or None. Only images with the same format, size and orientation
+# qualify, so the outputs have the same names and dimensions. On a miss the image
+# is indexed, its own result is about to be cached under its digest.
+def find_near_duplicate(image_file, header, digest, operations, key_extra):
+    with Metrics.stage('phash'):
+        image_hash = dhash(image_file)
+    if image_hash is None:
+        return None
+    group = (header.format, header.width, header.height, header.orientation)
+
+    for distance, other in near_duplicates.candidates(image_hash, group)[:NEAR_DUPLICATE_PROBES]:
+        zip_bytes = result_cache.get(make_digest_cache_key(other, operations, *key_extra), count_miss=False)
+        if zip_bytes is not None:
+            near_duplicates.record(distance)
+            Metrics.NEAR_DUPLICATE_LOOKUPS.inc(result='hit')
+            return zip_bytes
+
+    near_duplicates.record(None)
+    Metrics.NEAR_DUPLICATE_LOOKUPS.inc(result='miss')
+    near_duplicates.add(image_hash, group, digest)
+    return None
+
+
+# Many images, one operation list. The operations are validated once, the images
+# are processed in parallel and the response is one streamed ZIP with a folder per
+# image plus manifest.json, where images that failed are listed with their error.
+@app.route('/process_batch', methods=['POST'])
+def process_batch_route():
+    try:
+        if 'operations' not in request.form:
+            raise BadRequest("Operations data is missing in the request.")
+        if request.content_length is not None and request.content_length > MAX_BATCH_SIZE:
+            raise BadRequest(f"Batch is too large. Maximum allowed is {MAX_BATCH_SIZE_IN_MB} MB.")
+
+        operations = parse_operations(request.form['operations'])
+        compression = parse_compression(request.form)
+        encoding = parse_encoding(request.form)
+
+        # Images either as repeated 'images' files or as one ZIP in 'archive'
+        if 'archive' in request.files:
+            uploads = [detach_upload(request.files['archive'])]
+            sources = archive_sources(uploads[0])
+        elif 'images' in request.files:
+            uploads = [detach_upload(f) for f in request.files.getlist('images')]
+            sources = [(name, lambda stream=stream: upload_view(stream)) for name, stream in uploads]
+        else:
+            raise BadRequest("Images are missing in the request. Send them as 'images' files or as a ZIP file in 'archive'.")
+
+        if len(sources) > MAX_BATCH_IMAGES:
+            raise BadRequest(f"Too many images. Maximum allowed is {MAX_BATCH_IMAGES}.")
+
+        response = Response(stream_with_context(generate_batch_zip(sources, operations, uploads, compression, encoding)), mimetype='application/zip')
+        response.headers['Content-Disposition'] = 'attachment; filename=processed_batch.zip'
+        return response
+
+    except BadRequest as br:
+        app.logger.error(f"Client error: {str(br)}")
+        return jsonify({'error': str(br)}), 400
+    except Exception as e:
+        app.logger.error(f"An unexpected error occurred: {str(e)}")
+        return jsonify({'error': "An unexpected error occurred while processing the batch"}), 500
+
+
+# Same form as /process_image_sequence, but the request returns a job id at once
+# (202) and a background worker does the processing. Poll GET /jobs/<id>.
+@app.route('/jobs', methods=['POST'])
+def submit_job_route():
+    try:
+        if request.content_length is not None and request.content_length > MAX_IMAGE_SIZE:
+            raise BadRequest(f"Image file is too large. Maximum allowed is {MAX_SIZE_IN_MB} MB.")
+        files, form = request.files, request.form
+        if 'image' not in files:
+            raise BadRequest("Image file is missing in the request.")
+        if 'operations' not in form:
+            raise BadRequest("Operations data is missing in the request.")
+
+        image_file = upload_view(files['image'].stream)
+        header = check_image_format(image_file)
+        operations = parse_operations(form['operations'])
+        check_operation_cost(header, operations, JOBS_COST_BUDGET)
+        params = {'operations': operations, 'compression': parse_compression(form), 'encoding': parse_encoding(form)}
+
+        lane = 'large' if estimate_working_set(header, operations) > JOBS_LARGE_BYTES else 'small'
+        job_id = get_job_queue().submit(image_file, params, lane)
+        location = url_for('job_route', job_id=job_id)
+        return jsonify({'job_id': job_id, 'status': 'queued', 'lane': lane, 'url': location}), 202, {'Location': location}
+
+    except JobQueueFull as jf:
+        app.logger.error(f"Job queue full: {str(jf)}")
+        return jsonify({'error': str(jf)}), 429, {'Retry-After': str(ADMISSION_RETRY_AFTER)}
+    except BadRequest as br:
+        app.logger.error(f"Client error: {str(br)}")
+        return jsonify({'error': str(br)}), 400
+    except Exception as e:
+        app.logger.error(f"An unexpected error occurred: {str(e)}")
+        return jsonify({'error': "An unexpected error occurred while queueing the job"}), 500
+
+
+# The result ZIP once the job is done, its status as JSON before that (202 while
+# queued or running, 200 with the error once failed), 404 when unknown or expired
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_route(job_id):
+    queue = get_job_queue()
+    job = queue.get(job_id)
+    if job is None:
+        return jsonify({'error': "Unknown or expired job."}), 404
+    if job['status'] == 'done':
+        try:
+            return send_file(queue.result_path(job_id), mimetype='application/zip', as_attachment=True,
+                             download_name='processed_images.zip')
+        except FileNotFoundError:
+            return jsonify({'error': "Unknown or expired job."}), 404
+    return jsonify(job), 200 if job['status'] == 'failed' else 202
+
+
+# Runs one job on a queue worker: same checks and pipeline as a direct request,
+# the ZIP goes to result_path. Client-side problems become the job's error.
+def run_job(input_path, params, result_path):
+    try:
+        with open(input_path, 'rb') as f:
+            image_file = upload_view(f)
+        header = check_image_format(image_file)
+        operations = params['operations']
+        cost = admission.acquire(estimate_working_set(header, operations), queue=False)
+        try:
+            outputs = get_executor().run(image_file, operations, timeout=JOBS_TIMEOUT, block=True, encoding=params['encoding'])
+        finally:
+            admission.release(cost)
+        with open(result_path, 'wb') as f:
+            for chunk in stream_zip(outputs, params['compression']):
+                f.write(chunk)
+    except (BadRequest, ValueError, ExecutorTimeout) as e:
+        raise JobFailed(getattr(e, 'description', None) or str(e))
+    except Exception as e:
+        app.logger.error(f"An unexpected error occurred in a job: {str(e)}")
+        raise
+
+
+# Created and started on first use like the executor. Server entry points call it at
+# startup so jobs left over from before a restart are picked up without new traffic.
+def get_job_queue():
+    global job_queue
+    with job_queue_lock:
+        if job_queue is None:
+            job_queue = JobQueue(JOBS_DIR, run_job, JOBS_RESULT_TTL, JOBS_SMALL_WORKERS, JOBS_LARGE_WORKERS, JOBS_MAX_QUEUED)
+            job_queue.start()
+    return job_queue
+
+
+# Starts the executor (process workers warm themselves up) and the job queue, and
+# runs synthetic images through every codec and kernel in this process, so the
+# first real request doesn't pay for lazy initialisation. Then reports ready.
+def warm_start():
+    started = time.perf_counter()
+    get_executor()
+    if WARM_START:
+        warm_up()
+    get_job_queue()
+    worker_ready.set()
+    app.logger.info(f"Worker ready in {time.perf_counter() - started:.2f}s")
+
+
+# Take the spooled upload stream away from its FileStorage. Werkzeug closes the
+# request's files when the view returns, but the batch is read while streaming.
+def detach_upload(file_storage):
+    stream = file_storage.stream
+    file_storage.stream = io.BytesIO()
+    return (file_storage.filename or 'image', stream)
+
+
+# (name, loader) for every file in an uploaded ZIP, read lazily one at a time
+def archive_sources(upload):
+    try:
+        archive = zipfile.ZipFile(upload[1])
+    except zipfile.BadZipFile:
+        raise BadRequest("The 'archive' upload is not a valid ZIP file.")
+    return [(info.filename, lambda info=info: archive.read(info))
+            for info in archive.infolist() if not info.is_dir()]
+
+
+# One image of a batch, checked the same way as a single upload
+def process_batch_image(image_bytes, operations, encoding=None):
+    if len(image_bytes) > MAX_IMAGE_SIZE:
+        raise BadRequest(f"Image file is too large. Maximum allowed is {MAX_SIZE_IN_MB} MB.")
+    header = check_image_format(image_bytes)
+    check_operation_cost(header, operations, OPERATION_COST_BUDGET)
+    cost = admission.acquire(estimate_working_set(header, operations), queue=False)
+    try:
+        return get_executor().run(image_bytes, operations, timeout=PROCESSING_TIMEOUT, block=True, encoding=encoding)
+    finally:
+        admission.release(cost)
+
+
+# Folder name inside the batch ZIP, numbered so duplicate names stay apart
+def batch_folder_name(index, name):
+    stem = os.path.splitext(os.path.basename(name))[0]
+    stem = re.sub(r'[^A-Za-z0-9._-]', '_', stem) or 'image'
+    return f"{index + 1:04d}_{stem}"
+
+
+# Streams the batch ZIP. Up to BATCH_PARALLELISM images are in flight and results
+# are written in upload order as soon as each one is ready.
+def generate_batch_zip(sources, operations, uploads, compression, encoding=None):
+    archive = ZipStream()
+    manifest = []
+    pending = deque()
+    pool = ThreadPoolExecutor(max_workers=BATCH_PARALLELISM, thread_name_prefix='batch')
+    try:
+        for index, (name, load) in enumerate(sources):
+            # Uploads are read here one at a time, the workers only get bytes
+            try:
+                future = pool.submit(process_batch_image, load(), operations, encoding)
+            except (OSError, zipfile.BadZipFile, zipfile.LargeZipFile) as e:
+                future = Future()
+                future.set_exception(ValueError(f"Could not read the image from the upload: {str(e)}"))
+            pending.append((index, name, future))
+            if len(pending) >= BATCH_PARALLELISM * 2:
+                yield from write_batch_result(archive, manifest, compression, *pending.popleft())
+        while pending:
+            yield from write_batch_result(archive, manifest, compression, *pending.popleft())
+
+        yield archive.add('manifest.json', json.dumps(manifest, indent=2).encode('utf-8'))
+        yield archive.close()
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+        for _, stream in uploads:
+            stream.close()
+
+
+def write_batch_result(archive, manifest, compression, index, name, future):
+    folder = batch_folder_name(index, name)
+    entry = {'index': index, 'name': name, 'folder': folder}
+    try:
+        processed_images = future.result()
+    except (BadRequest, ValueError, ExecutorTimeout) as e:
+        entry.update(status='error', error=getattr(e, 'description', None) or str(e))
+        manifest.append(entry)
+        return
+    except Exception as e:
+        app.logger.error(f"Batch image {index} ({name}) failed: {str(e)}")
+        entry.update(status='error', error="An unexpected error occurred while processing the image")
+        manifest.append(entry)
+        return
+
+    files = []
+    for filename, img_bytes in processed_images:
+        yield archive.add(f"{folder}/{filename}", img_bytes, entry_compression(filename, compression))
+        files.append(f"{folder}/{filename}")
+    entry.update(status='ok', files=files)
+    manifest.append(entry)
+
+
+# The executor is created on first use so the reloader's parent process
+# (debug mode) doesn't start its own worker pool
+def get_executor():
+    global executor
+    with executor_lock:
+        if executor is None:
+            executor = create_executor(PROCESSING_EXECUTOR, PROCESSING_WORKERS, PROCESSING_QUEUE, PROCESSING_CV2_THREADS)
+    return executor
+
+
+# Prometheus scrape endpoint: per-stage timings, request times, bytes in/out, frame sizes
+@app.route('/metrics', methods=['GET'])
+def metrics_route():
+    return Response(Metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+
+# Liveness: the process is up and answering
+@app.route('/healthz', methods=['GET'])
+def liveness_route():
+    return jsonify({'status': 'ok'})
+
+
+# Readiness: 200 once warm_start has run, 503 while the worker is still starting
+@app.route('/readyz', methods=['GET'])
+def readiness_route():
+    if not worker_ready.is_set():
+        return jsonify({'status': 'starting'}), 503
+    return jsonify({'status': 'ready'})
+
+
+# Request timing: observations are collected per request for the optional
+# Server-Timing header, the total is recorded once the last byte has gone out
+@app.before_request
+def start_request_metrics():
+    if not Metrics.ENABLED:
+        return
+    g.request_start = time.perf_counter()
+    g.observations, g.metrics_token = Metrics.start_collecting()
+
+
+@app.after_request
+def finish_request_metrics(response):
+    if not Metrics.ENABLED or 'request_start' not in g:
+        return response
+
+    # Only the stages done before the headers go out (streamed encodes come later)
+    if SERVER_TIMING_ENABLED:
+        response.headers['Server-Timing'] = Metrics.server_timing(g.observations)
+
+    start, route, status = g.request_start, request.endpoint or 'unknown', response.status_code
+    response.call_on_close(lambda: Metrics.REQUEST_SECONDS.observe(time.perf_counter() - start, route=route, status=status))
+    return response
+
+
+@app.teardown_request
+def stop_request_metrics(exc):
+    token = g.pop('metrics_token', None)
+    if token is not None:
+        Metrics.stop_collecting(token)
+
+
+# Hit/miss/eviction counters for the result cache, plus this process's frame
+# buffer pool under 'frame_pool', its decoded frame cache under 'frame_cache' and
+# the near-duplicate index (when enabled) under 'near_duplicates'
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats_route():
+    stats = dict(result_cache.get_stats(), frame_pool=frame_pool.get_stats(), frame_cache=frame_cache.get_stats())
+    if near_duplicates is not None:
+        stats['near_duplicates'] = near_duplicates.get_stats()
+    return jsonify(stats)
+
+
+# Streams the response ZIP and keeps a copy for the result cache, unless the
+# archive grows past what the cache could hold anyway
+def stream_and_cache_zip(outputs, compression, cache_key):
+    chunks = []
+    size = 0
+    try:
+        with Metrics.stage('send'):
+            for chunk in stream_zip(outputs, compression):
+                if chunks is not None:
+                    chunks.append(chunk)
+                    size += len(chunk)
+                    if size > RESULT_CACHE_MEMORY_BYTES:
+                        chunks = None
+                yield chunk
+    except Exception as e:
+        # Headers are already sent, all we can do is log and cut the response short
+        app.logger.error(f"An unexpected error occurred while streaming: {str(e)}")
+        raise
+
+    if chunks is not None:
+        result_cache.put(cache_key, b''.join(chunks))
+
+
+# ZIP method for the response: 'deflate' (default), 'stored' or 'auto' (stored for
+# JPEG/PNG payloads, which DEFLATE can't shrink)
+def parse_compression(form):
+    compression = form.get('compression', 'deflate')
+    if compression not in ZIP_COMPRESSION_MODES:
+        raise BadRequest(f"Invalid compression '{compression}'. Use one of: {', '.join(ZIP_COMPRESSION_MODES)}.")
+    return compression
+
+
+# Optional 'encoding' form field: a JSON object with the output format, quality,
+# PNG compression/strategy, JPEG progressive/optimize and a 'profile' ('default' or
+# 'fast'), optionally per output kind. Returned normalized, or None when absent.
+def parse_encoding(form):
+    if 'encoding' not in form:
+        return None
+    try:
+        return normalize_encoding(json.loads(form['encoding']))
+    except (json.JSONDecodeError, ValueError) as e:
+        raise BadRequest(f"Invalid encoding: {str(e)}")
+
+
+# Optional 'preview' form field: 'true' for a PREVIEW_SIZE preview, or the longest
+# side in pixels. Returns the size, or None when no preview was asked for.
+def parse_preview(form):
+    value = form.get('preview', '').strip().lower()
+    if value in ('', 'false', '0'):
+        return None
+    if value == 'true':
+        return PREVIEW_SIZE
+    if not value.isdigit() or not 16 <= int(value) <= MAX_PREVIEW_SIZE:
+        raise BadRequest(f"Invalid preview '{value}'. Use 'true' or a size between 16 and {MAX_PREVIEW_SIZE} pixels.")
+    return int(value)
+
+
+# Image format check from the file header (no decode), returns the ImageHeader
+def check_image_format(image_file):
+    header = sniff_image(image_file)
+    if header.format is None:
+        raise BadRequest("The uploaded file is not a recognised image. Only JPG, PNG, and TIFF are supported.")
+    if header.format not in SUPPORTED_FORMATS:
+        raise BadRequest(f"Invalid image format. Image was {header.format}. Only JPG, PNG, and TIFF are supported.")
+    if header.pages > MAX_PAGES:
+        raise BadRequest(f"The image has too many pages. Maximum allowed is {MAX_PAGES}.")
+    return header
+
+
+# Parse the operations JSON, check the count and every operation against the
+# operation registry. Returns the list as the client sent it (that is what the
+# job queue stores), the cache key and the pipeline normalize it again themselves.
+def parse_operations(operations_json):
+    try:
+        operations = json.loads(operations_json)
+    except json.JSONDecodeError:
+        raise BadRequest("Operations must be valid JSON.")
+    if isinstance(operations, list) and len(operations) > MAX_OPERATIONS:
+        raise BadRequest(f"Too many operations. Maximum allowed is {MAX_OPERATIONS}.")
+    try:
+        normalize_operations(operations)
+    except ValueError as e:
+        raise BadRequest(str(e))
+    return operations
+
+
+# Refuse op lists that would touch more than budget pixels on this image (see
+# estimate_cost), or whose geometry doesn't fit it, from the header alone so
+# nothing has been decoded yet
+def check_operation_cost(header, operations, budget):
+    if not header.width or not header.height:
+        return
+    width, height = header.width, header.height
+    if header.orientation >= 5:
+        width, height = height, width  # Operations see the upright image
+    try:
+        cost = estimate_cost(normalize_operations(operations), width, height) * header.pages
+    except ValueError as e:
+        raise BadRequest(str(e))
+    if cost > budget:
+        raise BadRequest(f"The operations are too expensive for this image ({cost / 1e6:.1f} million pixel "
+                         f"operations, the limit is {budget / 1e6:.1f} million). Use fewer or smaller operations.")
 
-    
-    
 
 # Start of application run    
 if __name__ == '__main__':
+    # Only in the reloader's child, the parent just watches files
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        warm_start()
     app.run(debug=True, threaded=True)
@@ -0,0 +1,29 @@
+import cv2
+import numpy as np
+
+from OpenCV.ProcessingService import process_image_sequence
+
+
+# A smooth but uneven BGR frame (plus alpha when channels is 4), so resampling
+# and colour errors show up without the noise of random pixels
+def sample_image(width=160, height=120, channels=3, dtype=np.uint8):
+    y, x = np.mgrid[0:height, 0:width].astype(np.float64)
+    planes = [x / width, y / height, 0.5 + 0.5 * np.sin(x / 9) * np.cos(y / 7)]
+    planes += [np.full_like(x, 0.75)] * (channels - 3)
+    peak = np.iinfo(dtype).max
+    image = np.dstack(planes[:channels]) * peak
+    return np.round(image).astype(dtype).reshape((height, width) + ((channels,) if channels > 1 else ()))
+
+
+# Run image through the pipeline as a PNG upload, returns {filename: decoded image}
+def run_pipeline(image, operations):
+    ok, data = cv2.imencode('.png', image)
+    assert ok
+    outputs = process_image_sequence(data, operations)
+    return {filename: cv2.imdecode(np.frombuffer(encoded, np.uint8), cv2.IMREAD_UNCHANGED)
+            for filename, encoded in outputs if filename.endswith('.png')}
+
+
+def max_difference(a, b):
+    assert a.shape == b.shape
+    return int(np.abs(a.astype(np.int64) - b.astype(np.int64)).max())
@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+
+from OpenCV import ProcessingService
+from OpenCV.ImageProcessor import ToneProcessor, ColorMatrixProcessor, GrayscaleProcessor, RotateProcessor, \
+    TONE_CURVES
+from OpenCV.OperationPlanner import plan_operations
+from OpenCV.OperationRegistry import OPERATIONS, normalize_operations
+
+from .helpers import sample_image, run_pipeline, max_difference
+
+FINAL = 'final_processed_image.png'
+
+
+# The reference: every op through its own processor, one pass each
+def sequential(image, operations):
+    for op in normalize_operations(operations):
+        spec = OPERATIONS[op['operation']]
+        if spec.plan == 'tone':
+            image = ToneProcessor(image, [spec.pointwise(op)]).process_image().get_image()
+        elif spec.plan == 'color_matrix':
+            image = ColorMatrixProcessor(image, spec.pointwise(op)).process_image().get_image()
+        elif op['operation'] == 'grayscale':
+            image = GrayscaleProcessor(image).process_image().get_image()
+        else:
+            image = RotateProcessor(image, op['degrees']).process_image().get_image()
+    return image
+
+
+@pytest.fixture(params=[False, True], ids=['whole', 'tiled'])
+def tiled(request, monkeypatch):
+    if request.param:
+        monkeypatch.setattr(ProcessingService, 'TILED_OUTPUT_PIXELS', 1)
+        monkeypatch.setattr(ProcessingService, 'TILE_SIZE', 64)
+    return request.param
+
+
+def test_tone_chain_is_one_table():
+    operations = [{"operation": "brightness", "amount": 10}, {"operation": "contrast", "amount": 30},
+                  {"operation": "gamma", "gamma": 2.2}, {"operation": "invert"},
+                  {"operation": "levels", "black": 10, "white": 240}]
+    plan = plan_operations(normalize_operations(operations), 160, 120)
+    assert [kind for kind, _ in plan[0].color] == ['tone']
+    image = sample_image()
+    # Separate 8 bit passes round between the curves (and gamma blows that up in
+    # the shadows), the composed table only once at the end: compare with floats
+    values = image / 255
+    for op in normalize_operations(operations):
+        name, args = OPERATIONS[op['operation']].pointwise(op)
+        values = np.clip(TONE_CURVES[name](values, *args), 0, 1)
+    assert max_difference(run_pipeline(image, operations)[FINAL], np.round(values * 255)) <= 1
+
+
+def test_matrix_chain_is_one_matrix():
+    operations = [{"operation": "sepia", "amount": 60},
+                  {"operation": "channelMix", "matrix": [[0, 0, 1], [0, 1, 0], [1, 0, 0]]}]
+    plan = plan_operations(normalize_operations(operations), 160, 120)
+    assert [kind for kind, _ in plan[0].color] == ['matrix']
+    image = sample_image()
+    assert max_difference(run_pipeline(image, operations)[FINAL], sequential(image, operations)) <= 1
+
+
+@pytest.mark.parametrize('operations', [
+    [{"operation": "invert"}, {"operation": "rotate", "degrees": 45}],
+    [{"operation": "brightness", "amount": 50}, {"operation": "rotate", "degrees": 45}],
+    [{"operation": "sepia"}, {"operation": "rotate", "degrees": 30}, {"operation": "gamma", "gamma": 2}],
+    [{"operation": "rotate", "degrees": 45}, {"operation": "invert"}],
+    [{"operation": "invert"}, {"operation": "rotate", "degrees": 20}, {"operation": "grayscale"}],
+], ids=['invert-rotate', 'brightness-rotate', 'sepia-rotate-gamma', 'rotate-invert', 'invert-rotate-gray'])
+def test_color_around_rotate(operations, tiled):
+    image = sample_image()
+    result = run_pipeline(image, operations + [{"operation": "thumbnail"}])
+    expected = sequential(image, operations)
+    final = result[FINAL]
+    assert final.shape == expected.shape
+    # The corners the rotation fills are black before and coloured after the rotate
+    assert max_difference(final[:2, :2], expected[:2, :2]) <= 2
+    inside = (slice(final.shape[0] // 2 - 10, final.shape[0] // 2 + 10),
+              slice(final.shape[1] // 2 - 10, final.shape[1] // 2 + 10))
+    assert max_difference(final[inside], expected[inside]) <= 2
+    thumbnail = result[f'thumbnail_{len(operations)}.png']
+    assert max_difference(thumbnail[:2, :2], expected[:2, :2]) <= 2
+
+
+def test_alpha_and_depth_survive():
+    image = sample_image(channels=4, dtype=np.uint16)
+    final = run_pipeline(image, [{"operation": "invert"}, {"operation": "sepia"}])[FINAL]
+    assert final.dtype == np.uint16
+    assert np.array_equal(final[:, :, 3], image[:, :, 3])
+
+
+def test_grayscale_order():
+    image = sample_image()
+    assert run_pipeline(image, [{"operation": "grayscale"}, {"operation": "sepia"}])[FINAL].ndim == 3
+    assert run_pipeline(image, [{"operation": "sepia"}, {"operation": "grayscale"}])[FINAL].ndim == 2
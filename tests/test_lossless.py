@@ -0,0 +1,61 @@
+import cv2
+import numpy as np
+import pytest
+
+from OpenCV import LosslessJpeg
+from OpenCV.ImageIngest import sniff_image
+from OpenCV.ProcessingService import process_image_sequence
+
+from .helpers import sample_image
+
+OPERATIONS = [
+    [{"operation": "flip", "direction": "horizontal"}],
+    [{"operation": "rotateLeft"}],
+    [{"operation": "rotateRight"}, {"operation": "flip", "direction": "vertical"}],
+    [{"operation": "rotate", "degrees": 180}],
+]
+
+
+def upload():
+    ok, data = cv2.imencode('.jpg', sample_image(64, 48), [cv2.IMWRITE_JPEG_QUALITY, 95])
+    return data.tobytes()
+
+
+def final_image(data, operations, lossless):
+    outputs = process_image_sequence(data, operations, {'lossless': lossless})
+    assert outputs[0][0] == 'final_processed_image.jpeg'
+    return bytes(outputs[0][1])
+
+
+def decoded(data):
+    return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+
+
+def assert_same_picture(a, b):
+    assert a.shape == b.shape
+    assert np.abs(a.astype(np.int64) - b).mean() < 3  # Only the re-encode's loss
+
+
+@pytest.mark.parametrize('operations', OPERATIONS)
+def test_exif_orientation_matches_reencode(operations):
+    data = upload()
+    exif = final_image(data, operations, 'exif')
+    assert sniff_image(exif).orientation != 1
+    assert_same_picture(decoded(exif), decoded(final_image(data, operations, 'off')))
+
+
+@pytest.mark.skipif(LosslessJpeg.JPEGTRAN is None, reason="jpegtran is not installed")
+@pytest.mark.parametrize('operations', OPERATIONS)
+def test_jpegtran_matches_reencode(operations):
+    data = upload()
+    assert_same_picture(decoded(final_image(data, operations, 'auto')), decoded(final_image(data, operations, 'off')))
+
+
+# Anything that is not a pixel permutation goes through the pixel pipeline
+@pytest.mark.parametrize('operations', [
+    [{"operation": "rotateLeft"}, {"operation": "grayscale"}],
+    [{"operation": "rotateLeft"}, {"operation": "invert"}],
+    [{"operation": "rotateLeft"}, {"operation": "thumbnail"}],
+])
+def test_not_a_permutation_is_reencoded(operations):
+    assert sniff_image(final_image(upload(), operations, 'exif')).orientation == 1
@@ -0,0 +1,32 @@
+from OpenCV.NearDuplicate import NearDuplicateIndex
+
+GROUP_A = ('JPEG', 640, 480, 1)
+GROUP_B = ('JPEG', 800, 600, 1)
+
+
+def test_near_hashes_in_the_same_group():
+    index = NearDuplicateIndex(max_distance=4)
+    index.add(0b1011, GROUP_A, 'a')
+    assert index.candidates(0b1011 ^ 0b110, GROUP_A) == [(2, 'a')]
+    assert index.candidates(0b1011, GROUP_B) == []
+    assert index.candidates(0b1011 ^ 0b11111, GROUP_A) == []
+
+
+# The same hash in two groups is two entries, neither overwrites the other
+def test_same_hash_in_two_groups():
+    index = NearDuplicateIndex(max_distance=2)
+    index.add(42, GROUP_A, 'a')
+    index.add(42, GROUP_B, 'b')
+    assert index.candidates(42, GROUP_A) == [(0, 'a')]
+    assert index.candidates(42, GROUP_B) == [(0, 'b')]
+
+
+def test_eviction_drops_tables_and_groups():
+    index = NearDuplicateIndex(max_distance=2, max_entries=2)
+    for value in range(50):
+        index.add(value << 8, ('PNG', value, value, 1), str(value))
+    assert len(index.entries) == 2
+    assert len(index.groups) == 2
+    assert sum(len(bucket) for table in index.tables for bucket in table.values()) == 2 * len(index.tables)
+    assert index.candidates(49 << 8, ('PNG', 49, 49, 1)) == [(0, '49')]
+    assert index.candidates(0, ('PNG', 0, 0, 1)) == []
@@ -0,0 +1,170 @@
+import numpy as np
+import pytest
+
+from OpenCV.ImageProcessor import FlipProcessor, RotateProcessor, GrayscaleProcessor, ResizeProcessor, \
+    ThumbnailProcessor, RotateLeftProcessor, RotateRightProcessor, RenditionProcessor, CropProcessor, SmartCropProcessor, \
+    ToneProcessor, ColorMatrixProcessor, INTERPOLATIONS
+from OpenCV.OperationPlanner import plan_operations
+from OpenCV.OperationRegistry import OPERATIONS, OPERATION_SPECS, normalize_operations
+
+from .helpers import sample_image, run_pipeline, max_difference
+
+FINAL = 'final_processed_image.png'
+
+
+# One op through its standalone processor, the way the API worked before the
+# planner. Returns (image the rest of the sequence works on, extra outputs by name).
+def reference_step(image, op, index):
+    name = op['operation']
+    spec = OPERATIONS[name]
+    if name == 'flip':
+        return FlipProcessor(image, op['flip_code']).process_image().get_image(), {}
+    if name == 'rotate':
+        return RotateProcessor(image, op['degrees'], INTERPOLATIONS[op['interpolation']]).process_image().get_image(), {}
+    if name == 'resize':
+        return ResizeProcessor(image, op['percentage']).process_image().get_image(), {}
+    if name == 'grayscale':
+        return GrayscaleProcessor(image).process_image().get_image(), {}
+    if name == 'rotateLeft':
+        return RotateLeftProcessor(image).process_image().get_image(), {}
+    if name == 'rotateRight':
+        return RotateRightProcessor(image).process_image().get_image(), {}
+    if name == 'thumbnail':
+        return image, {f'thumbnail_{index}.png': ThumbnailProcessor(image).process_image().get_image()}
+    if name == 'renditions':
+        renditions = RenditionProcessor(image, op['sizes'], op['fit']).process_image().get_renditions()
+        return image, {f'rendition_{index}_{w}x{h}.png': rendition for (w, h), rendition in renditions}
+    if name == 'crop':
+        return CropProcessor(image, op['x'], op['y'], op['width'], op['height']).process_image().get_image(), {}
+    if name == 'smartcrop':
+        return SmartCropProcessor(image, op['aspect']).process_image().get_image(), {}
+    if spec.plan == 'tone':
+        return ToneProcessor(image, [spec.pointwise(op)]).process_image().get_image(), {}
+    if spec.plan == 'color_matrix':
+        return ColorMatrixProcessor(image, spec.pointwise(op)).process_image().get_image(), {}
+    raise AssertionError(f"No reference for '{name}', add it here")
+
+
+def reference(image, operations):
+    outputs = {}
+    for index, op in enumerate(normalize_operations(operations)):
+        image, extra = reference_step(image, op, index)
+        outputs.update(extra)
+    outputs[FINAL] = image
+    return outputs
+
+
+# One example per registry entry, with the largest per-pixel error the single warp may
+# have against the standalone processor (0 for pixel permutations). Resampling
+# ops differ in their rounding and in how edges are filled.
+EXAMPLES = {
+    'flip': ({"operation": "flip", "direction": "horizontal"}, 0),
+    'rotate': ({"operation": "rotate", "degrees": 30}, 2),
+    'resize': ({"operation": "resize", "percentage": 50}, 2),
+    'grayscale': ({"operation": "grayscale"}, 0),
+    'thumbnail': ({"operation": "thumbnail"}, 2),
+    'rotateLeft': ({"operation": "rotateLeft"}, 0),
+    'rotateRight': ({"operation": "rotateRight"}, 0),
+    # The planner may render the pyramid's frame at half size first
+    'renditions': ({"operation": "renditions", "sizes": [64, [48, 32]], "fit": "crop"}, 4),
+    'crop': ({"operation": "crop", "x": 20, "y": 10, "width": 100, "height": 80}, 0),
+    'smartcrop': ({"operation": "smartcrop", "aspect": "1:1"}, 0),
+    'brightness': ({"operation": "brightness", "amount": 20}, 0),
+    'contrast': ({"operation": "contrast", "amount": -30}, 0),
+    'gamma': ({"operation": "gamma", "gamma": 1.8}, 0),
+    'levels': ({"operation": "levels", "black": 20, "white": 220, "gamma": 1.2}, 0),
+    'invert': ({"operation": "invert"}, 0),
+    'sepia': ({"operation": "sepia", "amount": 80}, 0),
+    'channelMix': ({"operation": "channelMix", "matrix": [[0.5, 0.5, 0], [0, 1, 0], [0, 0.2, 0.8]]}, 0),
+}
+
+# Flips, quarter turns and crops only: the composed matrix is still an exact
+# permutation of a sub-rectangle
+PERMUTATIONS = [
+    {"operation": "flip", "direction": "vertical"}, {"operation": "rotateLeft"},
+    {"operation": "crop", "x": 5, "y": 7, "width": 60, "height": 90},
+    {"operation": "flip", "direction": "horizontal"}, {"operation": "rotateRight"},
+    {"operation": "rotateRight"},
+]
+
+
+def assert_outputs_match(result, expected, tolerance):
+    assert set(result) == set(expected)
+    for name, image in expected.items():
+        assert result[name].shape == image.shape, name
+        assert max_difference(result[name], image) <= tolerance, name
+
+
+# A new registry entry needs an example here and a branch in reference_step
+def test_every_operation_has_an_example():
+    assert set(EXAMPLES) == {spec.name for spec in OPERATION_SPECS}
+
+
+@pytest.mark.parametrize('name', sorted(EXAMPLES))
+def test_single_operation_parity(name):
+    op, tolerance = EXAMPLES[name]
+    image = sample_image()
+    assert_outputs_match(run_pipeline(image, [op]), reference(image, [op]), tolerance)
+
+
+@pytest.mark.parametrize('channels, dtype', [(1, np.uint8), (3, np.uint8), (4, np.uint16)])
+def test_permutation_chain_is_exact(channels, dtype):
+    image = sample_image(channels=channels, dtype=dtype)
+    assert_outputs_match(run_pipeline(image, PERMUTATIONS), reference(image, PERMUTATIONS), 0)
+
+
+# Right angles in any form are exact quarter turns, 0 and 360 change nothing
+@pytest.mark.parametrize('degrees', [90, 180, 270, -90, -270, 360, 0, 720])
+def test_right_angle_rotates_are_exact(degrees):
+    image = sample_image()
+    operations = [{"operation": "rotate", "degrees": degrees}]
+    assert_outputs_match(run_pipeline(image, operations), reference(image, operations), 0)
+    assert not plan_operations(normalize_operations(operations), 160, 120)[0].constant_border
+
+
+@pytest.mark.parametrize('interpolation', ['nearest', 'linear', 'cubic', 'lanczos'])
+def test_rotate_interpolation_tiers(interpolation):
+    image = sample_image()
+    operations = [{"operation": "rotate", "degrees": 25, "interpolation": interpolation}]
+    assert_outputs_match(run_pipeline(image, operations), reference(image, operations), 2)
+
+
+# One warp serves every rotate, at the best tier any of them asked for
+def test_best_tier_wins():
+    operations = [{"operation": "rotate", "degrees": 10, "interpolation": "cubic"},
+                  {"operation": "rotate", "degrees": 10, "interpolation": "nearest"}]
+    final = plan_operations(normalize_operations(operations), 160, 120)[0]
+    assert final.interpolation == INTERPOLATIONS['cubic']
+
+
+# Pairs that undo each other drop out of the composed matrix
+def test_cancelling_pairs_compose_to_identity():
+    operations = [{"operation": "rotateLeft"}, {"operation": "rotateRight"},
+                  {"operation": "flip", "direction": "vertical"}, {"operation": "flip", "direction": "vertical"}]
+    final = plan_operations(normalize_operations(operations), 160, 120)[0]
+    assert np.allclose(final.matrix, [[1, 0, 0], [0, 1, 0]])
+    assert final.size == (160, 120)
+
+
+# Renditions sized off a turned frame
+@pytest.mark.parametrize('fit', ['letterbox', 'crop', 'fit'])
+def test_renditions_after_geometry(fit):
+    operations = [{"operation": "rotateLeft"}, {"operation": "renditions", "sizes": [100, [80, 40]], "fit": fit},
+                  {"operation": "flip", "direction": "horizontal"}]
+    image = sample_image()
+    assert_outputs_match(run_pipeline(image, operations), reference(image, operations), 4)
+
+
+# A mixed sequence: the planner warps once per output where the reference
+# resamples at every step, so only the shapes and the overall picture must agree
+def test_mixed_sequence_parity():
+    operations = [{"operation": "flip", "direction": "horizontal"}, {"operation": "rotate", "degrees": 20},
+                  {"operation": "grayscale"}, {"operation": "thumbnail"}, {"operation": "resize", "percentage": 150},
+                  {"operation": "rotateLeft"}, {"operation": "gamma", "gamma": 1.5}]
+    image = sample_image()
+    result = run_pipeline(image, operations)
+    expected = reference(image, operations)
+    assert set(result) == set(expected)
+    for name, image in expected.items():
+        assert result[name].shape == image.shape, name
+        assert np.abs(result[name].astype(np.int64) - image).mean() < 2, name
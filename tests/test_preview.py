@@ -0,0 +1,58 @@
+import io
+import json
+import time
+
+import cv2
+import pytest
+
+import main
+from OpenCV import Executor
+from OpenCV.JobQueue import JobQueue
+
+from .helpers import sample_image
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    queue = JobQueue(str(tmp_path), main.run_job, small_workers=1, large_workers=0)
+    monkeypatch.setattr(main, 'job_queue', queue)
+    monkeypatch.setattr(main, 'executor', Executor.InlineExecutor())
+    yield main.app.test_client()
+    main.executor.shutdown()
+    queue.stop()
+
+
+def post_preview(client):
+    ok, data = cv2.imencode('.png', sample_image(640, 480))
+    operations = [{"operation": "rotate", "degrees": 30}, {"operation": "thumbnail"}]
+    return client.post('/process_image_sequence', data={
+        'image': (io.BytesIO(data.tobytes()), 'image.png'), 'operations': json.dumps(operations), 'preview': '64'})
+
+
+def queued_jobs():
+    return sum(sum(lanes.values()) for key, lanes in main.job_queue.get_stats().items() if key != 'running_here')
+
+
+def test_preview_queues_full_job(client):
+    response = post_preview(client)
+    assert response.status_code == 200
+    assert response.headers['X-Job-Url'].endswith(response.headers['X-Job-Id'])
+    assert queued_jobs() == 1
+
+
+# The inline executor runs on the request thread, previews must still give up in time
+def test_inline_preview_timeout_queues_nothing(client, monkeypatch):
+    process = Executor.process_image_sequence
+
+    def slow(*args, **kwargs):
+        time.sleep(0.5)
+        return process(*args, **kwargs)
+
+    monkeypatch.setattr(Executor, 'process_image_sequence', slow)
+    monkeypatch.setattr(main, 'PREVIEW_TIMEOUT', 0.05)
+    started = time.perf_counter()
+    response = post_preview(client)
+    assert response.status_code == 504
+    assert time.perf_counter() - started < 0.4
+    assert 'X-Job-Id' not in response.headers
+    assert queued_jobs() == 0
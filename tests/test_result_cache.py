@@ -0,0 +1,27 @@
+import pytest
+
+from OpenCV.ResultCache import image_digest, make_digest_cache_key
+
+DIGEST = image_digest(b'image')
+
+
+# Op lists that render the same thing share a key
+@pytest.mark.parametrize('a, b', [
+    ([{"operation": "rotate", "degrees": 360}], [{"operation": "rotate", "degrees": 0}]),
+    ([{"operation": "rotate", "degrees": -90}], [{"operation": "rotate", "degrees": 270}]),
+    ([{"operation": "rotate", "degrees": 30}], [{"operation": "rotate", "degrees": 30, "interpolation": "linear"}]),
+    ([{"operation": "sepia"}], [{"operation": "sepia", "amount": 100}]),
+    ([{"operation": "resize", "percentage": 50.0}], [{"operation": "resize", "percentage": 50}]),
+    ([{"operation": "smartcrop", "aspect": "16:9"}], [{"operation": "smartcrop", "aspect": [16, 9]}]),
+], ids=['full-turn', 'negative', 'default-interpolation', 'default-amount', 'float', 'aspect'])
+def test_equivalent_operations_share_a_key(a, b):
+    assert make_digest_cache_key(DIGEST, a) == make_digest_cache_key(DIGEST, b)
+
+
+@pytest.mark.parametrize('a, b, extra_a, extra_b', [
+    ([{"operation": "rotate", "degrees": 90}], [{"operation": "rotate", "degrees": 270}], (), ()),
+    ([{"operation": "rotate", "degrees": 30}], [{"operation": "rotate", "degrees": 30, "interpolation": "cubic"}], (), ()),
+    ([{"operation": "flip", "direction": "horizontal"}], [{"operation": "flip", "direction": "horizontal"}], (6,), (9,)),
+], ids=['angle', 'interpolation', 'compression'])
+def test_different_results_get_different_keys(a, b, extra_a, extra_b):
+    assert make_digest_cache_key(DIGEST, a, *extra_a) != make_digest_cache_key(DIGEST, b, *extra_b)
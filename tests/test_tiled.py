@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from OpenCV import ProcessingService
+
+from .helpers import sample_image, run_pipeline, max_difference
+
+# Each tile's warp is the same matrix shifted to the tile, and warpAffine rounds
+# coordinates to 1/32 pixel, so a tile can land a hair off the whole-frame warp.
+# That is a level or two in 8 bit units, more for Lanczos on the sharp edge of a
+# rotation where its kernel rings.
+CASES = [
+    ([{"operation": "rotate", "degrees": 33}], 2),
+    ([{"operation": "resize", "percentage": 60}, {"operation": "flip", "direction": "vertical"}], 2),
+    ([{"operation": "resize", "percentage": 140}, {"operation": "rotateLeft"}], 2),
+    ([{"operation": "crop", "x": 30, "y": 20, "width": 200, "height": 150}, {"operation": "rotateLeft"}], 0),
+    ([{"operation": "grayscale"}, {"operation": "rotate", "degrees": 45}], 2),
+    ([{"operation": "brightness", "amount": 30}, {"operation": "rotate", "degrees": 15}, {"operation": "sepia"}], 2),
+    ([{"operation": "rotate", "degrees": 10, "interpolation": "lanczos"},
+      {"operation": "resize", "percentage": 140}], 12),
+]
+CASE_IDS = ['rotate', 'downscale-flip', 'upscale-turn', 'crop-turn', 'gray-rotate', 'color-rotate', 'lanczos-upscale']
+FORMATS = [(3, np.uint8), (1, np.uint8), (4, np.uint16)]
+
+
+def render(image, operations, monkeypatch, spill=False):
+    monkeypatch.setattr(ProcessingService, 'TILED_OUTPUT_PIXELS', 1)
+    monkeypatch.setattr(ProcessingService, 'TILE_SIZE', 64)
+    if spill:
+        monkeypatch.setattr(ProcessingService, 'SPILL_OUTPUT_PIXELS', 1)
+    return run_pipeline(image, operations)['final_processed_image.png']
+
+
+@pytest.mark.parametrize('operations, tolerance', CASES, ids=CASE_IDS)
+@pytest.mark.parametrize('channels, dtype', FORMATS)
+def test_tiled_matches_whole_frame(operations, tolerance, channels, dtype, monkeypatch):
+    image = sample_image(320, 240, channels, dtype)
+    whole = run_pipeline(image, operations)['final_processed_image.png']
+    tiled = render(image, operations, monkeypatch)
+    assert max_difference(whole, tiled) <= tolerance * (np.iinfo(dtype).max // 255)
+
+
+def test_spilled_output_matches(monkeypatch):
+    image = sample_image(320, 240)
+    operations = [{"operation": "rotate", "degrees": 20}]
+    whole = run_pipeline(image, operations)['final_processed_image.png']
+    assert max_difference(whole, render(image, operations, monkeypatch, spill=True)) <= 2
@@ -0,0 +1,54 @@
+import io
+import json
+
+import cv2
+import pytest
+from werkzeug.test import EnvironBuilder, run_wsgi_app
+
+import main
+from OpenCV import Executor
+from OpenCV.JobQueue import JobQueue
+
+from .helpers import sample_image
+
+OPERATIONS = json.dumps([{"operation": "flip", "direction": "horizontal"}])
+
+
+@pytest.fixture(autouse=True)
+def inline_executor(monkeypatch):
+    monkeypatch.setattr(main, 'executor', Executor.InlineExecutor())
+    yield
+    main.executor.shutdown()
+
+
+def png_file(name='image.png'):
+    ok, data = cv2.imencode('.png', sample_image())
+    return io.BytesIO(data.tobytes()), name
+
+
+# A chunked upload has no Content-Length. The test client always sets one, so the
+# request goes to the WSGI app directly.
+def post_chunked(path, data):
+    environ = EnvironBuilder(path=path, method='POST', data=data).get_environ()
+    del environ['CONTENT_LENGTH']
+    environ['HTTP_TRANSFER_ENCODING'] = 'chunked'
+    environ['wsgi.input_terminated'] = True
+    body, status, headers = run_wsgi_app(main.app, environ, buffered=True)
+    return int(status.split()[0]), b''.join(body)
+
+
+def test_chunked_batch_is_processed():
+    status, body = post_chunked('/process_batch', {'images': png_file(), 'operations': OPERATIONS})
+    assert status == 200
+    assert body.startswith(b'PK')
+
+
+def test_chunked_job_is_queued(tmp_path, monkeypatch):
+    queue = JobQueue(str(tmp_path), main.run_job, small_workers=1, large_workers=0)
+    monkeypatch.setattr(main, 'job_queue', queue)
+    try:
+        status, body = post_chunked('/jobs', {'image': png_file(), 'operations': OPERATIONS})
+    finally:
+        queue.stop()
+    assert status == 202
+    assert json.loads(body)['status'] == 'queued'